@@ -0,0 +1,402 @@
+"""
+Asynchronous serving mode.
+
+MJPEG streams and snapshots are served straight from the shared frame cache
+by coroutines on a single event loop, so an open /video_feed costs a
+coroutine and its socket buffers instead of an OS thread. Every other route
+is handed to the Flask app unchanged, which keeps login, templates and the
+security headers exactly as they are; it runs on a bounded thread pool, one
+worker per request, like a threaded WSGI server. WebSocket connections
+are refused (Socket.IO clients fall back to long-polling).
+
+    python asgi_app.py                       # TLS on :443, like web_camera_stream.py
+    uvicorn asgi_app:application --ssl-certfile ... --ssl-keyfile ...
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs, urlencode
+
+from asgiref.wsgi import WsgiToAsgiInstance
+
+from camera_hub import get_hub
+from frame_cache import DEFAULT_QUALITY, QUALITY_PROFILES
+from mosaic import close_mosaic, open_mosaic, parse_mosaic_args
+from snapshots import parse_snapshot_args
+from web_camera_stream import (app, load_camera_settings, recording_settings,
+                               start_background_services, STREAM_FPS_OPTIONS)
+
+logger = logging.getLogger(__name__)
+
+VIDEO_FEED_PATH = re.compile(r'^/video_feed/(\d+)$')
+SNAPSHOT_PATH = re.compile(r'^/camera/(\d+)/snapshot\.jpg$')
+MOSAIC_PATH = re.compile(r'^/video_feed/mosaic$')
+
+# Seconds to wait for a frame before checking whether the camera is still up
+FRAME_TIMEOUT = 5.0
+
+# Threads Flask requests run on; each long response (a recording download,
+# a Socket.IO long-poll) holds one until it finishes
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 32))
+
+
+class ThreadPoolWsgi:
+    """
+    Serves a WSGI app from ASGI the way a threaded WSGI server would: the app
+    and each step of its response iterator run on a worker from a bounded
+    pool, and the response stops (closing the iterator) when the client goes
+    away. asgiref's WsgiToAsgi runs every request on one shared thread, so a
+    single streaming response would hold up every other Flask route.
+    """
+
+    _done = object()
+
+    def __init__(self, wsgi_application, threads=WSGI_THREADS):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+
+            # Reuse asgiref's environ and start_response translation
+            adapter = WsgiToAsgiInstance(self.wsgi_application)
+            adapter.scope = scope
+            try:
+                environ = adapter.build_environ(scope, body)
+            except ValueError as e:
+                return await send_simple(send, 400, str(e).encode())
+
+            response = await loop.run_in_executor(
+                self.executor, self.wsgi_application, environ, adapter.start_response)
+            iterator = iter(response)
+            disconnected = asyncio.Event()
+            watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+            try:
+                started = False
+                while not disconnected.is_set():
+                    chunk = await loop.run_in_executor(self.executor, next, iterator, self._done)
+                    if chunk is self._done or disconnected.is_set():
+                        break
+                    if not started:
+                        started = True
+                        await send(adapter.response_start)
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                if not disconnected.is_set():
+                    if not started:
+                        await send(adapter.response_start)
+                    await send({'type': 'http.response.body', 'body': b''})
+            finally:
+                watcher.cancel()
+                if hasattr(response, 'close'):
+                    # Runs generator cleanup, e.g. detaching a viewer from its camera
+                    await loop.run_in_executor(self.executor, response.close)
+
+
+flask_application = ThreadPoolWsgi(app)
+
+
+def security_headers():
+    """
+    The headers Flask-Talisman adds to every Flask response (HSTS, CSP,
+    X-Frame-Options, nosniff, ...), taken from an empty response run through
+    the app's after-request hooks, so the native routes send the same ones
+    """
+    with app.test_request_context('/', base_url='https://localhost'):
+        response = app.process_response(app.response_class())
+    return [(name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in response.headers.items()
+            if name.lower() not in ('content-type', 'content-length')]
+
+
+SECURITY_HEADERS = security_headers()
+
+
+class FrameBroadcast:
+    """
+    Wakes every coroutine waiting on a camera when its hub (or a mosaic)
+    publishes a frame. One future is shared by all waiters and replaced on
+    each frame, so the cost per frame does not depend on the number of viewers.
+    """
+
+    def __init__(self, source, loop):
+        self.source = source
+        self.loop = loop
+        self._future = loop.create_future()
+        source.add_frame_notifier(self._notify_threadsafe)
+
+    def close(self):
+        self.source.remove_frame_notifier(self._notify_threadsafe)
+
+    def _notify_threadsafe(self, seq):
+        # Called on the hub's decoder thread or the mosaic's compositor thread
+        self.loop.call_soon_threadsafe(self._publish, seq)
+
+    def _publish(self, seq):
+        future, self._future = self._future, self.loop.create_future()
+        future.set_result(seq)
+
+    async def wait(self, timeout):
+        """Wait for the next frame; returns False on timeout"""
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+_broadcasts = {}
+
+
+def get_broadcast(hub):
+    broadcast = _broadcasts.get(hub.camera_id)
+    if broadcast is None or broadcast.source is not hub:
+        broadcast = FrameBroadcast(hub, asyncio.get_running_loop())
+        _broadcasts[hub.camera_id] = broadcast
+    return broadcast
+
+
+def is_authenticated(scope):
+    """Check the Flask-Login session carried in the Flask session cookie"""
+    cookie_header = b''
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookie_header = value
+            break
+    cookies = SimpleCookie(cookie_header.decode('latin-1'))
+    morsel = cookies.get(app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return False
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        session = serializer.loads(
+            morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return False
+    return '_user_id' in session
+
+
+def login_location(scope):
+    """Login URL that returns to the requested page, as Flask-Login's login_required sends"""
+    target = scope['path']
+    if scope.get('query_string'):
+        target += '?' + scope['query_string'].decode('latin-1')
+    return f"/login?{urlencode({'next': target})}".encode()
+
+
+async def send_simple(send, status, body, content_type=b'text/plain; charset=utf-8', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type),
+                    (b'content-length', str(len(body)).encode()), *headers, *SECURITY_HEADERS],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+async def find_camera(camera_id):
+    cameras = await asyncio.get_running_loop().run_in_executor(None, load_camera_settings)
+    if camera_id < len(cameras):
+        return cameras[camera_id]
+    return None
+
+
+async def video_feed(scope, receive, send, camera_id):
+    """multipart/x-mixed-replace stream fed from the shared frame cache"""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    quality = query.get('quality', [DEFAULT_QUALITY])[0]
+    if quality not in QUALITY_PROFILES:
+        return await send_simple(send, 400, b'Unknown quality')
+    try:
+        max_fps = int(query.get('fps', [recording_settings['fps']])[0])
+    except ValueError:
+        max_fps = None
+    if max_fps not in STREAM_FPS_OPTIONS:
+        return await send_simple(send, 400, b'Unsupported fps')
+
+    camera = await find_camera(camera_id)
+    if camera is None:
+        return await send_simple(send, 404, b'Camera not found')
+
+    hub = get_hub(camera_id, camera)
+    broadcast = get_broadcast(hub)
+    client = scope.get('client')
+    subscription = hub.subscribe(quality, max_fps, client[0] if client else None)
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame'),
+                        (b'cache-control', b'no-cache, no-store'), *SECURITY_HEADERS],
+        })
+        while not disconnected.is_set():
+            delay = subscription.pace_delay()
+            if delay:
+                await asyncio.sleep(delay)
+            encoded = subscription.take_encoded()
+            if encoded is None:
+                if await broadcast.wait(FRAME_TIMEOUT):
+                    continue
+                if not hub.is_running:
+                    logger.error(f"No frames from {hub.name} (stream ended?)")
+                    break
+                # The hub is reconnecting: repeat the last good frame, as the threaded path does
+                encoded = hub.frame_cache.get(quality)
+                if encoded is None:
+                    continue
+            # The server only returns once the socket has drained, so a slow
+            # client just picks up a newer frame on its next turn
+            await send({'type': 'http.response.body', 'body': encoded.payload, 'more_body': True})
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        subscription.close()
+
+
+async def mosaic_feed(scope, receive, send):
+    """multipart/x-mixed-replace stream of several cameras, fed from a shared mosaic compositor"""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    cameras = await asyncio.get_running_loop().run_in_executor(None, load_camera_settings)
+    try:
+        layout = parse_mosaic_args({name: values[0] for name, values in query.items()}, len(cameras))
+    except ValueError as e:
+        return await send_simple(send, 400, str(e).encode())
+
+    mosaic = open_mosaic(layout, cameras)
+    broadcast = FrameBroadcast(mosaic, asyncio.get_running_loop())
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame'),
+                        (b'cache-control', b'no-cache, no-store'), *SECURITY_HEADERS],
+        })
+        last_seq = 0
+        while not disconnected.is_set():
+            encoded = mosaic.latest()
+            if encoded is None or encoded.seq <= last_seq:
+                if await broadcast.wait(FRAME_TIMEOUT):
+                    continue
+                # No tile changed: repeat the frame so the stream stays open
+                encoded = mosaic.latest()
+                if encoded is None:
+                    continue
+            last_seq = encoded.seq
+            await send({'type': 'http.response.body', 'body': encoded.payload, 'more_body': True})
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        broadcast.close()
+        close_mosaic(mosaic)
+
+
+async def snapshot(scope, receive, send, camera_id):
+    """The latest frame as a JPEG, from memory when the camera's pipeline is running"""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        width, quality, max_age = parse_snapshot_args({name: values[0] for name, values in query.items()})
+    except ValueError as e:
+        return await send_simple(send, 400, str(e).encode())
+
+    camera = await find_camera(camera_id)
+    if camera is None:
+        return await send_simple(send, 404, b'Camera not found')
+
+    hub = get_hub(camera_id, camera)
+    # Answers at once from memory; only a camera that isn't running blocks for a keyframe
+    snapshot = await asyncio.get_running_loop().run_in_executor(
+        None, hub.snapshots.get, width, quality, max_age)
+    if snapshot is None:
+        return await send_simple(send, 503, b'No frame available')
+
+    etag = f'"{snapshot.etag}"'.encode()
+    cache_control = f'private, max-age={int(max_age)}' if int(max_age) else 'private, no-cache'
+    headers = [(b'etag', etag), (b'cache-control', cache_control.encode())]
+    for name, value in scope.get('headers', []):
+        if name == b'if-none-match':
+            tags = [tag.strip() for tag in value.split(b',')]
+            if etag in tags or b'*' in tags or b'W/' + etag in tags:
+                return await send_simple(send, 304, b'', headers=headers)
+    await send_simple(send, 200, snapshot.jpeg, b'image/jpeg', headers)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(None, start_background_services)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            flask_application.executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] == 'websocket':
+        # The Flask app has no WebSocket transport in this mode; closing
+        # before accepting answers the handshake with 403
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 1000})
+
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        for pattern, handler in ((VIDEO_FEED_PATH, video_feed), (SNAPSHOT_PATH, snapshot),
+                                 (MOSAIC_PATH, mosaic_feed)):
+            match = pattern.match(scope['path'])
+            if match:
+                if not is_authenticated(scope):
+                    return await send_simple(send, 302, b'', headers=[(b'location', login_location(scope))])
+                return await handler(scope, receive, send, *(int(group) for group in match.groups()))
+
+    return await flask_application(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    try:
+        logger.info("Starting asynchronous web camera stream server...")
+        uvicorn.run(
+            application,
+            host='0.0.0.0',
+            port=443,
+            ssl_certfile=os.environ.get('SSL_CERT_PATH', 'certs/cert.pem'),
+            ssl_keyfile=os.environ.get('SSL_KEY_PATH', 'certs/key.pem'),
+            log_level=os.environ.get('LOG_LEVEL', 'DEBUG').lower()
+        )
+    except Exception as e:
+        logger.error(f"Failed to start server: {str(e)}", exc_info=True)
+        sys.exit(1)
@@ -0,0 +1,153 @@
+"""
+Rate limiter latency benchmark.
+
+Runs rate-limit checks from several threads against an in-process Redis
+stand-in that adds a fixed round-trip time to every call, and reports the
+latency each check adds to a request. The per-call GET + SETEX/INCR limiter
+this replaced is measured against the same stand-in as a baseline, and the
+RateLimiter is also run with Redis down to show the local fallback.
+
+    python benchmarks/bench_rate_limit.py --rtt-ms 0.5 --clients 50 --checks 20000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rate_limiter import RateLimiter  # noqa: E402
+
+
+class FakeRedis:
+    """
+    Just enough of redis.Redis for the limiters, with a simulated network
+    round-trip per call. Commands run under one lock, like Redis' single
+    thread; the sliding-window script is executed as its Python equivalent.
+    """
+
+    def __init__(self, rtt, down=False):
+        self.rtt = rtt
+        self.down = down
+        self.calls = 0
+        self.data = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        if self.down:
+            raise redis.ConnectionError('Connection refused')
+        time.sleep(self.rtt)
+        with self._lock:
+            self.calls += 1
+
+    def get(self, key):
+        self._round_trip()
+        return self.data.get(key)
+
+    def setex(self, key, seconds, value):
+        self._round_trip()
+        self.data[key] = value
+
+    def incr(self, key):
+        self._round_trip()
+        with self._lock:
+            self.data[key] = int(self.data.get(key, 0)) + 1
+
+    def register_script(self, script):
+        def run(keys, args):
+            self._round_trip()
+            limit, wanted, permille, window_ms = (int(arg) for arg in args)
+            with self._lock:
+                current = int(self.data.get(keys[0], 0))
+                previous = int(self.data.get(keys[1], 0))
+                granted = min(wanted, limit - int(previous * (1 - permille / 1000)) - current)
+                if granted <= 0:
+                    return 0
+                self.data[keys[0]] = current + granted
+                return granted
+        return run
+
+
+def legacy_check(client, key, limit):
+    """The original limiter: GET, then SETEX or INCR"""
+    count = client.get(key)
+    if count is None:
+        client.setex(key, 60, 1)
+    elif int(count) >= limit:
+        return False
+    else:
+        client.incr(key)
+    return True
+
+
+def run(check, clients, checks):
+    latencies = []
+    allowed = []
+    lock = threading.Lock()
+
+    def worker(client_id):
+        local = []
+        passed = 0
+        for _ in range(checks // clients):
+            start = time.perf_counter()
+            passed += check(f'10.0.0.{client_id % 4}')
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+            allowed.append(passed)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'checks': len(latencies),
+        'allowed': sum(allowed),
+        'mean_us': round(statistics.mean(latencies) * 1e6, 1),
+        'p50_us': round(latencies[len(latencies) // 2] * 1e6, 1),
+        'p99_us': round(latencies[int(len(latencies) * 0.99)] * 1e6, 1),
+        'checks_per_second': round(len(latencies) / wall),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rtt-ms', type=float, default=0.5, help='simulated Redis round-trip time')
+    parser.add_argument('--clients', type=int, default=50, help='concurrent request threads')
+    parser.add_argument('--checks', type=int, default=20000)
+    parser.add_argument('--limit', type=int, default=60000, help='requests per minute per client IP')
+    args = parser.parse_args()
+    rtt = args.rtt_ms / 1000
+
+    results = {}
+
+    fake = FakeRedis(rtt)
+    results['legacy_get_incr'] = run(lambda key: legacy_check(fake, f'rate_limit:{key}:bench', args.limit),
+                                     args.clients, args.checks)
+    results['legacy_get_incr']['redis_calls_per_check'] = round(fake.calls / args.checks, 3)
+
+    fake = FakeRedis(rtt)
+    limiter = RateLimiter(args.limit, 60.0, name='bench', client=fake)
+    results['sliding_window_leased'] = run(limiter.allow, args.clients, args.checks)
+    results['sliding_window_leased']['redis_calls_per_check'] = round(fake.calls / args.checks, 3)
+
+    limiter = RateLimiter(args.limit, 60.0, name='bench', client=FakeRedis(rtt, down=True))
+    results['redis_down_local_fallback'] = run(limiter.allow, args.clients, args.checks)
+
+    print(json.dumps({'rtt_ms': args.rtt_ms, 'clients': args.clients, 'limit_per_minute': args.limit,
+                      'results': results}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+"""
+End-to-end streaming benchmark.
+
+Runs the real capture, decode, encode and delivery pipeline against local
+synthetic cameras: a test-pattern clip is rendered once with ffmpeg and each
+camera's hub reads it at its native frame rate, as it would an RTSP stream,
+so no real camera is needed. Viewers are driven through
+CameraStream.get_video_stream and recorders through CameraRecorder. The
+viewer count is stepped up until delivery falls behind.
+
+Each step reports CPU per published frame (this process and its ffmpeg
+children), end-to-end latency percentiles (packet arrival to frame handed to
+a viewer, from the hubs' delivery latency histograms), process memory per
+added viewer, and delivered fps. The largest step that kept up is reported
+as the maximum sustainable viewer count. Results are JSON; write them with
+--output and pass an earlier file to --compare to get the change per metric.
+
+    python benchmarks/bench_streaming.py --cameras 2 --recorders 1 --viewers 1,4,16,64 --output base.json
+    python benchmarks/bench_streaming.py --cameras 2 --recorders 1 --viewers 1,4,16,64 --compare base.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Seconds of clip rendered beyond the planned run, so the source never ends early
+CLIP_MARGIN = 30.0
+
+# Lowest fraction of the target frame rate every viewer must get for a step to count as sustained
+SUSTAINED_FPS_RATIO = 0.9
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def render_clip(path, width, height, fps, seconds, ffmpeg_bin):
+    """Render the synthetic camera: a moving test pattern, H.264 with a 2 s GOP and no B-frames"""
+    cmd = [ffmpeg_bin, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+           '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}', '-t', f'{seconds:.0f}',
+           '-c:v', 'libx264', '-preset', 'veryfast', '-tune', 'zerolatency', '-bf', '0',
+           '-g', str(fps * 2), '-pix_fmt', 'yuv420p', path]
+    subprocess.run(cmd, check=True)
+
+
+def children_cpu():
+    """:return: CPU seconds of this process's running and exited child processes"""
+    times = os.times()
+    total = times.children_user + times.children_system
+    pid = str(os.getpid())
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return total
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # Fields after the parenthesised command name; ppid is the second
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if fields[1] == pid:
+            total += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return total
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Viewer:
+    """One simulated MJPEG client reading a CameraStream as fast as it is paced"""
+
+    def __init__(self, camera_stream):
+        self.camera_stream = camera_stream
+        self.frames = 0
+        self.bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        stream = self.camera_stream.get_video_stream()
+        try:
+            for payload in stream:
+                self.frames += 1
+                self.bytes += len(payload)
+                if self._stop.is_set():
+                    break
+        finally:
+            stream.close()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=10.0):
+        self._thread.join(timeout)
+
+
+def snapshot(hubs, viewers):
+    """Cumulative counters at one instant; steps are measured as differences of two"""
+    histograms = [hub.metrics.delivery_latency.snapshot() for hub in hubs]
+    buckets = [sum(counts) for counts in zip(*[histogram[2] for histogram in histograms])]
+    return {
+        'time': time.monotonic(),
+        'cpu': time.process_time() + children_cpu(),
+        'published': sum(hub.metrics.frames_published.value for hub in hubs),
+        'dropped': sum(hub.metrics.frames_dropped.value for hub in hubs),
+        'decoder_dropped': sum(hub.metrics.decoder_dropped.value for hub in hubs),
+        'latency': (sum(h[0] for h in histograms), sum(h[1] for h in histograms), buckets),
+        'viewer_frames': [viewer.frames for viewer in viewers],
+        'rss': rss_bytes(),
+    }
+
+
+def run_step(count, hubs, camera_settings, args, target_fps, previous_rss):
+    from metrics import Histogram
+    from web_camera_stream import CameraStream
+
+    viewers = [
+        Viewer(CameraStream(i % len(hubs), camera_settings[i % len(hubs)], args.quality, args.fps,
+                            client=f'bench-{i}')).start()
+        for i in range(count)
+    ]
+    try:
+        time.sleep(args.warmup)
+        before = snapshot(hubs, viewers)
+        time.sleep(args.seconds)
+        after = snapshot(hubs, viewers)
+    finally:
+        for viewer in viewers:
+            viewer.stop()
+        for viewer in viewers:
+            viewer.join()
+
+    elapsed = after['time'] - before['time']
+    cpu = after['cpu'] - before['cpu']
+    published = after['published'] - before['published']
+    viewer_fps = [(a - b) / elapsed for a, b in zip(after['viewer_frames'], before['viewer_frames'])]
+    delivered = sum(a - b for a, b in zip(after['viewer_frames'], before['viewer_frames']))
+    latency = (after['latency'][0] - before['latency'][0], after['latency'][1] - before['latency'][1],
+               [a - b for a, b in zip(after['latency'][2], before['latency'][2])])
+    histogram = Histogram()
+
+    def percentile_ms(q):
+        value = histogram.quantile(q, latency)
+        return round(value * 1000, 1) if value is not None else None
+
+    p95 = percentile_ms(0.95)
+    result = {
+        'viewers': count,
+        'seconds': round(elapsed, 2),
+        'cpu_cores': round(cpu / elapsed, 3),
+        'published_fps': round(published / elapsed, 1),
+        'cpu_ms_per_published_frame': round(cpu / published * 1000, 3) if published else None,
+        'cpu_ms_per_delivered_frame': round(cpu / delivered * 1000, 3) if delivered else None,
+        'viewer_fps_min': round(min(viewer_fps), 1),
+        'viewer_fps_avg': round(sum(viewer_fps) / len(viewer_fps), 1),
+        'latency_ms': {'avg': round(latency[0] / latency[1] * 1000, 1) if latency[1] else None,
+                       'p50': percentile_ms(0.5), 'p95': p95, 'p99': percentile_ms(0.99)},
+        'frames_dropped': after['dropped'] - before['dropped'],
+        'decoder_dropped': after['decoder_dropped'] - before['decoder_dropped'],
+        'rss_mb': round(after['rss'] / 1e6, 1),
+        'rss_kb_per_added_viewer': None,
+    }
+    if previous_rss is not None:
+        rss, viewers_before = previous_rss
+        result['rss_kb_per_added_viewer'] = round((after['rss'] - rss) / 1e3 / (count - viewers_before), 1)
+    result['sustained'] = (min(viewer_fps) >= SUSTAINED_FPS_RATIO * target_fps
+                           and (p95 is None or p95 <= args.max_latency_ms))
+    return result
+
+
+def compare(results, baseline):
+    """:return: Per-step change of the headline metrics against an earlier run"""
+    def change(before, after):
+        if before is None or after is None:
+            return {'before': before, 'after': after}
+        return {'before': before, 'after': after,
+                'change_pct': round((after - before) / before * 100, 1) if before else None}
+
+    baseline_steps = {step['viewers']: step for step in baseline.get('steps', [])}
+    steps = []
+    for step in results['steps']:
+        old = baseline_steps.get(step['viewers'])
+        if old is None:
+            continue
+        steps.append({
+            'viewers': step['viewers'],
+            'cpu_ms_per_published_frame': change(old['cpu_ms_per_published_frame'],
+                                                 step['cpu_ms_per_published_frame']),
+            'cpu_cores': change(old['cpu_cores'], step['cpu_cores']),
+            'latency_p50_ms': change(old['latency_ms']['p50'], step['latency_ms']['p50']),
+            'latency_p95_ms': change(old['latency_ms']['p95'], step['latency_ms']['p95']),
+            'viewer_fps_min': change(old['viewer_fps_min'], step['viewer_fps_min']),
+            'rss_mb': change(old['rss_mb'], step['rss_mb']),
+        })
+    return {
+        'baseline_commit': baseline.get('environment', {}).get('commit'),
+        'max_sustainable_viewers': change(baseline.get('max_sustainable_viewers'),
+                                          results['max_sustainable_viewers']),
+        'steps': steps,
+    }
+
+
+def environment(ffmpeg_bin):
+    def first_line(cmd):
+        try:
+            return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                  timeout=10).stdout.decode().splitlines()[0].strip()
+        except (OSError, IndexError, subprocess.TimeoutExpired):
+            return None
+
+    return {
+        'commit': first_line(['git', '-C', os.path.dirname(os.path.abspath(__file__)), 'rev-parse', '--short', 'HEAD']),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': first_line([ffmpeg_bin, '-version']),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cameras', type=int, default=1)
+    parser.add_argument('--recorders', type=int, default=0, help='cameras recorded at the same time (at most --cameras)')
+    parser.add_argument('--viewers', default='1,2,4,8,16,32', help='comma-separated viewer counts to step through')
+    parser.add_argument('--seconds', type=float, default=10.0, help='measured seconds per step')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds after viewers attach before measuring')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--source-fps', type=int, default=25, help='frame rate of the synthetic cameras')
+    parser.add_argument('--fps', type=int, default=15, choices=(15, 24, 30), help='frame rate cap per viewer')
+    parser.add_argument('--quality', default='medium', choices=('low', 'medium', 'high'))
+    parser.add_argument('--max-latency-ms', type=float, default=500.0,
+                        help='p95 latency above which a step is not sustained')
+    parser.add_argument('--keep-going', action='store_true', help='run every step even after one is not sustained')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    args = parser.parse_args()
+    counts = sorted({int(count) for count in args.viewers.split(',')})
+    if args.recorders > args.cameras:
+        parser.error('--recorders can be at most --cameras')
+
+    workdir = tempfile.mkdtemp(prefix='bench-streaming-')
+    # The app reads these at import time; the camera config is never loaded
+    os.environ['CAMERA_CONFIG_PATH'] = os.path.join(workdir, 'camera_config.yml')
+    os.environ['RECORDINGS_INDEX_PATH'] = os.path.join(workdir, 'recordings.db')
+
+    import recorder
+    from camera_hub import get_hub
+    from packet_source import FFMPEG_BIN
+    from web_camera_stream import recording_settings
+    # onvif configures the root logger at import, before the app can
+    logging.getLogger().setLevel(os.environ.get('LOG_LEVEL', 'WARNING').upper())
+
+    clip = os.path.join(workdir, 'camera.mp4')
+    steps_seconds = len(counts) * (args.warmup + args.seconds + 2)
+    render_clip(clip, args.width, args.height, args.source_fps, steps_seconds + CLIP_MARGIN, FFMPEG_BIN)
+    camera_settings = [{'name': f'synthetic {i}', 'url': clip, 'fps': args.source_fps}
+                       for i in range(args.cameras)]
+    hubs = [get_hub(i, settings) for i, settings in enumerate(camera_settings)]
+
+    recorder.RECORDINGS_DIR = os.path.join(workdir, 'recordings')
+    os.makedirs(recorder.RECORDINGS_DIR)
+    recorders = [recorder.CameraRecorder(i, camera_settings[i], recording_settings) for i in range(args.recorders)]
+    # Keep every capture running between steps, as always-on cameras do
+    for hub in hubs:
+        hub.pin()
+    for camera_recorder in recorders:
+        camera_recorder.start_recording()
+    time.sleep(args.warmup)
+
+    target_fps = min(args.fps, args.source_fps)
+    steps = []
+    previous_rss = (rss_bytes(), 0)
+    try:
+        for count in counts:
+            step = run_step(count, hubs, camera_settings, args, target_fps, previous_rss)
+            steps.append(step)
+            previous_rss = (step['rss_mb'] * 1e6, count)
+            print(f"{count} viewers: {step['cpu_cores']} cores, p95 {step['latency_ms']['p95']} ms, "
+                  f"min {step['viewer_fps_min']} fps{'' if step['sustained'] else ' (not sustained)'}",
+                  file=sys.stderr)
+            if not step['sustained'] and not args.keep_going:
+                break
+    finally:
+        for camera_recorder in recorders:
+            camera_recorder.stop_recording()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    sustained = 0
+    for step in steps:
+        if not step['sustained']:
+            break
+        sustained = step['viewers']
+    results = {
+        'benchmark': 'streaming',
+        'environment': environment(FFMPEG_BIN),
+        'config': {
+            'cameras': args.cameras,
+            'recorders': args.recorders,
+            'source': f'{args.width}x{args.height}@{args.source_fps}',
+            'viewer_fps': args.fps,
+            'quality': args.quality,
+            'seconds_per_step': args.seconds,
+            'max_latency_ms': args.max_latency_ms,
+        },
+        'recorders': [{'camera_id': r.camera_id, 'dropped_packets': r.dropped_packets} for r in recorders],
+        'steps': steps,
+        'max_sustainable_viewers': sustained,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            results['comparison'] = compare(results, json.load(f))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
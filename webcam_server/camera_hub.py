@@ -0,0 +1,794 @@
+import cv2
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from frame_cache import FrameCache, QUALITY_PROFILES
+from metrics import CameraMetrics, register
+from packet_source import PacketSource, FrameDecoder
+from ring_buffer import PacketRingBuffer
+from snapshots import SnapshotCache
+
+logger = logging.getLogger(__name__)
+
+# Seconds a hub keeps its capture open after the last viewer has left
+HUB_GRACE_PERIOD = float(os.environ.get('HUB_GRACE_PERIOD', 10))
+
+# Packets to observe before trusting the measured frame rate over the configured one
+RATE_WARMUP_PACKETS = 30
+
+# Pre-event history kept per camera; a camera's pre_event_seconds /
+# pre_event_max_mb settings override these, and 0 seconds disables it
+PRE_EVENT_SECONDS = float(os.environ.get('PRE_EVENT_SECONDS', 10))
+PRE_EVENT_MAX_MB = float(os.environ.get('PRE_EVENT_MAX_MB', 8))
+
+# Reconnect delays after a failed or stalled capture: doubling from the
+# minimum up to the maximum, each randomized to between half and all of it
+# so cameras behind one failed switch don't reconnect in lockstep. A
+# connection that lasted RECONNECT_RESET_SECONDS starts again at the minimum.
+RECONNECT_MIN_DELAY = float(os.environ.get('RECONNECT_MIN_DELAY', 0.5))
+RECONNECT_MAX_DELAY = float(os.environ.get('RECONNECT_MAX_DELAY', 30))
+RECONNECT_RESET_SECONDS = 30.0
+
+# Seconds without a packet before a connected capture counts as stalled and
+# is reconnected, and the longest a connection may take to send its first one
+CAPTURE_STALL_TIMEOUT = float(os.environ.get('CAPTURE_STALL_TIMEOUT', 5))
+CAPTURE_CONNECT_TIMEOUT = float(os.environ.get('CAPTURE_CONNECT_TIMEOUT', 15))
+
+# Seconds between the watchdog's checks of a capture
+WATCHDOG_INTERVAL = 1.0
+
+# Widest consumer a camera's substream_url can serve, unless the camera sets substream_width
+SUBSTREAM_WIDTH = 640
+
+# Seconds to decode from the main stream after the substream fails
+SUBSTREAM_RETRY_INTERVAL = 30.0
+
+# How the hub decodes for its current consumers:
+# source: 'main', or 'substream' when the camera's substream_url is wide enough
+# width: decoder output width, None for full resolution
+# fps: frames per second published to viewers, None for every frame
+# keyframes_only: only keyframes are decoded; fps is at or below the keyframe rate
+DecodePlan = namedtuple('DecodePlan', ['source', 'width', 'fps', 'keyframes_only'])
+
+
+class Subscription:
+    """
+    A single viewer's handle on a CameraHub. Each read returns the newest
+    frame, so a slow client skips the frames it had no time for instead of
+    queueing them, and never holds up the capture or other viewers.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, hub, quality=None, max_fps=None, client=None):
+        self.id = next(self._ids)
+        self.hub = hub
+        self.quality = quality
+        self.max_fps = max_fps
+        self.client = client
+        self.last_seq = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.connected_at = time.time()
+        self.closed = False
+        self._next_due = 0.0
+
+    def pace_delay(self):
+        """Seconds until this client's fps budget allows another frame"""
+        if not self.max_fps:
+            return 0.0
+        return max(0.0, self._next_due - time.monotonic())
+
+    def _advance(self, seq, size=0, captured_at=None):
+        metrics = self.hub.metrics
+        # Frames published since the last one this client received were skipped
+        if self.delivered:
+            dropped = max(0, seq - self.last_seq - 1)
+            if dropped:
+                self.dropped += dropped
+                metrics.frames_dropped.add(dropped)
+        self.delivered += 1
+        metrics.frames_delivered.add()
+        if size:
+            metrics.bytes_out.add(size)
+        if captured_at is not None:
+            metrics.delivery_latency.observe(time.monotonic() - captured_at)
+        self.last_seq = seq
+        if self.max_fps:
+            self._next_due = time.monotonic() + 1.0 / self.max_fps
+
+    def take_encoded(self):
+        """Non-blocking: the newest cached frame if this client hasn't had it yet, else None"""
+        encoded = self.hub.frame_cache.get(self.quality)
+        if encoded is None or encoded.seq <= self.last_seq:
+            return None
+        self._advance(encoded.seq, len(encoded.payload), encoded.captured_at)
+        return encoded
+
+    def next_encoded(self, timeout=5.0):
+        """
+        Block until a newer encoded frame is cached for this subscription's quality
+        :return: The shared EncodedFrame, or None if the hub stopped or timed out
+        """
+        time.sleep(self.pace_delay())
+        seen = self.last_seq
+        while True:
+            encoded = self.take_encoded()
+            if encoded is not None:
+                return encoded
+            result = self.hub.wait_for_frame(seen, timeout)
+            if result is None:
+                return None
+            seen = result[0]
+
+    def stats(self):
+        return {
+            'id': self.id,
+            'client': self.client,
+            'quality': self.quality,
+            'max_fps': self.max_fps,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'connected_seconds': round(time.time() - self.connected_at, 1),
+        }
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.hub.unsubscribe(self.quality, self)
+
+
+class CameraHub:
+    """
+    One long-lived connection per camera. A single ffmpeg stream-copy session
+    feeds compressed packets to packet sinks (recorders) and, only while
+    viewers are subscribed, to a decoder whose frames are shared by all of
+    them. The capture starts with the first subscriber or sink and stops once
+    the last one has been gone for ``grace_period`` seconds.
+
+    The decoder does no more work than its consumers need (see DecodePlan).
+    It scales frames down to the widest consumer inside ffmpeg and decodes
+    keyframes only when nobody wants more frames than the GOP rate. It uses
+    the camera's ``substream_url`` when that stream is wide enough, and
+    skips the BGR conversion and JPEG encodes of frames beyond the viewers'
+    fps caps. Full-resolution decoding happens only for full-resolution
+    viewers. Recorders take compressed packets and never need decoding.
+    """
+
+    def __init__(self, camera_id, camera_settings, grace_period=HUB_GRACE_PERIOD):
+        self.camera_id = camera_id
+        self.camera_settings = camera_settings
+        self.codec = camera_settings.get('codec', 'h264')
+        self.grace_period = grace_period
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._new_keyframe = threading.Condition(self._lock)
+        self._frame = None
+        self._frame_published_at = None
+        self._last_keyframe = None
+        self._seq = 0
+        self._decoded_frames = 0
+        self._subscribers = 0
+        self._subscriptions = {}
+        self._pins = 0
+        self._packet_sinks = []
+        self._frame_listeners = []
+        self._listener_needs = {}
+        self._frame_notifiers = []
+        self._sink_lock = threading.Lock()
+        self._idle_since = None
+        self._running = False
+        self._restart = False
+        self._source = None
+        self._thread = None
+        self._packet_interval = None
+        self._last_packet_time = None
+        self._packet_count = 0
+        self._keyframe_interval = None
+        self._last_keyframe_time = None
+        self._decoder = None
+        self._decode_plan = None
+        self._consumers_changed = True
+        self._substream = None
+        self._substream_failed_at = None
+        self._next_publish = 0.0
+        self._decoder_started_at = None
+        self._last_decoded_at = None
+        self._decoder_stale = False
+        self._connect_started_at = None
+        self._stalled = False
+        self._down_since = None
+        self.metrics = CameraMetrics(camera_id, self._gauges)
+        register(self.metrics)
+        self.frame_cache = FrameCache(self.name, self.metrics)
+        self.snapshots = SnapshotCache(self)
+        self.pre_event = None
+        pre_event_seconds = float(camera_settings.get('pre_event_seconds', PRE_EVENT_SECONDS))
+        if pre_event_seconds > 0:
+            max_mb = float(camera_settings.get('pre_event_max_mb', PRE_EVENT_MAX_MB))
+            self.pre_event = PacketRingBuffer(pre_event_seconds, int(max_mb * 1024 * 1024))
+
+    @property
+    def name(self):
+        return self.camera_settings.get('name', f'camera {self.camera_id}')
+
+    @property
+    def subscriber_count(self):
+        return self._subscribers
+
+    @property
+    def is_running(self):
+        return self._running
+
+    @property
+    def frame_rate(self):
+        """Frame rate measured from packet arrival, falling back to the configured fps"""
+        if self._packet_interval and self._packet_count >= RATE_WARMUP_PACKETS:
+            return 1.0 / self._packet_interval
+        return float(self.camera_settings.get('fps', 25))
+
+    @property
+    def decode_plan(self):
+        """The DecodePlan in effect, or None while nothing is being decoded"""
+        return self._decode_plan
+
+    def _gauges(self):
+        """Point-in-time values for this hub's CameraMetrics"""
+        last_packet_time = self._last_packet_time
+        down_since = self._down_since
+        if not self._running:
+            state = 'stopped'
+        elif down_since is not None:
+            state = 'reconnecting'
+        elif last_packet_time is None:
+            state = 'connecting'
+        else:
+            state = 'streaming'
+        return {
+            'name': self.name,
+            'running': self._running,
+            'state': state,
+            'up': state == 'streaming',
+            'outage_seconds': round(time.monotonic() - down_since, 1) if down_since is not None else None,
+            'fps': self.frame_rate if self._running else 0.0,
+            'configured_fps': self.camera_settings.get('fps'),
+            'last_packet_age': time.monotonic() - last_packet_time if last_packet_time is not None else None,
+            'subscribers': self._subscribers,
+            'frame_listeners': len(self._frame_listeners),
+            'packet_sinks': len(self._packet_sinks),
+        }
+
+    def reconfigure(self, camera_settings):
+        """
+        Take new settings for this camera. A running capture reconnects with
+        them; viewers, sinks and listeners stay attached across the gap.
+        """
+        with self._lock:
+            self.camera_settings = camera_settings
+            self.codec = camera_settings.get('codec', 'h264')
+            self.frame_cache.camera_name = self.name
+            if self._running:
+                self._restart = True
+                if self._source is not None:
+                    self._source.interrupt()
+
+    def subscribe(self, quality=None, max_fps=None, client=None):
+        """
+        Attach a viewer, starting the capture worker if it is not running
+        :param quality: Encoded variant the viewer reads, or None for raw frames
+        :param max_fps: Cap on frames delivered to this viewer
+        :param client: Label (e.g. remote address) reported in client stats
+        """
+        subscription = Subscription(self, quality, max_fps, client)
+        if quality is not None:
+            self.frame_cache.acquire(quality)
+        with self._lock:
+            self._subscribers += 1
+            self._subscriptions[subscription.id] = subscription
+            self._consumers_changed = True
+            self._idle_since = None
+            if not self._running:
+                self._start_locked()
+        return subscription
+
+    def unsubscribe(self, quality=None, subscription=None):
+        if quality is not None:
+            self.frame_cache.release(quality)
+        with self._lock:
+            self._subscribers = max(0, self._subscribers - 1)
+            if subscription is not None:
+                self._subscriptions.pop(subscription.id, None)
+            self._consumers_changed = True
+            self._mark_idle_locked()
+
+    def client_stats(self):
+        """Delivery statistics for every attached viewer"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        return [subscription.stats() for subscription in subscriptions]
+
+    def add_frame_notifier(self, notifier):
+        """
+        Call ``notifier(seq)`` on the decoder thread each time a frame has
+        been published to the frame cache. Unlike listeners and subscribers,
+        notifiers do not keep the capture or the decoder running.
+        """
+        with self._lock:
+            self._frame_notifiers = self._frame_notifiers + [notifier]
+
+    def remove_frame_notifier(self, notifier):
+        with self._lock:
+            self._frame_notifiers = [n for n in self._frame_notifiers if n != notifier]
+
+    def add_frame_listener(self, listener, max_width=None, max_fps=None):
+        """
+        Receive every decoded frame as planar I420 (the first rows are the
+        grayscale Y plane). ``listener(seq, yuv)`` runs on the decoder thread
+        and must be cheap; the frame is shared and must not be modified.
+        :param max_width: Widest frame the listener can use; frames may then be
+                          decoded at that width (but can arrive wider)
+        :param max_fps: Frame rate the listener needs; may allow keyframe-only decoding
+        """
+        with self._lock:
+            self._frame_listeners = self._frame_listeners + [listener]
+            self._listener_needs[listener] = (max_width, max_fps)
+            self._consumers_changed = True
+            self._idle_since = None
+            if not self._running:
+                self._start_locked()
+
+    def remove_frame_listener(self, listener):
+        with self._lock:
+            self._frame_listeners = [l for l in self._frame_listeners if l != listener]
+            self._listener_needs.pop(listener, None)
+            self._consumers_changed = True
+            self._mark_idle_locked()
+
+    def pin(self):
+        """Keep the capture running with no viewers, e.g. to fill the pre-event buffer"""
+        with self._lock:
+            self._pins += 1
+            self._idle_since = None
+            if not self._running:
+                self._start_locked()
+
+    def unpin(self):
+        with self._lock:
+            self._pins = max(0, self._pins - 1)
+            self._mark_idle_locked()
+
+    def add_packet_sink(self, sink, pre_event=True):
+        """
+        Receive every compressed packet without decoding. ``sink(packet)`` is
+        called on the capture thread and must not block.
+        :param pre_event: First replay the pre-event buffer from its oldest keyframe
+        """
+        with self._lock:
+            self._idle_since = None
+            if not self._running:
+                self._start_locked()
+        with self._sink_lock:
+            # Replay and attach atomically so no packet is missed or repeated
+            if pre_event and self.pre_event is not None:
+                for packet in self.pre_event.packets_from_keyframe():
+                    sink(packet)
+            self._packet_sinks = self._packet_sinks + [sink]
+
+    def remove_packet_sink(self, sink):
+        with self._sink_lock:
+            self._packet_sinks = [s for s in self._packet_sinks if s != sink]
+        with self._lock:
+            self._mark_idle_locked()
+
+    def wait_for_frame(self, last_seq, timeout=5.0):
+        """
+        Wait for a frame with a sequence number greater than ``last_seq``
+        :return: (seq, frame) tuple, or None if the hub stopped or timed out
+        """
+        deadline = time.monotonic() + timeout
+        with self._new_frame:
+            while self._seq <= last_seq:
+                if not self._running:
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._new_frame.wait(remaining)
+            return self._seq, self._frame
+
+    def latest_frame(self):
+        """:return: (seq, BGR frame, time.monotonic() it was published) of the newest frame, or None"""
+        with self._lock:
+            if not self._running or self._frame is None:
+                return None
+            return self._seq, self._frame, self._frame_published_at
+
+    def wait_for_keyframe(self, since, timeout=5.0):
+        """
+        Wait until the capture has a keyframe that arrived at or after ``since``
+        (a time.monotonic() value). Keyframes carry their parameter sets, so
+        each one decodes on its own.
+        :return: The newest keyframe Packet, or None if the hub stopped or timed out
+        """
+        deadline = time.monotonic() + timeout
+        with self._new_keyframe:
+            while self._last_keyframe is None or self._last_keyframe.timestamp < since:
+                if not self._running:
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._new_keyframe.wait(remaining)
+            return self._last_keyframe
+
+    def _is_idle_locked(self):
+        return (self._subscribers == 0 and self._pins == 0
+                and not self._packet_sinks and not self._frame_listeners)
+
+    def _mark_idle_locked(self):
+        if self._is_idle_locked():
+            self._idle_since = time.monotonic()
+
+    def _start_locked(self):
+        self._running = True
+        self._restart = False
+        self._frame = None
+        self._last_keyframe = None
+        self._packet_interval = None
+        self._last_packet_time = None
+        self._packet_count = 0
+        self._keyframe_interval = None
+        self._last_keyframe_time = None
+        self._consumers_changed = True
+        self.frame_cache.clear()
+        if self.pre_event is not None:
+            self.pre_event.clear()
+        self._thread = threading.Thread(target=self._capture_loop, name=f'hub-{self.camera_id}', daemon=True)
+        self._thread.start()
+
+    def _should_stop(self):
+        with self._lock:
+            if (self._is_idle_locked() and self._idle_since is not None
+                    and time.monotonic() - self._idle_since >= self.grace_period):
+                self._running = False
+                self._new_frame.notify_all()
+                self._new_keyframe.notify_all()
+                return True
+            return False
+
+    def _track_rate(self, packet):
+        if packet.seq == 1:
+            # First packet of a new connection; the gap before it isn't a frame interval
+            self._last_packet_time = None
+            self._last_keyframe_time = None
+        if self._last_packet_time is not None:
+            interval = packet.timestamp - self._last_packet_time
+            if self._packet_interval is None:
+                self._packet_interval = interval
+            else:
+                self._packet_interval += 0.05 * (interval - self._packet_interval)
+        self._last_packet_time = packet.timestamp
+        self._packet_count += 1
+        if packet.keyframe:
+            if self._last_keyframe_time is not None:
+                interval = packet.timestamp - self._last_keyframe_time
+                if self._keyframe_interval is None:
+                    self._keyframe_interval = interval
+                else:
+                    self._keyframe_interval += 0.2 * (interval - self._keyframe_interval)
+            self._last_keyframe_time = packet.timestamp
+
+    def _plan_decode(self):
+        """The cheapest DecodePlan that still satisfies every current consumer of pixels"""
+        with self._lock:
+            viewers = [
+                (QUALITY_PROFILES[subscription.quality]['max_width'] if subscription.quality else None,
+                 subscription.max_fps)
+                for subscription in self._subscriptions.values()
+            ]
+            needs = viewers + list(self._listener_needs.values())
+        if not needs:
+            return None
+
+        def largest(values):
+            # None means "full resolution" / "every frame" and beats any number
+            return None if None in values else max(values)
+
+        width = largest([width for width, _ in needs])
+        decode_fps = largest([fps for _, fps in needs])
+        publish_fps = largest([fps for _, fps in viewers]) if viewers else None
+        # Keyframes decode on their own, so a low enough rate skips every other frame
+        keyframes_only = (decode_fps is not None and self._keyframe_interval is not None
+                          and decode_fps * self._keyframe_interval <= 1.0)
+        source = 'main'
+        substream_url = self.camera_settings.get('substream_url')
+        if (substream_url and not keyframes_only and width is not None
+                and width <= int(self.camera_settings.get('substream_width', SUBSTREAM_WIDTH))
+                and (self._substream_failed_at is None
+                     or time.monotonic() - self._substream_failed_at >= SUBSTREAM_RETRY_INTERVAL)):
+            source = 'substream'
+        return DecodePlan(source, width, publish_fps, keyframes_only)
+
+    def _update_decoder(self, packet):
+        """Decode only what the current viewers and frame listeners need"""
+        if self._decoder_stale:
+            # Flagged by the watchdog; planning from scratch starts a new decoder
+            self._decoder_stale = False
+            self._stop_decoder()
+            self._decode_plan = None
+            self._consumers_changed = True
+        # Consumers change rarely; the keyframe rate is re-checked once per GOP
+        if self._consumers_changed or packet.keyframe:
+            self._consumers_changed = False
+            plan = self._plan_decode()
+            if plan != self._decode_plan:
+                self._switch_decoder(plan)
+        plan = self._decode_plan
+        if plan is not None and plan.source == 'main' and (packet.keyframe or not plan.keyframes_only):
+            self._decoder.feed(packet)
+
+    def _switch_decoder(self, plan):
+        previous = self._decode_plan
+        self._decode_plan = plan
+        if (plan is not None and previous is not None
+                and plan.source == previous.source and plan.width == previous.width):
+            # Rate changes only affect what is fed and published
+            return
+        self._stop_decoder()
+        if plan is None:
+            return
+        logger.info(f"Hub {self.name} decoding {'substream' if plan.source == 'substream' else 'main stream'} at "
+                    f"{f'{plan.width}px' if plan.width else 'full resolution'}"
+                    f"{', keyframes only' if plan.keyframes_only else ''}")
+        self._decoder = FrameDecoder(self.codec, self._on_frame, self.name, width=plan.width,
+                                     metrics=self.metrics).start()
+        self._decoder_started_at = time.monotonic()
+        if plan.source == 'substream':
+            source = PacketSource(self.camera_settings['substream_url'],
+                                  self.camera_settings.get('substream_codec', self.codec))
+            self._substream = source
+            threading.Thread(target=self._substream_loop, args=(source, self._decoder),
+                             name=f'hub-{self.camera_id}-substream', daemon=True).start()
+
+    def _stop_decoder(self):
+        if self._substream is not None:
+            self._substream.interrupt()
+            self._substream = None
+        if self._decoder is not None:
+            self._decoder.stop()
+            self._decoder = None
+        self._decoder_started_at = None
+
+    def _substream_loop(self, source, decoder):
+        """Feeds the decoder from the substream while it is the decode source"""
+        try:
+            source.open()
+            for packet in source.packets():
+                if self._substream is not source:
+                    break
+                decoder.feed(packet)
+        except Exception as e:
+            logger.error(f"Substream error for {self.name}: {str(e)}")
+        finally:
+            source.close()
+        if self._substream is source:
+            logger.warning(f"Substream of {self.name} ended, decoding the main stream instead")
+            self._substream_failed_at = time.monotonic()
+            self._consumers_changed = True
+
+    def _on_frame(self, yuv, captured_at=None):
+        self._decoded_frames += 1
+        self._last_decoded_at = time.monotonic()
+        for listener in self._frame_listeners:
+            listener(self._decoded_frames, yuv)
+        if self._subscribers == 0:
+            return
+        plan = self._decode_plan
+        if plan is not None and plan.fps and not plan.keyframes_only:
+            # No viewer wants this frame; skip converting and encoding it
+            now = time.monotonic()
+            interval = 1.0 / plan.fps
+            if now + 0.5 / self.frame_rate < self._next_publish:
+                return
+            self._next_publish = self._next_publish + interval if now - self._next_publish < interval \
+                else now + interval
+
+        # Convert and encode once per watched quality before waking the viewers
+        seq = self._seq + 1
+        frame = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
+        self.frame_cache.update(seq, frame, captured_at)
+
+        with self._new_frame:
+            self._frame = frame
+            self._frame_published_at = time.monotonic()
+            self._seq = seq
+            self._new_frame.notify_all()
+        self.metrics.frames_published.add()
+        for notifier in self._frame_notifiers:
+            notifier(seq)
+
+    def _capture_loop(self):
+        """
+        Supervises the capture: reconnects after read failures and stalls,
+        with jittered exponential backoff, until the hub goes idle or is
+        reconfigured. Viewers, sinks and the decoder stay attached throughout.
+        """
+        stream_url = self.camera_settings['url']
+        attempt = 0
+        threading.Thread(target=self._watchdog, args=(threading.current_thread(),),
+                         name=f'hub-{self.camera_id}-watchdog', daemon=True).start()
+        try:
+            while True:
+                streamed = self._capture(stream_url)
+                if self._restart or self._thread is not threading.current_thread() or self._should_stop():
+                    break
+                if self._down_since is None:
+                    self._down_since = self._last_packet_time or time.monotonic()
+                # A connection that held up for a while starts the backoff over
+                attempt = 1 if streamed >= RECONNECT_RESET_SECONDS else attempt + 1
+                delay = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2 ** (attempt - 1))
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                logger.warning(f"Hub reconnecting to {self.name} in {delay:.1f}s (attempt {attempt})")
+                if not self._backoff(delay):
+                    break
+        finally:
+            self._stop_decoder()
+            self._decode_plan = None
+            self._down_since = None
+            restarting = False
+            with self._lock:
+                # A new worker may already have been started by a late subscriber
+                if self._thread is threading.current_thread():
+                    self._source = None
+                    if self._restart and not self._is_idle_locked():
+                        restarting = True
+                        self._start_locked()
+                    else:
+                        self._running = False
+                self._new_frame.notify_all()
+                self._new_keyframe.notify_all()
+            if restarting:
+                logger.info(f"Hub reconnecting with new settings: {self.name}")
+            else:
+                logger.info(f"Hub stopped for camera: {self.name}")
+
+    def _backoff(self, delay):
+        """Sleep before a reconnect; False if the hub went idle or was reconfigured meanwhile"""
+        deadline = time.monotonic() + delay
+        while True:
+            if self._restart or self._thread is not threading.current_thread() or self._should_stop():
+                return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            time.sleep(min(remaining, 0.5))
+
+    def _capture(self, stream_url):
+        """
+        One connection to the camera: hands packets to the sinks and the
+        decoder until the stream fails, stalls, or the hub stops
+        :return: Seconds packets were received for
+        """
+        logger.info(f"Hub connecting to: {stream_url}")
+        source = PacketSource(stream_url, self.codec)
+        metrics = self.metrics
+        connected_at = None
+        self._stalled = False
+        try:
+            with self._lock:
+                if self._restart:
+                    return 0.0
+                self._connect_started_at = time.monotonic()
+                self._source = source.open()
+
+            for packet in source.packets():
+                if connected_at is None:
+                    connected_at = time.monotonic()
+                    metrics.connects.add()
+                    if self._down_since is not None:
+                        outage = connected_at - self._down_since
+                        metrics.recovery_time.observe(outage)
+                        self._down_since = None
+                        logger.info(f"Hub reconnected to camera: {self.name} after {outage:.1f}s")
+                    else:
+                        logger.info(f"Hub connected to camera: {self.name}")
+                    if self._decoder is not None:
+                        # The new stream can't continue the old one's references
+                        self._decoder.resync()
+                if self._restart or self._should_stop():
+                    break
+
+                self._track_rate(packet)
+                metrics.packets.add()
+                metrics.bytes_in.add(len(packet.data))
+                if packet.keyframe:
+                    with self._new_keyframe:
+                        self._last_keyframe = packet
+                        self._new_keyframe.notify_all()
+                with self._sink_lock:
+                    if self.pre_event is not None:
+                        self.pre_event.append(packet)
+                    for sink in self._packet_sinks:
+                        sink(packet)
+                self._update_decoder(packet)
+            else:
+                if not self._restart and self._running:
+                    if self._stalled:
+                        logger.error(f"No packets from {self.name} for {CAPTURE_STALL_TIMEOUT:.0f}s (stalled)")
+                        metrics.stalls.add()
+                    else:
+                        logger.error(f"Can't receive packets from {self.name} (stream ended?)")
+                    metrics.capture_errors.add()
+
+        except Exception as e:
+            logger.error(f"Error in camera hub {self.name}: {str(e)}")
+            metrics.capture_errors.add()
+
+        finally:
+            with self._lock:
+                if self._source is source:
+                    self._source = None
+            source.close()
+        return time.monotonic() - connected_at if connected_at is not None else 0.0
+
+    def _watchdog(self, capture_thread):
+        """
+        Runs beside a capture thread. Interrupts a connection that has sent
+        nothing for CAPTURE_STALL_TIMEOUT (or never connects within
+        CAPTURE_CONNECT_TIMEOUT), since a stalled camera leaves the read
+        blocked forever, and restarts a decoder whose frames have stopped
+        while packets still arrive.
+        """
+        while capture_thread.is_alive() and self._thread is capture_thread:
+            time.sleep(WATCHDOG_INTERVAL)
+            now = time.monotonic()
+            with self._lock:
+                source = self._source
+                connect_started_at = self._connect_started_at
+            if source is None:
+                continue
+            last_packet_time = self._last_packet_time
+            if last_packet_time is None or last_packet_time < connect_started_at:
+                if now - connect_started_at > CAPTURE_CONNECT_TIMEOUT:
+                    self._stalled = True
+                    source.interrupt()
+                continue
+            if now - last_packet_time > CAPTURE_STALL_TIMEOUT:
+                self._stalled = True
+                source.interrupt()
+                continue
+
+            decoder_started_at = self._decoder_started_at
+            if self._decoder is None or decoder_started_at is None:
+                continue
+            # Keyframe-only decoding legitimately yields one frame per GOP
+            limit = max(CAPTURE_STALL_TIMEOUT, 2 * (self._keyframe_interval or 0))
+            last_decoded_at = max(self._last_decoded_at or 0.0, decoder_started_at)
+            if now - last_decoded_at > limit:
+                logger.warning(f"Decoder for {self.name} produced no frames for {now - last_decoded_at:.0f}s, "
+                               f"restarting it")
+                self.metrics.stalls.add()
+                self._decoder_stale = True
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def get_hub(camera_id, camera_settings):
+    """Return the shared hub for a camera, creating it on first use"""
+    with _hubs_lock:
+        hub = _hubs.get(camera_id)
+        if hub is None:
+            hub = CameraHub(camera_id, camera_settings)
+            _hubs[camera_id] = hub
+        return hub
+
+
+def all_hubs():
+    with _hubs_lock:
+        return dict(_hubs)
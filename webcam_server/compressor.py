@@ -0,0 +1,197 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from packet_source import FFMPEG_BIN
+from recorder import PARTIAL_SUFFIX
+from recordings_index import DONE, FAILED, PENDING, COMPRESSING
+
+logger = logging.getLogger(__name__)
+
+# Encoder settings for archived recordings
+COMPRESSION_CODEC = os.environ.get('COMPRESSION_CODEC', 'libx265')
+COMPRESSION_CRF = int(os.environ.get('COMPRESSION_CRF', 28))
+COMPRESSION_PRESET = os.environ.get('COMPRESSION_PRESET', 'medium')
+
+# Threads each encode may use
+COMPRESSION_THREADS = int(os.environ.get('COMPRESSION_THREADS', 2))
+
+# Upper bound on concurrent encodes; fewer run while the cores are busy
+COMPRESSION_MAX_WORKERS = int(os.environ.get('COMPRESSION_MAX_WORKERS', max(1, (os.cpu_count() or 1) // 4)))
+
+# Seconds between checks for work when nothing wakes the compressor
+COMPRESSION_POLL_INTERVAL = 30.0
+
+# Codec names ffmpeg reports for the output of each encoder; files already
+# in the target codec are left alone
+ENCODER_CODECS = {'libx265': 'hevc', 'libx264': 'h264', 'libaom-av1': 'av1', 'libsvtav1': 'av1'}
+
+# First video stream in ffmpeg's input summary, e.g. "Stream #0:0(und): Video: h264 (High) ..."
+VIDEO_STREAM = re.compile(r'Stream #\S+: Video: (\w+)')
+
+
+# Found once; prefixed to background ffmpeg commands (preexec_fn isn't safe
+# in a process with this many threads)
+NICE_BIN = shutil.which('nice')
+IONICE_BIN = shutil.which('ionice')
+
+
+def idle_command(cmd):
+    """:return: ``cmd`` prefixed to run at nice 19 and, where ionice exists, in the idle I/O class"""
+    prefix = []
+    if NICE_BIN:
+        prefix += [NICE_BIN, '-n', '19']
+    if IONICE_BIN:
+        prefix += [IONICE_BIN, '-c', '3']
+    return prefix + cmd
+
+
+def probe(path):
+    """:return: ffmpeg's summary of a media file (codecs, duration, streams)"""
+    # With no output file ffmpeg just prints the input summary and exits
+    result = subprocess.run([FFMPEG_BIN, '-hide_banner', '-nostdin', '-i', path],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=30)
+    return result.stderr.decode(errors='replace')
+
+
+class VideoCompressor:
+    """
+    Re-encodes finished recordings to save space, driven by the recordings
+    index: only PENDING segments (finalized by the recorder) are picked up,
+    oldest first, and each moves through COMPRESSING to DONE or FAILED.
+
+    Encodes run as ffmpeg processes at nice 19 and, where ``ionice`` exists,
+    in the idle I/O class, so live streaming always wins the CPU and disk.
+    At most ``max_workers`` run at once, and a further one only starts while
+    the load average leaves ``threads`` cores free. The compressed file
+    replaces the original only if it is smaller.
+    """
+
+    def __init__(self, index, directory, max_workers=COMPRESSION_MAX_WORKERS, threads=COMPRESSION_THREADS,
+                 codec=COMPRESSION_CODEC, crf=COMPRESSION_CRF, preset=COMPRESSION_PRESET):
+        self.index = index
+        self.directory = directory
+        self.max_workers = max_workers
+        self.threads = threads
+        self.codec = codec
+        self.crf = crf
+        self.preset = preset
+        self.active = {}
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        # Encodes interrupted by a restart start over
+        requeued = self.index.reset_state(COMPRESSING, PENDING)
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted compressions")
+        self._thread = threading.Thread(target=self._schedule, name='compressor', daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        """Check for pending recordings now rather than at the next poll"""
+        self._wake.set()
+
+    def status(self):
+        stats = self.index.compression_stats()
+        with self._lock:
+            stats['active'] = sorted(self.active)
+        return stats
+
+    def _has_capacity(self):
+        with self._lock:
+            running = len(self.active)
+        if running >= self.max_workers:
+            return False
+        if running == 0:
+            # Niced, so one encode can always make progress in spare cycles
+            return True
+        free_cores = (os.cpu_count() or 1) - os.getloadavg()[0]
+        return free_cores >= self.threads
+
+    def _schedule(self):
+        while True:
+            self._wake.clear()
+            started = False
+            try:
+                if self._has_capacity():
+                    row = self.index.claim_pending()
+                    if row is not None:
+                        with self._lock:
+                            self.active[row['filename']] = time.time()
+                        threading.Thread(target=self._run_job, args=(row,),
+                                         name=f"compress-{row['filename']}", daemon=True).start()
+                        started = True
+            except Exception as e:
+                logger.error(f"Compressor error: {str(e)}")
+            # Start encodes one at a time so the load average can catch up
+            self._wake.wait(5.0 if started else COMPRESSION_POLL_INTERVAL)
+
+    def _run_job(self, row):
+        filename = row['filename']
+        try:
+            self._compress(row)
+        except Exception as e:
+            logger.error(f"Error compressing {filename}: {str(e)}")
+            self.index.finish_compression(filename, FAILED, row['size'], None)
+        finally:
+            with self._lock:
+                self.active.pop(filename, None)
+            self._wake.set()
+
+    def _probe_codec(self, path):
+        """:return: Codec of the first video stream, or None"""
+        match = VIDEO_STREAM.search(probe(path))
+        return match.group(1) if match else None
+
+    def _encode_command(self, source, target):
+        cmd = [FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+               '-i', source, '-map', '0', '-c', 'copy',
+               '-c:v', self.codec, '-crf', str(self.crf), '-preset', self.preset, '-threads', str(self.threads)]
+        if self.codec == 'libx265':
+            cmd += ['-x265-params', f'pools={self.threads}:log-level=error', '-tag:v', 'hvc1']
+        cmd += ['-movflags', '+faststart', '-f', 'mp4', target]
+        return idle_command(cmd)
+
+    def _compress(self, row):
+        filename = row['filename']
+        path = os.path.join(self.directory, filename)
+        if not os.path.exists(path):
+            logger.info(f"{filename} was deleted before it could be compressed")
+            self.index.remove(filename)
+            return
+        original_size = os.path.getsize(path)
+
+        if self._probe_codec(path) == ENCODER_CODECS.get(self.codec):
+            # Already compressed, by us before a restart or by hand
+            self.index.finish_compression(filename, DONE, original_size, row['original_size'] or original_size)
+            return
+
+        target = f'{path}.compressed{PARTIAL_SUFFIX}'
+        start = time.monotonic()
+        process = subprocess.run(self._encode_command(path, target), stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            if os.path.exists(target):
+                os.remove(target)
+            logger.error(f"Compressing {filename} failed ({process.returncode}): "
+                         f"{process.stderr.decode(errors='replace').strip()}")
+            self.index.finish_compression(filename, FAILED, original_size, None)
+            return
+
+        size = os.path.getsize(target)
+        if size < original_size and os.path.exists(path):
+            os.replace(target, path)
+        else:
+            os.remove(target)
+            size = original_size
+        saved = original_size - size
+        self.index.finish_compression(filename, DONE, size, original_size)
+        logger.info(f"Compressed {filename} in {time.monotonic() - start:.1f}s: "
+                    f"{original_size / 1e6:.1f} MB -> {size / 1e6:.1f} MB, saved {saved / 1e6:.1f} MB "
+                    f"({saved / original_size * 100 if original_size else 0:.0f}%)")
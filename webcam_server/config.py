@@ -1,5 +1,14 @@
+import logging
 import os
-from cryptography.fernet import Fernet
+import threading
+import time
+import yaml
+from cryptography.fernet import Fernet, InvalidToken
+
+logger = logging.getLogger(__name__)
+
+# Seconds between stat() calls on the camera config; reads in between are free
+CONFIG_CHECK_INTERVAL = float(os.environ.get('CONFIG_CHECK_INTERVAL', 1.0))
 
 class SecureConfig:
     def __init__(self):
@@ -12,11 +21,115 @@ class SecureConfig:
     def decrypt_value(self, encrypted_value):
         return self.cipher_suite.decrypt(encrypted_value.encode()).decode()
 
+    def decrypt_cameras(self, config):
+        """Decrypt the sensitive values of a parsed camera config in place"""
+        for camera in config:
+            if 'onvif' in camera:
+                camera['onvif']['password'] = self.decrypt_value(camera['onvif']['password'])
+        return config
+
     def load_camera_config(self, config_path):
         with open(config_path, 'r') as f:
             config = yaml.safe_load(f)
             # Decrypt sensitive values
-            for camera in config:
-                if 'onvif' in camera:
-                    camera['onvif']['password'] = self.decrypt_value(camera['onvif']['password'])
-            return config 
\ No newline at end of file
+            return self.decrypt_cameras(config)
+
+
+class ConfigRegistry:
+    """
+    Parsed camera config shared by every request. The file is parsed (and its
+    passwords decrypted) once per change: ``get()`` only stat()s it, at most
+    every ``check_interval`` seconds, and reloads when its mtime or size moves.
+    A reload swaps in a complete new list, so readers never see a half-loaded
+    config, and a file that fails to parse leaves the last good one in place.
+
+    ``add_listener(callback)`` registers ``callback(changed_ids, cameras)``,
+    called after each reload with the ids of the cameras that were added,
+    removed or edited.
+    """
+
+    def __init__(self, config_path, secure_config=None, check_interval=CONFIG_CHECK_INTERVAL):
+        self.config_path = config_path
+        self.secure_config = secure_config
+        self.check_interval = check_interval
+        self._cameras = []
+        self._signature = None
+        self._checked_at = None
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Current camera list; shared between callers, so treat it as read-only
+        :return: List of camera settings dicts
+        """
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            self._check(now)
+        return self._cameras
+
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+
+    def reload(self):
+        """Re-read the file now, regardless of its mtime"""
+        self._check(time.monotonic(), force=True)
+
+    def _check(self, now, force=False):
+        with self._lock:
+            if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+                # Another thread checked while we waited for the lock
+                return
+            self._checked_at = now
+            try:
+                stat = os.stat(self.config_path)
+            except OSError as e:
+                if self._signature != 'missing':
+                    logger.error(f"Error loading camera config: {str(e)}")
+                self._signature = 'missing'
+                return
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature and not force:
+                return
+
+            try:
+                cameras = self._load()
+            except Exception as e:
+                # Keep serving the last good config; retry once the file changes again
+                logger.error(f"Error loading camera config: {str(e)}")
+                self._signature = signature
+                return
+
+            initial = self._signature is None
+            previous = self._cameras
+            self._cameras = cameras
+            self._signature = signature
+            listeners = self._listeners
+        logger.info(f"Loaded camera config {self.config_path} ({len(cameras)} cameras)")
+
+        # The first load has nothing running to update
+        changed_ids = [
+            camera_id for camera_id in range(max(len(previous), len(cameras)))
+            if camera_id >= len(previous) or camera_id >= len(cameras)
+            or previous[camera_id] != cameras[camera_id]
+        ]
+        if initial or not changed_ids:
+            return
+        for listener in listeners:
+            try:
+                listener(changed_ids, cameras)
+            except Exception as e:
+                logger.error(f"Error applying camera config change: {str(e)}")
+
+    def _load(self):
+        with open(self.config_path, 'r') as f:
+            cameras = yaml.safe_load(f) or []
+        if not isinstance(cameras, list):
+            raise ValueError(f"{self.config_path} must contain a list of cameras")
+        if self.secure_config is not None:
+            try:
+                self.secure_config.decrypt_cameras(cameras)
+            except InvalidToken:
+                raise ValueError("Can't decrypt camera passwords (wrong ENCRYPTION_KEY?)")
+        return cameras
@@ -0,0 +1,102 @@
+import cv2
+import logging
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# JPEG quality and maximum width for each level accepted by validators.SettingsSchema
+QUALITY_PROFILES = {
+    'low': {'jpeg_quality': 50, 'max_width': 640},
+    'medium': {'jpeg_quality': 70, 'max_width': 1280},
+    'high': {'jpeg_quality': 90, 'max_width': None},
+}
+DEFAULT_QUALITY = 'high'
+
+MULTIPART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MULTIPART_FOOTER = b'\r\n'
+
+# seq: capture sequence number the frame was encoded from
+# payload: the multipart-framed bytes, ready to be yielded as-is
+# jpeg: zero-copy view of the bare JPEG inside payload
+# captured_at: time.monotonic() the frame's packet arrived from the camera, or None
+EncodedFrame = namedtuple('EncodedFrame', ['seq', 'payload', 'jpeg', 'captured_at'], defaults=(None,))
+
+
+def encode_jpeg(frame, quality=DEFAULT_QUALITY, width=None):
+    """
+    Encode a BGR frame as JPEG for a quality level
+    :param frame: Decoded frame
+    :param quality: One of QUALITY_PROFILES
+    :param width: Scale down to this width instead of the profile's maximum
+    :return: JPEG buffer (numpy array), or None if encoding failed
+    """
+    profile = QUALITY_PROFILES[quality]
+    max_width = width or profile['max_width']
+    height, width = frame.shape[:2]
+    if max_width and width > max_width:
+        frame = cv2.resize(frame, (max_width, height * max_width // width),
+                           interpolation=cv2.INTER_AREA)
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, profile['jpeg_quality']])
+    return buffer if ret else None
+
+
+def frame_multipart(jpeg_buffer, seq=0, captured_at=None):
+    """Wrap an encoded JPEG in multipart framing, keeping a view of the JPEG"""
+    payload = b''.join((MULTIPART_HEADER, jpeg_buffer, MULTIPART_FOOTER))
+    jpeg = memoryview(payload)[len(MULTIPART_HEADER):len(payload) - len(MULTIPART_FOOTER)]
+    return EncodedFrame(seq, payload, jpeg, captured_at)
+
+
+class FrameCache:
+    """
+    Latest encoded frame of a camera, one entry per quality level. Each captured
+    frame is encoded once per level that currently has a watcher, and every
+    generator yields the same immutable bytes object.
+    """
+
+    def __init__(self, camera_name='', metrics=None):
+        self.camera_name = camera_name
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._watchers = {quality: 0 for quality in QUALITY_PROFILES}
+        self._frames = {}
+
+    def acquire(self, quality):
+        with self._lock:
+            self._watchers[quality] += 1
+
+    def release(self, quality):
+        with self._lock:
+            self._watchers[quality] = max(0, self._watchers[quality] - 1)
+            if self._watchers[quality] == 0:
+                self._frames.pop(quality, None)
+
+    def active_qualities(self):
+        with self._lock:
+            return [quality for quality, count in self._watchers.items() if count > 0]
+
+    def update(self, seq, frame, captured_at=None):
+        """Encode a newly captured frame for every watched quality level"""
+        for quality in self.active_qualities():
+            start = time.perf_counter()
+            buffer = encode_jpeg(frame, quality)
+            if self.metrics is not None:
+                self.metrics.encode_latency.observe(time.perf_counter() - start)
+            if buffer is None:
+                logger.error(f"Failed to encode {quality} frame from {self.camera_name}.")
+                continue
+            encoded = frame_multipart(buffer, seq, captured_at)
+            with self._lock:
+                # The last watcher may have left while this frame was encoding
+                if self._watchers[quality] > 0:
+                    self._frames[quality] = encoded
+
+    def get(self, quality):
+        """Return the latest EncodedFrame for a quality level, or None"""
+        return self._frames.get(quality)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
@@ -0,0 +1,187 @@
+import logging
+import struct
+import threading
+import time
+from flask import request
+from flask_login import current_user
+from flask_socketio import Namespace
+from camera_hub import get_hub
+from frame_cache import DEFAULT_QUALITY, QUALITY_PROFILES
+
+logger = logging.getLogger(__name__)
+
+FRAMES_NAMESPACE = '/frames'
+
+# Every binary 'frame' message starts with the camera id and frame seq
+# (big-endian uint32 each); the rest of the message is the bare JPEG
+FRAME_HEADER = struct.Struct('>II')
+
+# Seconds to wait for a client's ack before sending that camera's next frame anyway
+ACK_TIMEOUT = 5.0
+
+# Longest the sender sleeps without a frame notification
+IDLE_WAIT = 1.0
+
+
+class FrameConnection:
+    """
+    One browser's WebSocket carrying frames from any number of cameras.
+
+    Each camera has at most one frame in flight: the next one goes out only
+    after the client has acked the last (i.e. drawn it), so a camera the
+    client can't keep up with skips to the newest frame instead of queueing.
+    A single sender thread serves all of the connection's cameras.
+    """
+
+    def __init__(self, socketio, sid, namespace, client=None):
+        self.socketio = socketio
+        self.sid = sid
+        self.namespace = namespace
+        self.client = client
+        self.connected = True
+        self._subscriptions = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._send_loop, name=f'frames-{sid}', daemon=True)
+        self._thread.start()
+
+    def _notify(self, seq):
+        # Called on a hub's decoder thread
+        self._wake.set()
+
+    def subscribe(self, camera_id, camera_settings, quality, max_fps):
+        """Start sending a camera, or change its quality / frame rate"""
+        self.unsubscribe(camera_id)
+        hub = get_hub(camera_id, camera_settings)
+        subscription = hub.subscribe(quality, max_fps, self.client)
+        hub.add_frame_notifier(self._notify)
+        with self._lock:
+            self._subscriptions[camera_id] = subscription
+        self._wake.set()
+
+    def unsubscribe(self, camera_id):
+        with self._lock:
+            subscription = self._subscriptions.pop(camera_id, None)
+            self._in_flight.pop(camera_id, None)
+        if subscription is not None:
+            subscription.hub.remove_frame_notifier(self._notify)
+            subscription.close()
+
+    def ack(self, camera_id):
+        with self._lock:
+            self._in_flight.pop(camera_id, None)
+        self._wake.set()
+
+    def close(self):
+        self.connected = False
+        self._wake.set()
+        with self._lock:
+            camera_ids = list(self._subscriptions)
+        for camera_id in camera_ids:
+            self.unsubscribe(camera_id)
+
+    def _send_loop(self):
+        while self.connected:
+            wait = self._send_due()
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def _send_due(self):
+        """Send every camera that has a new frame and room for it; returns how long to sleep"""
+        now = time.monotonic()
+        wait = IDLE_WAIT
+        with self._lock:
+            subscriptions = list(self._subscriptions.items())
+        for camera_id, subscription in subscriptions:
+            with self._lock:
+                sent_at = self._in_flight.get(camera_id)
+                if sent_at is not None and now - sent_at < ACK_TIMEOUT:
+                    continue
+            delay = subscription.pace_delay()
+            if delay:
+                wait = min(wait, delay)
+                continue
+            encoded = subscription.take_encoded()
+            if encoded is None:
+                continue
+            with self._lock:
+                if self._subscriptions.get(camera_id) is not subscription:
+                    continue
+                self._in_flight[camera_id] = now
+            try:
+                self.socketio.emit('frame', FRAME_HEADER.pack(camera_id, encoded.seq) + encoded.jpeg,
+                                   to=self.sid, namespace=self.namespace)
+            except Exception as e:
+                logger.error(f"Error sending frame to {self.client}: {str(e)}")
+        return wait
+
+
+class FrameNamespace(Namespace):
+    """
+    Socket.IO namespace multiplexing live JPEG frames from several cameras
+    over one connection. Clients send:
+
+        subscribe    {'camera': id, 'quality': 'low'|'medium'|'high', 'fps': n}
+        unsubscribe  {'camera': id}
+        ack          {'camera': id}   once the last frame of that camera is drawn
+
+    and receive binary 'frame' messages (FRAME_HEADER + JPEG).
+    """
+
+    def __init__(self, socketio, load_camera_settings, fps_options, namespace=FRAMES_NAMESPACE):
+        super().__init__(namespace)
+        self.socketio = socketio
+        self.load_camera_settings = load_camera_settings
+        self.fps_options = fps_options
+        self.connections = {}
+
+    def on_connect(self):
+        if not current_user.is_authenticated:
+            return False
+        self.connections[request.sid] = FrameConnection(self.socketio, request.sid, self.namespace,
+                                                        request.remote_addr)
+        logger.info(f"Frame socket opened by {request.remote_addr}")
+
+    def on_disconnect(self):
+        connection = self.connections.pop(request.sid, None)
+        if connection is not None:
+            connection.close()
+            logger.info(f"Frame socket closed by {connection.client}")
+
+    def on_subscribe(self, data):
+        connection = self.connections.get(request.sid)
+        if connection is None:
+            return {'error': 'Not connected'}
+        try:
+            camera_id = int(data['camera'])
+            quality = data.get('quality', DEFAULT_QUALITY)
+            max_fps = int(data.get('fps', self.fps_options[-1]))
+        except (KeyError, TypeError, ValueError):
+            return {'error': 'Invalid subscription'}
+        if quality not in QUALITY_PROFILES:
+            return {'error': 'Unknown quality'}
+        if max_fps not in self.fps_options:
+            return {'error': 'Unsupported fps'}
+
+        camera_settings = self.load_camera_settings()
+        if not 0 <= camera_id < len(camera_settings):
+            return {'error': 'Camera not found'}
+        try:
+            connection.subscribe(camera_id, camera_settings[camera_id], quality, max_fps)
+            return {'status': 'subscribed', 'camera': camera_id}
+        except Exception as e:
+            logger.error(f"Error subscribing to camera {camera_id}: {str(e)}")
+            return {'error': str(e)}
+
+    def on_unsubscribe(self, data):
+        connection = self.connections.get(request.sid)
+        if connection is not None and isinstance(data, dict) and 'camera' in data:
+            connection.unsubscribe(int(data['camera']))
+            return {'status': 'unsubscribed', 'camera': int(data['camera'])}
+        return {'error': 'Invalid unsubscribe'}
+
+    def on_ack(self, data):
+        connection = self.connections.get(request.sid)
+        if connection is not None and isinstance(data, dict) and 'camera' in data:
+            connection.ack(int(data['camera']))
@@ -0,0 +1,307 @@
+import bisect
+import threading
+import time
+from collections import deque
+
+# Latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 2.5)
+
+# Buckets for the time a capture takes to recover from a failure, in seconds
+RECOVERY_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+# Shortest span rates are measured over; a rate covers the time since the
+# newest sample that is at least this old
+RATE_WINDOW = 10.0
+
+# Seconds without a packet before a running camera counts as stalled
+STALL_SECONDS = 2.0
+
+# Measured over configured frame rate at or above which the signal is strong
+# (first) or moderate (second); anything lower is weak
+SIGNAL_THRESHOLDS = (0.9, 0.5)
+
+
+class _PerThread:
+    """
+    Base for metrics written from hot loops. Each writing thread gets its own
+    cell, so a write is a thread-local lookup plus an add on a list only that
+    thread touches: no lock, and no lost updates between threads. Reads sum
+    the cells; cells of finished threads are folded into ``_retired``.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cells = []
+        self._retired = [0] * size
+
+    def _cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            pass
+        cell = [0] * self._size
+        with self._lock:
+            self._retire_locked()
+            self._cells.append((threading.current_thread(), cell))
+        self._local.cell = cell
+        return cell
+
+    def _retire_locked(self):
+        live = []
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                live.append((thread, cell))
+            else:
+                self._retired = [a + b for a, b in zip(self._retired, cell)]
+        self._cells = live
+
+    def _totals(self):
+        with self._lock:
+            self._retire_locked()
+            totals = list(self._retired)
+            for _, cell in self._cells:
+                totals = [a + b for a, b in zip(totals, cell)]
+        return totals
+
+
+class Counter(_PerThread):
+    """Monotonic count, e.g. packets or bytes"""
+
+    def __init__(self):
+        super().__init__(1)
+        self._samples = deque([(time.monotonic(), 0)])
+        self._samples_lock = threading.Lock()
+
+    def add(self, amount=1):
+        self._cell()[0] += amount
+
+    @property
+    def value(self):
+        return self._totals()[0]
+
+    def rate(self):
+        """:return: Increase per second over roughly the last RATE_WINDOW seconds"""
+        now = time.monotonic()
+        value = self.value
+        with self._samples_lock:
+            samples = self._samples
+            if now - samples[-1][0] >= 1.0:
+                samples.append((now, value))
+            while len(samples) > 1 and samples[1][0] <= now - RATE_WINDOW:
+                samples.popleft()
+            since, start = samples[0]
+        return (value - start) / (now - since) if now > since else 0.0
+
+
+class Histogram(_PerThread):
+    """Distribution of observed values in fixed buckets, as Prometheus histograms"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        # Cell layout: sum, count, then one slot per bucket and one for +Inf
+        super().__init__(len(buckets) + 3)
+        self.buckets = buckets
+
+    def observe(self, value):
+        cell = self._cell()
+        cell[0] += value
+        cell[1] += 1
+        cell[2 + bisect.bisect_left(self.buckets, value)] += 1
+
+    def snapshot(self):
+        """:return: (sum, count, per-bucket counts including +Inf)"""
+        totals = self._totals()
+        return totals[0], totals[1], totals[2:]
+
+    def quantile(self, q, snapshot=None):
+        """:return: Estimated q-quantile, interpolated within its bucket, or None without data"""
+        _, count, counts = snapshot or self.snapshot()
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for upper, bucket_count in zip(self.buckets + (None,), counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if upper is None:
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            if upper is not None:
+                lower = upper
+        return lower
+
+
+class CameraMetrics:
+    """
+    Pipeline instrumentation for one camera. The hub, its decoder, frame
+    cache and viewer subscriptions write these from their own threads; the
+    hub supplies point-in-time values (running, subscribers, ...) through
+    ``gauges``, which is only called when metrics are read.
+    """
+
+    def __init__(self, camera_id, gauges):
+        self.camera_id = camera_id
+        self.gauges = gauges
+        self.packets = Counter()
+        self.bytes_in = Counter()
+        self.connects = Counter()
+        self.capture_errors = Counter()
+        self.stalls = Counter()
+        self.decoder_dropped = Counter()
+        self.frames_published = Counter()
+        self.frames_delivered = Counter()
+        self.frames_dropped = Counter()
+        self.bytes_out = Counter()
+        self.decode_latency = Histogram()
+        self.encode_latency = Histogram()
+        self.delivery_latency = Histogram()
+        self.recovery_time = Histogram(RECOVERY_BUCKETS)
+
+    def signal_strength(self, gauges, fps):
+        """
+        IP cameras report no radio signal, so this rates how well the stream
+        is arriving: stalled or failing streams are Weak, otherwise the
+        received frame rate against the configured one decides.
+        :return: 'Strong', 'Moderate' or 'Weak', or None if not capturing
+        """
+        if not gauges['running']:
+            return None
+        age = gauges['last_packet_age']
+        if age is None or age > STALL_SECONDS or self.capture_errors.rate() > 0:
+            return 'Weak'
+        ratio = fps / gauges['configured_fps'] if gauges['configured_fps'] else 1.0
+        if ratio >= SIGNAL_THRESHOLDS[0]:
+            return 'Strong'
+        if ratio >= SIGNAL_THRESHOLDS[1]:
+            return 'Moderate'
+        return 'Weak'
+
+    def status(self):
+        """Current rates and totals, as served by the /status endpoints"""
+        gauges = self.gauges()
+        fps = self.packets.rate() if gauges['running'] else 0.0
+
+        def latency_ms(histogram):
+            snapshot = histogram.snapshot()
+            total, count, _ = snapshot
+            if not count:
+                return None
+            return {
+                'avg': round(total / count * 1000, 1),
+                'p50': round(histogram.quantile(0.5, snapshot) * 1000, 1),
+                'p95': round(histogram.quantile(0.95, snapshot) * 1000, 1),
+            }
+
+        recovery_total, recoveries, _ = self.recovery_time.snapshot()
+
+        return {
+            'name': gauges['name'],
+            'running': gauges['running'],
+            'state': gauges['state'],
+            'fps': round(fps, 1),
+            'in_mbps': round(self.bytes_in.rate() * 8 / 1e6, 2),
+            'out_mbps': round(self.bytes_out.rate() * 8 / 1e6, 2),
+            'subscribers': gauges['subscribers'],
+            'reconnects': max(0, self.connects.value - 1),
+            'capture_errors': self.capture_errors.value,
+            'stalls': self.stalls.value,
+            'outage_seconds': gauges['outage_seconds'],
+            'recovery': {
+                'count': recoveries,
+                'avg_seconds': round(recovery_total / recoveries, 2) if recoveries else None,
+                'p95_seconds': round(self.recovery_time.quantile(0.95), 2) if recoveries else None,
+            },
+            'decoder_dropped': self.decoder_dropped.value,
+            'frames_dropped': self.frames_dropped.value,
+            'decode_latency_ms': latency_ms(self.decode_latency),
+            'encode_latency_ms': latency_ms(self.encode_latency),
+            'delivery_latency_ms': latency_ms(self.delivery_latency),
+            'signal': self.signal_strength(gauges, fps),
+        }
+
+
+_cameras = {}
+_cameras_lock = threading.Lock()
+
+
+def register(camera_metrics):
+    """Make a camera's metrics visible to registered() and render_prometheus()"""
+    with _cameras_lock:
+        _cameras[camera_metrics.camera_id] = camera_metrics
+
+
+def registered():
+    with _cameras_lock:
+        return dict(_cameras)
+
+
+# Metric name, help text, and the CameraMetrics attribute or gauge key it reads
+_COUNTERS = (
+    ('webcam_capture_packets_total', 'Frames (access units) received from the camera', 'packets'),
+    ('webcam_capture_bytes_total', 'Compressed bytes received from the camera', 'bytes_in'),
+    ('webcam_capture_connects_total', 'Connections made to the camera', 'connects'),
+    ('webcam_capture_errors_total', 'Captures that ended with an error or a lost stream', 'capture_errors'),
+    ('webcam_capture_stalls_total', 'Captures or decoders restarted after going silent', 'stalls'),
+    ('webcam_decoder_dropped_total', 'Packets skipped because the decoder fell behind', 'decoder_dropped'),
+    ('webcam_frames_published_total', 'Decoded frames converted and encoded for viewers', 'frames_published'),
+    ('webcam_frames_delivered_total', 'Frames handed to viewers', 'frames_delivered'),
+    ('webcam_frames_dropped_total', 'Frames viewers skipped because they were too slow', 'frames_dropped'),
+    ('webcam_delivered_bytes_total', 'Encoded bytes handed to viewers', 'bytes_out'),
+)
+_HISTOGRAMS = (
+    ('webcam_decode_latency_seconds', 'Packet arrival to decoded frame', 'decode_latency'),
+    ('webcam_encode_latency_seconds', 'JPEG encode time per quality level', 'encode_latency'),
+    ('webcam_delivery_latency_seconds', 'Packet arrival to frame handed to a viewer', 'delivery_latency'),
+    ('webcam_capture_recovery_seconds', 'Last packet before a failure to first packet after reconnecting',
+     'recovery_time'),
+)
+_GAUGES = (
+    ('webcam_capture_running', 'Whether the capture is connected or connecting', 'running'),
+    ('webcam_capture_up', 'Whether packets are arriving (not connecting or reconnecting)', 'up'),
+    ('webcam_capture_fps', 'Measured frame rate of the camera', 'fps'),
+    ('webcam_subscribers', 'Attached viewers', 'subscribers'),
+    ('webcam_frame_listeners', 'Attached frame listeners (motion detection)', 'frame_listeners'),
+    ('webcam_packet_sinks', 'Attached packet sinks (recorders)', 'packet_sinks'),
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """:return: Every camera's metrics in the Prometheus text exposition format"""
+    cameras = sorted(registered().items())
+    samples = []
+    for camera_id, camera_metrics in cameras:
+        gauges = camera_metrics.gauges()
+        samples.append((camera_metrics, gauges, f'camera="{camera_id}",name="{_escape(gauges["name"])}"'))
+    lines = []
+    for name, help_text, attribute in _COUNTERS:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for camera_metrics, _, labels in samples:
+            lines.append(f'{name}{{{labels}}} {getattr(camera_metrics, attribute).value}')
+    for name, help_text, key in _GAUGES:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for _, gauges, labels in samples:
+            lines.append(f'{name}{{{labels}}} {_number(gauges[key])}')
+    for name, help_text, attribute in _HISTOGRAMS:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for camera_metrics, _, labels in samples:
+            histogram = getattr(camera_metrics, attribute)
+            total, count, counts = histogram.snapshot()
+            cumulative = 0
+            for upper, bucket_count in zip(histogram.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{labels},le="{upper}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {_number(float(total))}')
+            lines.append(f'{name}_count{{{labels}}} {count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,249 @@
+import cv2
+import logging
+import math
+import numpy as np
+import os
+import threading
+import time
+from collections import namedtuple
+from camera_hub import get_hub
+from frame_cache import QUALITY_PROFILES, encode_jpeg, frame_multipart
+
+logger = logging.getLogger(__name__)
+
+# Canvas width of a mosaic unless the request sets one; the height follows
+# from the number of rows
+MOSAIC_WIDTH = int(os.environ.get('MOSAIC_WIDTH', 1280))
+MOSAIC_MIN_WIDTH = 160
+MOSAIC_MAX_WIDTH = 3840
+
+# Frames per second a mosaic is composited and encoded at, and the most a
+# request may ask for
+MOSAIC_FPS = float(os.environ.get('MOSAIC_FPS', 5))
+MOSAIC_MAX_FPS = 15.0
+
+# JPEG quality level of the mosaic stream unless the request sets one
+MOSAIC_QUALITY = 'medium'
+
+# Most cameras one mosaic can tile
+MOSAIC_MAX_TILES = 36
+
+# Width over height of a tile; frames of another shape are letterboxed
+TILE_ASPECT = 16 / 9
+
+# cameras: tuple of camera ids, in tile order (left to right, top to bottom)
+# columns: tiles per row
+# width: requested canvas width in pixels
+# fps: composite and encode rate
+# quality: one of QUALITY_PROFILES
+MosaicLayout = namedtuple('MosaicLayout', ['cameras', 'columns', 'width', 'fps', 'quality'])
+
+
+def parse_mosaic_args(args, camera_count):
+    """
+    Validate mosaic query parameters
+    :param args: Mapping of parameter name to string value
+    :param camera_count: Number of configured cameras
+    :return: MosaicLayout; raises ValueError if invalid
+    """
+    if args.get('cameras'):
+        cameras = []
+        for value in args['cameras'].split(','):
+            camera_id = int(value)
+            if not 0 <= camera_id < camera_count:
+                raise ValueError(f'Camera {camera_id} not found')
+            if camera_id not in cameras:
+                cameras.append(camera_id)
+    else:
+        cameras = list(range(camera_count))
+    if not cameras:
+        raise ValueError('No cameras to show')
+    if len(cameras) > MOSAIC_MAX_TILES:
+        raise ValueError(f'At most {MOSAIC_MAX_TILES} cameras fit in a mosaic')
+
+    columns = int(args.get('columns') or math.ceil(math.sqrt(len(cameras))))
+    if not 1 <= columns <= len(cameras):
+        raise ValueError(f'columns must be between 1 and {len(cameras)}')
+    width = int(args.get('width') or MOSAIC_WIDTH)
+    if not MOSAIC_MIN_WIDTH <= width <= MOSAIC_MAX_WIDTH:
+        raise ValueError(f'width must be between {MOSAIC_MIN_WIDTH} and {MOSAIC_MAX_WIDTH}')
+    fps = float(args.get('fps') or MOSAIC_FPS)
+    if not 0 < fps <= MOSAIC_MAX_FPS:
+        raise ValueError(f'fps must be above 0 and at most {MOSAIC_MAX_FPS:g}')
+    quality = args.get('quality') or MOSAIC_QUALITY
+    if quality not in QUALITY_PROFILES:
+        raise ValueError('Unknown quality')
+    return MosaicLayout(tuple(cameras), columns, width, fps, quality)
+
+
+class Mosaic:
+    """
+    Several cameras tiled into one MJPEG stream, shared by every viewer of
+    the same layout.
+
+    Each camera's hub is asked for frames no wider than a tile at the mosaic's
+    frame rate, so its decoder can run small and slow. The hub's frame
+    listener only keeps a reference to the newest frame; a compositor thread
+    then wakes at the mosaic's own rate, redraws just the tiles whose camera
+    produced a frame since the last tick into a canvas allocated once, and
+    encodes the canvas only if some tile changed. One JPEG per tick replaces
+    one decode and one JPEG stream per camera in the browser.
+    """
+
+    def __init__(self, layout, camera_settings):
+        self.layout = layout
+        self.hubs = [get_hub(camera_id, camera_settings[camera_id]) for camera_id in layout.cameras]
+        rows = math.ceil(len(self.hubs) / layout.columns)
+        # Even sizes keep chroma-subsampled JPEG blocks aligned with the tiles
+        self.tile_width = max(2, layout.width // layout.columns // 2 * 2)
+        self.tile_height = max(2, int(self.tile_width / TILE_ASPECT) // 2 * 2)
+        self.canvas = np.zeros((rows * self.tile_height, layout.columns * self.tile_width, 3), dtype=np.uint8)
+        self._latest = [None] * len(self.hubs)
+        self._drawn = [None] * len(self.hubs)
+        self._fits = [None] * len(self.hubs)
+        self._listeners = [self._make_listener(index) for index in range(len(self.hubs))]
+        self._new_frame = threading.Condition()
+        self._encoded = None
+        self._seq = 0
+        self._frame_notifiers = []
+        self._viewers = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def name(self):
+        return ','.join(str(camera_id) for camera_id in self.layout.cameras)
+
+    def _make_listener(self, index):
+        def listener(seq, yuv):
+            # On the camera's decoder thread: just keep the newest frame
+            self._latest[index] = yuv
+        return listener
+
+    def start(self):
+        self._stop.clear()
+        for hub, listener in zip(self.hubs, self._listeners):
+            hub.add_frame_listener(listener, max_width=self.tile_width, max_fps=self.layout.fps)
+        self._thread = threading.Thread(target=self._run, name=f'mosaic-{self.name}', daemon=True)
+        self._thread.start()
+        logger.info(f"Mosaic of cameras {self.name} started: {self.canvas.shape[1]}x{self.canvas.shape[0]} "
+                    f"at {self.layout.fps:g} fps")
+
+    def stop(self):
+        self._stop.set()
+        for hub, listener in zip(self.hubs, self._listeners):
+            hub.remove_frame_listener(listener)
+        logger.info(f"Mosaic of cameras {self.name} stopped")
+
+    def add_frame_notifier(self, notifier):
+        """Call ``notifier(seq)`` on the compositor thread after each new mosaic frame"""
+        with self._new_frame:
+            self._frame_notifiers = self._frame_notifiers + [notifier]
+
+    def remove_frame_notifier(self, notifier):
+        with self._new_frame:
+            self._frame_notifiers = [n for n in self._frame_notifiers if n != notifier]
+
+    def wait_for_frame(self, last_seq, timeout=5.0):
+        """:return: The newest EncodedFrame after ``last_seq``, or None on timeout"""
+        with self._new_frame:
+            self._new_frame.wait_for(lambda: self._seq > last_seq, timeout)
+            if self._seq > last_seq:
+                return self._encoded
+        return None
+
+    def latest(self):
+        """:return: The newest EncodedFrame, or None before the first one"""
+        return self._encoded
+
+    def _run(self):
+        interval = 1.0 / self.layout.fps
+        next_tick = time.monotonic()
+        # The first tick encodes the empty grid, so viewers see it at once
+        changed = True
+        while not self._stop.is_set():
+            try:
+                if self._composite() or changed:
+                    self._publish()
+                    changed = False
+            except Exception as e:
+                logger.error(f"Mosaic of cameras {self.name} error: {str(e)}")
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # Fell behind; skip the missed ticks instead of bursting
+                next_tick = time.monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+    def _composite(self):
+        """Draw tiles whose camera has a new frame; :return: True if any was drawn"""
+        changed = False
+        for index, yuv in enumerate(self._latest):
+            if yuv is None or yuv is self._drawn[index]:
+                continue
+            self._drawn[index] = yuv
+            self._draw_tile(index, yuv)
+            changed = True
+        return changed
+
+    def _draw_tile(self, index, yuv):
+        row, column = divmod(index, self.layout.columns)
+        top = row * self.tile_height
+        left = column * self.tile_width
+        source_height, source_width = yuv.shape[0] * 2 // 3, yuv.shape[1]
+
+        fit = self._fits[index]
+        if fit is None or fit[0] != (source_width, source_height):
+            # Letterbox into the tile; blank it once so old bars don't linger
+            scale = min(self.tile_width / source_width, self.tile_height / source_height)
+            width = max(1, min(self.tile_width, round(source_width * scale)))
+            height = max(1, min(self.tile_height, round(source_height * scale)))
+            y = top + (self.tile_height - height) // 2
+            x = left + (self.tile_width - width) // 2
+            fit = self._fits[index] = ((source_width, source_height), width, height, y, x)
+            self.canvas[top:top + self.tile_height, left:left + self.tile_width] = 0
+        _, width, height, y, x = fit
+
+        frame = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
+        if (width, height) != (source_width, source_height):
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        self.canvas[y:y + height, x:x + width] = frame
+
+    def _publish(self):
+        buffer = encode_jpeg(self.canvas, self.layout.quality, self.canvas.shape[1])
+        if buffer is None:
+            logger.error(f"Failed to encode mosaic of cameras {self.name}")
+            return
+        with self._new_frame:
+            self._seq += 1
+            self._encoded = frame_multipart(buffer, self._seq)
+            self._new_frame.notify_all()
+        for notifier in self._frame_notifiers:
+            notifier(self._seq)
+
+
+_mosaics = {}
+_mosaics_lock = threading.Lock()
+
+
+def open_mosaic(layout, camera_settings):
+    """:return: The Mosaic for ``layout``, started if it has no other viewers"""
+    with _mosaics_lock:
+        mosaic = _mosaics.get(layout)
+        if mosaic is None:
+            mosaic = _mosaics[layout] = Mosaic(layout, camera_settings)
+            mosaic.start()
+        mosaic._viewers += 1
+        return mosaic
+
+
+def close_mosaic(mosaic):
+    """Detach a viewer; the last one stops the mosaic and releases its cameras"""
+    with _mosaics_lock:
+        mosaic._viewers -= 1
+        if mosaic._viewers > 0:
+            return
+        if _mosaics.get(mosaic.layout) is mosaic:
+            del _mosaics[mosaic.layout]
+    mosaic.stop()
@@ -0,0 +1,133 @@
+import logging
+import numpy as np
+import time
+from threading import Thread
+
+logger = logging.getLogger(__name__)
+
+# Defaults for a camera's optional ``motion`` settings block
+DEFAULT_MOTION_SETTINGS = {
+    'every_n_frames': 5,  # analyse one decoded frame out of N
+    'width': 240,  # analyse frames at about this many pixels across
+    'pixel_threshold': 25,  # grey-level change that counts a pixel as moving
+    'min_area': 0.01,  # fraction of unmasked pixels that must move
+    'trigger_frames': 2,  # consecutive moving analyses before motion starts
+    'cooldown': 10.0,  # seconds without motion before motion ends
+    'learning_rate': 0.05,  # background model update rate
+    'mask': [],  # [x, y, w, h] rectangles (0-1 of the frame) to ignore
+}
+
+
+class MotionDetector:
+    """
+    Background-subtraction motion detector working on downscaled grayscale
+    frames. All per-frame work is vectorized NumPy into buffers that are
+    allocated once, when the first frame arrives.
+    """
+
+    def __init__(self, motion_settings=None):
+        self.settings = dict(DEFAULT_MOTION_SETTINGS)
+        self.settings.update(motion_settings or {})
+        self.background = None
+        self.motion_ratio = 0.0
+        self.is_moving = False
+        self.last_motion_time = None
+        self._diff = None
+        self._moving = None
+        self._include = None
+        self._included_pixels = 0
+        self._streak = 0
+
+    def _allocate(self, shape):
+        self.background = np.empty(shape, dtype=np.float32)
+        self._diff = np.empty(shape, dtype=np.float32)
+        self._moving = np.empty(shape, dtype=np.bool_)
+        self._include = np.ones(shape, dtype=np.bool_)
+        height, width = shape
+        for x, y, w, h in self.settings['mask']:
+            self._include[int(y * height):int((y + h) * height), int(x * width):int((x + w) * width)] = False
+        self._included_pixels = max(1, int(np.count_nonzero(self._include)))
+
+    def analyze(self, gray, now=None):
+        """
+        Feed one downscaled grayscale frame
+        :param gray: 2D uint8 array (may be a strided view)
+        :param now: Timestamp of the frame, defaults to time.monotonic()
+        :return: True while motion is in progress
+        """
+        now = time.monotonic() if now is None else now
+        if self.background is None or self.background.shape != gray.shape:
+            self._allocate(gray.shape)
+            self.background[...] = gray
+            return self.is_moving
+
+        np.subtract(gray, self.background, out=self._diff)
+        np.abs(self._diff, out=self._diff)
+        np.greater(self._diff, self.settings['pixel_threshold'], out=self._moving)
+        np.logical_and(self._moving, self._include, out=self._moving)
+        self.motion_ratio = np.count_nonzero(self._moving) / self._included_pixels
+
+        # Running-average background: bg += rate * (gray - bg)
+        rate = self.settings['learning_rate']
+        np.multiply(self.background, 1.0 - rate, out=self.background)
+        np.multiply(gray, rate, out=self._diff)
+        self.background += self._diff
+
+        if self.motion_ratio >= self.settings['min_area']:
+            self._streak += 1
+            if self._streak >= self.settings['trigger_frames']:
+                self.is_moving = True
+                self.last_motion_time = now
+        else:
+            self._streak = 0
+            if self.is_moving and now - self.last_motion_time >= self.settings['cooldown']:
+                self.is_moving = False
+        return self.is_moving
+
+
+class MotionMonitor:
+    """
+    Runs a MotionDetector on a camera hub's decoded frames and calls
+    ``on_start`` / ``on_stop`` (in a separate thread) when motion begins and ends.
+    """
+
+    def __init__(self, hub, on_start, on_stop):
+        self.hub = hub
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.detector = MotionDetector(hub.camera_settings.get('motion'))
+        self.every_n = max(1, int(self.detector.settings['every_n_frames']))
+        self.width = max(1, int(self.detector.settings['width']))
+        self.running = False
+
+    @property
+    def is_moving(self):
+        return self.detector.is_moving
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            # Frames are subsampled to about ``width`` anyway, so let the hub decode them small
+            self.hub.add_frame_listener(self._on_frame, max_width=self.width)
+        return self
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.hub.remove_frame_listener(self._on_frame)
+
+    def _on_frame(self, seq, yuv):
+        if seq % self.every_n:
+            return
+        # The first two thirds of an I420 frame are the Y plane: grayscale for free
+        height = yuv.shape[0] * 2 // 3
+        step = max(1, yuv.shape[1] // self.width)
+        gray = yuv[:height:step, ::step]
+        was_moving = self.detector.is_moving
+        moving = self.detector.analyze(gray)
+        if moving and not was_moving:
+            logger.info(f"Motion started on {self.hub.name} ({self.detector.motion_ratio:.1%} of frame)")
+            Thread(target=self.on_start, name=f'motion-start-{self.hub.camera_id}').start()
+        elif was_moving and not moving:
+            logger.info(f"Motion ended on {self.hub.name}")
+            Thread(target=self.on_stop, name=f'motion-stop-{self.hub.camera_id}').start()
@@ -0,0 +1,271 @@
+import logging
+import numpy as np
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN', 'ffmpeg')
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# seq: per-source packet counter
+# timestamp: time.monotonic() when the access unit arrived
+# data: one complete Annex-B access unit (one frame), AUD first
+# keyframe: True if the access unit starts a GOP (IDR / IRAP)
+Packet = namedtuple('Packet', ['seq', 'timestamp', 'data', 'keyframe'])
+
+# Per-codec bitstream details. Every access unit is prefixed with an access
+# unit delimiter so frames can be split with a single bytes.find().
+CODECS = {
+    'h264': {
+        'format': 'h264',
+        'bsf': 'h264_mp4toannexb,dump_extra=freq=keyframe,h264_metadata=aud=insert',
+        'aud': b'\x00\x00\x00\x01\x09',
+        'nal_type': lambda header: header & 0x1f,
+        'vcl_types': range(1, 6),
+        'keyframe_types': (5,),
+    },
+    'hevc': {
+        'format': 'hevc',
+        'bsf': 'hevc_mp4toannexb,dump_extra=freq=keyframe,hevc_metadata=aud=insert',
+        'aud': b'\x00\x00\x00\x01\x46\x01',
+        'nal_type': lambda header: (header >> 1) & 0x3f,
+        'vcl_types': range(0, 32),
+        'keyframe_types': range(16, 22),
+    },
+}
+
+
+def is_keyframe(data, codec='h264'):
+    """Return True if the first picture in an access unit is a keyframe"""
+    spec = CODECS[codec]
+    pos = data.find(b'\x00\x00\x01')
+    while pos != -1 and pos + 3 < len(data):
+        nal_type = spec['nal_type'](data[pos + 3])
+        if nal_type in spec['vcl_types']:
+            return nal_type in spec['keyframe_types']
+        pos = data.find(b'\x00\x00\x01', pos + 3)
+    return False
+
+
+def input_args(url):
+    """ffmpeg input options for a camera URL"""
+    if url.startswith('rtsp://') or url.startswith('rtsps://'):
+        return ['-rtsp_transport', 'tcp', '-i', url]
+    if '://' not in url:
+        # A local file standing in for a camera is read at its native rate
+        return ['-re', '-i', url]
+    return ['-i', url]
+
+
+class PacketSource:
+    """
+    One stream-copy session to a camera. ffmpeg pulls the stream and remuxes
+    it to Annex-B without decoding; this class splits it into access units.
+    """
+
+    def __init__(self, url, codec='h264'):
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported codec: {codec}")
+        self.url = url
+        self.codec = codec
+        self.process = None
+
+    def open(self):
+        spec = CODECS[self.codec]
+        cmd = [FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin',
+               *input_args(self.url),
+               '-map', '0:v:0', '-c', 'copy', '-bsf:v', spec['bsf'],
+               '-f', spec['format'], 'pipe:1']
+        self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, bufsize=0)
+        return self
+
+    def packets(self):
+        """Generator yielding Packet tuples until the stream ends"""
+        spec = CODECS[self.codec]
+        aud = spec['aud']
+        stdout = self.process.stdout
+        buffer = bytearray()
+        search_from = 1
+        seq = 0
+
+        while True:
+            chunk = stdout.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+
+            while True:
+                end = buffer.find(aud, search_from)
+                if end == -1:
+                    # Resume the search where a split marker could still start
+                    search_from = max(1, len(buffer) - len(aud) + 1)
+                    break
+                data = bytes(buffer[:end])
+                del buffer[:end]
+                search_from = 1
+                seq += 1
+                yield Packet(seq, time.monotonic(), data, is_keyframe(data, self.codec))
+
+    def interrupt(self):
+        """End a blocked packets() from another thread, e.g. to reconnect"""
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+    def close(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+
+
+class FrameDecoder:
+    """
+    Decodes a PacketSource's access units in a separate ffmpeg process and
+    hands planar I420 frames (a (height * 3 / 2, width) uint8 array whose
+    first ``height`` rows are the grayscale Y plane) to
+    ``on_frame(yuv, captured_at)``, where ``captured_at`` is the arrival time
+    of the frame's packet (or None if unknown). Only
+    runs while someone needs pixels. With ``width`` set, wider frames are
+    scaled down inside the decoder, so only the small frames cross the pipe.
+
+    With ``metrics`` (a CameraMetrics), records the time from each packet's
+    arrival to its decoded frame, and the packets skipped when behind.
+    """
+
+    def __init__(self, codec, on_frame, name='', max_pending=60, width=None, metrics=None):
+        self.codec = codec
+        self.on_frame = on_frame
+        self.name = name
+        self.width = width
+        self.metrics = metrics
+        self.process = None
+        self._pending = queue.Queue(maxsize=max_pending)
+        # Arrival times of fed packets; frames come out in the same order
+        self._arrivals = deque(maxlen=max_pending * 2)
+        self._waiting_for_keyframe = True
+        self._behind = False
+        self._stopped = False
+        self._threads = []
+
+    def start(self):
+        spec = CODECS[self.codec]
+        cmd = [FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin',
+               '-probesize', '500000', '-analyzeduration', '500000',
+               '-flags', 'low_delay', '-thread_type', 'slice',
+               '-f', spec['format'], '-i', 'pipe:0', '-vsync', '0']
+        if self.width:
+            cmd += ['-vf', f"scale='min({self.width},iw)':-2:flags=fast_bilinear"]
+        cmd += ['-pix_fmt', 'yuv420p', '-f', 'yuv4mpegpipe', 'pipe:1']
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        self._threads = [
+            threading.Thread(target=self._feed_loop, args=(self.process.stdin,),
+                             name=f'decode-feed-{self.name}', daemon=True),
+            threading.Thread(target=self._read_loop, args=(self.process.stdout,),
+                             name=f'decode-read-{self.name}', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def feed(self, packet):
+        """Queue an access unit; never blocks the capture loop"""
+        if self._waiting_for_keyframe:
+            if not packet.keyframe:
+                if self._behind and self.metrics is not None:
+                    self.metrics.decoder_dropped.add()
+                return
+            self._waiting_for_keyframe = False
+            self._behind = False
+        # Recorded first so the frame can't come out before its arrival time
+        self._arrivals.append(packet.timestamp)
+        try:
+            self._pending.put_nowait(packet)
+        except queue.Full:
+            # Decoder is behind: drop until the next GOP so it never sees a broken reference
+            self._arrivals.pop()
+            self._waiting_for_keyframe = True
+            self._behind = True
+            if self.metrics is not None:
+                self.metrics.decoder_dropped.add()
+            logger.warning(f"Decoder for {self.name} fell behind, skipping to next keyframe")
+
+    def resync(self):
+        """Skip to the next keyframe, e.g. when the packets start coming from a new connection"""
+        self._waiting_for_keyframe = True
+
+    def stop(self):
+        if self.process is None:
+            return
+        self._stopped = True
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def _feed_loop(self, stdin):
+        try:
+            while not self._stopped:
+                try:
+                    packet = self._pending.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                stdin.write(packet.data)
+                stdin.flush()
+        except (BrokenPipeError, ValueError, OSError):
+            pass
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def _read_loop(self, stdout):
+        try:
+            header = stdout.readline()
+            if not header.startswith(b'YUV4MPEG2'):
+                logger.error(f"Decoder for {self.name} produced no video")
+                return
+            fields = {token[:1]: token[1:] for token in header.split()[1:]}
+            width, height = int(fields[b'W']), int(fields[b'H'])
+            frame_size = width * height * 3 // 2
+
+            while True:
+                if not stdout.readline():
+                    break
+                # Read straight into a fresh array; consumers may keep a reference
+                yuv = np.empty((height * 3 // 2, width), dtype=np.uint8)
+                view = memoryview(yuv).cast('B')
+                received = 0
+                while received < frame_size:
+                    n = stdout.readinto(view[received:])
+                    if not n:
+                        return
+                    received += n
+                captured_at = self._arrivals.popleft() if self._arrivals else None
+                if self.metrics is not None and captured_at is not None:
+                    self.metrics.decode_latency.observe(time.monotonic() - captured_at)
+                self.on_frame(yuv, captured_at)
+        except Exception as e:
+            logger.error(f"Decoder error for {self.name}: {str(e)}")
+        finally:
+            stdout.close()
@@ -1,21 +1,91 @@
 from onvif import ONVIFCamera
+import onvif.client
 import zeep
 import logging
+import os
+import requests
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from zeep.cache import SqliteCache
+from zeep.transports import Transport
+from zeep.wsdl import Document
 
 logger = logging.getLogger(__name__)
 
+# Seconds before an ONVIF request to a camera is given up on
+ONVIF_TIMEOUT = float(os.environ.get('ONVIF_TIMEOUT', 5))
+
+# zeep's on-disk cache for WSDL/XSD documents fetched over HTTP
+WSDL_CACHE_PATH = os.environ.get('ONVIF_WSDL_CACHE',
+                                 os.path.join(tempfile.gettempdir(), 'onvif_wsdl_cache.db'))
+
+# Seconds to wait before each retry of a camera whose PTZ session failed
+PTZ_RETRY_DELAYS = (2, 5, 15, 30, 60)
+
+# Recent command latencies kept per camera for the dispatch metrics
+PTZ_LATENCY_SAMPLES = 200
+
+# PTZ status poll interval (seconds) while the camera moves and while it is idle
+STATUS_POLL_MOVING = float(os.environ.get('PTZ_STATUS_POLL_MOVING', 0.25))
+STATUS_POLL_IDLE = float(os.environ.get('PTZ_STATUS_POLL_IDLE', 2.0))
+
+# Seconds a status poller keeps running after its last read, when no one watches it
+STATUS_POLL_LINGER = 60.0
+
 def zeep_pythonvalue(self, xmlvalue):
     return xmlvalue
 
 zeep.xsd.simple.AnySimpleType.pythonvalue = zeep_pythonvalue
 
+_wsdl_documents = {}
+_wsdl_lock = threading.Lock()
+
+class SharedWsdlClient(zeep.Client):
+    """zeep client that parses each ONVIF WSDL once per process and shares it between cameras"""
+
+    def __init__(self, wsdl, *args, **kwargs):
+        with _wsdl_lock:
+            document = _wsdl_documents.get(wsdl)
+            if document is None:
+                document = Document(wsdl, kwargs.get('transport') or Transport(),
+                                    settings=kwargs.get('settings'))
+                _wsdl_documents[wsdl] = document
+        super().__init__(document, *args, **kwargs)
+
+# onvif builds one zeep client per service from these module globals
+onvif.client.Client = onvif.client.CachingClient = SharedWsdlClient
+
+def create_transport():
+    """One keep-alive HTTP connection pool shared by all of a camera's ONVIF services"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return Transport(session=session, cache=SqliteCache(path=WSDL_CACHE_PATH),
+                     timeout=ONVIF_TIMEOUT, operation_timeout=ONVIF_TIMEOUT)
+
+def is_connection_error(error):
+    """True if an ONVIF call failed talking to the camera, rather than being refused by it"""
+    while error is not None:
+        if isinstance(error, requests.exceptions.RequestException):
+            return True
+        # onvif re-raises everything as ONVIFError inside the except block
+        error = error.__cause__ or error.__context__
+    return False
+
 class PTZController:
-    def __init__(self, host, username, password):
+    def __init__(self, host, username, password, port=80, transport=None):
         try:
-            self.camera = ONVIFCamera(host, 
-                                    port=80,
+            self.host = host
+            self.camera = ONVIFCamera(host,
+                                    port=port,
                                     user=username,
-                                    passwd=password)
+                                    passwd=password,
+                                    transport=transport or create_transport())
             
             # Create media service object
             self.media = self.camera.create_media_service()
@@ -32,9 +102,9 @@ class PTZController:
             self.request.ConfigurationToken = self.ptz.GetConfigurations()[0].token
             self.ptz_configuration_options = self.ptz.GetConfigurationOptions(self.request)
 
-            logger.info("PTZ Controller initialized successfully")
+            logger.info(f"PTZ Controller initialized successfully for {host}")
         except Exception as e:
-            logger.error(f"Failed to initialize PTZ controller: {str(e)}")
+            logger.error(f"Failed to initialize PTZ controller for {host}: {str(e)}")
             raise
 
     def move_continuous(self, pan, tilt, zoom):
@@ -81,13 +151,372 @@ class PTZController:
             raise
 
     def get_status(self):
-        """Get current PTZ status"""
+        """
+        Get current PTZ status
+        :return: {'position': {'pan', 'tilt', 'zoom'}, 'moving': {'pan_tilt', 'zoom'}};
+                 values the camera doesn't report are None
+        """
         try:
             status = self.ptz.GetStatus({'ProfileToken': self.media_profile})
+            position = status.Position
+            pan_tilt = position.PanTilt if position is not None else None
+            zoom = position.Zoom if position is not None else None
+            move_status = status.MoveStatus
             return {
-                'position': status.Position,
-                'moving': status.MoveStatus
+                'position': {
+                    'pan': pan_tilt.x if pan_tilt is not None else None,
+                    'tilt': pan_tilt.y if pan_tilt is not None else None,
+                    'zoom': zoom.x if zoom is not None else None,
+                },
+                'moving': {
+                    'pan_tilt': move_status.PanTilt if move_status is not None else None,
+                    'zoom': move_status.Zoom if move_status is not None else None,
+                }
             }
         except Exception as e:
             logger.error(f"Failed to get PTZ status: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
+
+
+class PTZPool:
+    """
+    PTZ controllers for every camera with an ``onvif`` block, connected in
+    parallel in the background. Request handlers only ever take a ready
+    controller from ``get()``; a session that fails to connect, or is
+    invalidated after a transport error, is rebuilt in the background with
+    increasing delays.
+    """
+
+    def __init__(self, max_workers=8):
+        self._settings = {}
+        self._controllers = {}
+        self._pending = set()
+        self._failures = {}
+        self._dispatchers = {}
+        self._status_pollers = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='onvif')
+
+    def prewarm(self, cameras):
+        """Start connecting every camera's PTZ session"""
+        for camera_id, camera in enumerate(cameras):
+            self.update(camera_id, camera)
+
+    def update(self, camera_id, camera_settings):
+        """Pick up a camera's (possibly changed or removed) settings"""
+        onvif_settings = camera_settings.get('onvif') if camera_settings else None
+        with self._lock:
+            if camera_id in self._settings and self._settings[camera_id] == onvif_settings:
+                return
+            self._controllers.pop(camera_id, None)
+            self._failures.pop(camera_id, None)
+            if onvif_settings is None:
+                self._settings.pop(camera_id, None)
+                return
+            self._settings[camera_id] = onvif_settings
+        self._schedule(camera_id)
+
+    def is_configured(self, camera_id):
+        return camera_id in self._settings
+
+    def get(self, camera_id):
+        """
+        The camera's connected controller; never waits on ONVIF
+        :return: PTZController, or None while it is (re)connecting or not configured
+        """
+        return self._controllers.get(camera_id)
+
+    def dispatcher(self, camera_id):
+        """The camera's PTZDispatcher, created on first use"""
+        with self._lock:
+            dispatcher = self._dispatchers.get(camera_id)
+            if dispatcher is None:
+                dispatcher = PTZDispatcher(camera_id, self)
+                self._dispatchers[camera_id] = dispatcher
+            return dispatcher
+
+    def status_poller(self, camera_id):
+        """The camera's PTZStatusPoller, created on first use"""
+        with self._lock:
+            poller = self._status_pollers.get(camera_id)
+            if poller is None:
+                poller = PTZStatusPoller(camera_id, self)
+                self._status_pollers[camera_id] = poller
+            return poller
+
+    def wake_status(self, camera_id):
+        """Poll a camera's status right away, e.g. after a command was sent"""
+        poller = self._status_pollers.get(camera_id)
+        if poller is not None:
+            poller.wake()
+
+    def handle_error(self, camera_id, controller, error):
+        """Rebuild the controller's session if a request failed on the network"""
+        if is_connection_error(error):
+            self.invalidate(camera_id, controller)
+
+    def invalidate(self, camera_id, controller):
+        """Drop a controller whose session broke and rebuild it in the background"""
+        with self._lock:
+            if self._controllers.get(camera_id) is not controller:
+                return
+            del self._controllers[camera_id]
+        logger.warning(f"PTZ session for camera {camera_id} lost, reconnecting")
+        self._schedule(camera_id)
+
+    def _schedule(self, camera_id, delay=0):
+        with self._lock:
+            if camera_id in self._pending:
+                return
+            self._pending.add(camera_id)
+        if delay:
+            timer = threading.Timer(delay, self._executor.submit, args=(self._connect, camera_id))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._executor.submit(self._connect, camera_id)
+
+    def _connect(self, camera_id):
+        with self._lock:
+            onvif_settings = self._settings.get(camera_id)
+        controller = None
+        if onvif_settings is not None:
+            try:
+                controller = PTZController(
+                    onvif_settings['host'],
+                    onvif_settings['username'],
+                    onvif_settings['password'],
+                    onvif_settings.get('port', 80)
+                )
+            except Exception:
+                # PTZController has already logged why
+                pass
+
+        retry_delay = None
+        with self._lock:
+            self._pending.discard(camera_id)
+            current = self._settings.get(camera_id)
+            if current is None:
+                return
+            if current is not onvif_settings:
+                # The settings changed while we were connecting
+                retry_delay = 0
+            elif controller is not None:
+                self._controllers[camera_id] = controller
+                self._failures.pop(camera_id, None)
+            else:
+                failures = self._failures.get(camera_id, 0) + 1
+                self._failures[camera_id] = failures
+                retry_delay = PTZ_RETRY_DELAYS[min(failures, len(PTZ_RETRY_DELAYS)) - 1]
+        if retry_delay is not None:
+            self._schedule(camera_id, retry_delay)
+
+
+class PTZDispatcher:
+    """
+    Sends one camera's PTZ commands from a worker thread, so requests return
+    without waiting on the camera. Only the newest pending move is kept: a
+    move superseded before it went out is dropped, and a stop discards any
+    pending move and is sent next.
+    """
+
+    def __init__(self, camera_id, pool):
+        self.camera_id = camera_id
+        self.pool = pool
+        self.sent = 0
+        self.superseded = 0
+        self.failed = 0
+        self.last_completed = 0
+        self.last_error = None
+        self._seq = 0
+        self._pending_move = None
+        self._pending_stop = None
+        self._latencies = deque(maxlen=PTZ_LATENCY_SAMPLES)
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f'ptz-{camera_id}', daemon=True)
+        self._thread.start()
+
+    def submit(self, kind, pan=0.0, tilt=0.0, zoom=0.0):
+        """
+        Queue a command
+        :param kind: 'continuous', 'absolute' or 'stop'
+        :return: The command's sequence number
+        """
+        with self._condition:
+            self._seq += 1
+            command = (self._seq, kind, pan, tilt, zoom, time.monotonic())
+            if self._pending_move is not None:
+                self.superseded += 1
+                self._pending_move = None
+            if kind == 'stop':
+                if self._pending_stop is not None:
+                    self.superseded += 1
+                self._pending_stop = command
+            else:
+                self._pending_move = command
+            self._condition.notify()
+            return self._seq
+
+    def stats(self):
+        with self._condition:
+            latencies = sorted(self._latencies)
+            stats = {
+                'queued': self._seq,
+                'sent': self.sent,
+                'superseded': self.superseded,
+                'failed': self.failed,
+                'last_completed': self.last_completed,
+                'last_error': self.last_error,
+            }
+        if latencies:
+            stats['latency_ms'] = {
+                'avg': round(sum(latencies) / len(latencies) * 1000, 1),
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+                'max': round(latencies[-1] * 1000, 1),
+            }
+        return stats
+
+    def _next_command(self):
+        with self._condition:
+            while self._pending_stop is None and self._pending_move is None:
+                self._condition.wait()
+            if self._pending_stop is not None:
+                command, self._pending_stop = self._pending_stop, None
+            else:
+                command, self._pending_move = self._pending_move, None
+            return command
+
+    def _run(self):
+        while True:
+            seq, kind, pan, tilt, zoom, submitted_at = self._next_command()
+            controller = self.pool.get(self.camera_id)
+            try:
+                if controller is None:
+                    raise RuntimeError('PTZ not connected')
+                if kind == 'stop':
+                    controller.stop()
+                elif kind == 'absolute':
+                    controller.move_absolute(pan, tilt, zoom)
+                else:
+                    controller.move_continuous(pan, tilt, zoom)
+            except Exception as e:
+                with self._condition:
+                    self.failed += 1
+                    self.last_error = str(e)
+                if controller is not None:
+                    self.pool.handle_error(self.camera_id, controller, e)
+                continue
+            with self._condition:
+                self._latencies.append(time.monotonic() - submitted_at)
+                self.sent += 1
+                self.last_completed = seq
+            self.pool.wake_status(self.camera_id)
+
+
+class PTZStatusPoller:
+    """
+    In-memory PTZ status of one camera, refreshed by a background thread so
+    any number of readers cost the camera one GetStatus per interval. It
+    polls every STATUS_POLL_MOVING seconds while the camera is moving and
+    every STATUS_POLL_IDLE seconds otherwise, and stops once nobody has read
+    or watched it for STATUS_POLL_LINGER seconds.
+
+    ``add_listener(callback)`` registers ``callback(camera_id, snapshot)``,
+    called on the poller thread whenever the position or move status changes.
+    """
+
+    def __init__(self, camera_id, pool):
+        self.camera_id = camera_id
+        self.pool = pool
+        self.status = None
+        self.updated_at = None
+        self.error = None
+        self._listeners = []
+        self._last_read = time.monotonic()
+        self._running = False
+        self._wake = threading.Event()
+        self._condition = threading.Condition()
+
+    def read(self, wait=1.0):
+        """
+        The cached status; only the very first read waits for a poll
+        :param wait: Seconds to wait if nothing has been polled yet
+        :return: Snapshot dict, with 'status' None if the camera hasn't answered yet
+        """
+        with self._condition:
+            self._last_read = time.monotonic()
+            self._ensure_running_locked()
+            if self.status is None and self.error is None:
+                self._condition.wait(wait)
+            return self._snapshot_locked()
+
+    def add_listener(self, listener):
+        with self._condition:
+            self._listeners = self._listeners + [listener]
+            self._ensure_running_locked()
+
+    def remove_listener(self, listener):
+        with self._condition:
+            self._listeners = [l for l in self._listeners if l != listener]
+            self._last_read = time.monotonic()
+
+    def wake(self):
+        self._wake.set()
+
+    def _snapshot_locked(self):
+        return {
+            'camera_id': self.camera_id,
+            'status': self.status,
+            'updated_at': self.updated_at,
+            'age': round(time.time() - self.updated_at, 3) if self.updated_at else None,
+            'error': self.error,
+        }
+
+    def _ensure_running_locked(self):
+        if not self._running:
+            self._running = True
+            threading.Thread(target=self._run, name=f'ptz-status-{self.camera_id}', daemon=True).start()
+
+    def _should_stop(self):
+        with self._condition:
+            if not self._listeners and time.monotonic() - self._last_read > STATUS_POLL_LINGER:
+                self._running = False
+                return True
+            return False
+
+    def _is_moving(self):
+        moving = self.status['moving'] if self.status else {}
+        return any(value not in (None, 'IDLE') for value in moving.values())
+
+    def _poll(self):
+        controller = self.pool.get(self.camera_id)
+        try:
+            if controller is None:
+                raise RuntimeError('PTZ not connected')
+            status, error = controller.get_status(), None
+        except Exception as e:
+            status, error = None, str(e)
+            if controller is not None:
+                self.pool.handle_error(self.camera_id, controller, e)
+
+        with self._condition:
+            changed = status is not None and status != self.status
+            if status is not None:
+                self.status = status
+                self.updated_at = time.time()
+            self.error = error
+            self._condition.notify_all()
+            snapshot = self._snapshot_locked()
+            listeners = self._listeners
+        if changed:
+            for listener in listeners:
+                try:
+                    listener(self.camera_id, snapshot)
+                except Exception as e:
+                    logger.error(f"Error publishing PTZ status: {str(e)}")
+
+    def _run(self):
+        while not self._should_stop():
+            self._poll()
+            self._wake.wait(STATUS_POLL_MOVING if self._is_moving() else STATUS_POLL_IDLE)
+            self._wake.clear()
@@ -0,0 +1,85 @@
+import logging
+import threading
+from flask import request
+from flask_login import current_user
+from flask_socketio import Namespace, join_room, leave_room
+
+logger = logging.getLogger(__name__)
+
+PTZ_NAMESPACE = '/ptz'
+
+
+def status_room(camera_id):
+    return f'ptz-{camera_id}'
+
+
+class PTZStatusNamespace(Namespace):
+    """
+    Socket.IO namespace pushing PTZ status changes instead of having clients
+    poll /ptz/<id>/status. Clients send ``watch`` / ``unwatch`` with
+    ``{'camera': id}`` and receive a ``status`` event with the same JSON as
+    the status route, once on watch and then on every change.
+    """
+
+    def __init__(self, socketio, ptz_pool, namespace=PTZ_NAMESPACE):
+        super().__init__(namespace)
+        self.socketio = socketio
+        self.ptz_pool = ptz_pool
+        self.watching = {}
+        self._watchers = {}
+        self._lock = threading.Lock()
+
+    def on_connect(self):
+        if not current_user.is_authenticated:
+            return False
+        self.watching[request.sid] = set()
+
+    def on_disconnect(self):
+        for camera_id in self.watching.pop(request.sid, set()):
+            self._release(camera_id)
+
+    def on_watch(self, data):
+        cameras = self.watching.get(request.sid)
+        try:
+            camera_id = int(data['camera'])
+        except (KeyError, TypeError, ValueError):
+            return {'error': 'Invalid camera'}
+        if cameras is None or not self.ptz_pool.is_configured(camera_id):
+            return {'error': 'PTZ not available for this camera'}
+        if camera_id not in cameras:
+            cameras.add(camera_id)
+            join_room(status_room(camera_id))
+            self._retain(camera_id)
+        return self.ptz_pool.status_poller(camera_id).read()
+
+    def on_unwatch(self, data):
+        cameras = self.watching.get(request.sid)
+        try:
+            camera_id = int(data['camera'])
+        except (KeyError, TypeError, ValueError):
+            return {'error': 'Invalid camera'}
+        if cameras is not None and camera_id in cameras:
+            cameras.discard(camera_id)
+            leave_room(status_room(camera_id))
+            self._release(camera_id)
+        return {'status': 'unwatched', 'camera': camera_id}
+
+    def _publish(self, camera_id, snapshot):
+        self.socketio.emit('status', snapshot, to=status_room(camera_id), namespace=self.namespace)
+
+    def _retain(self, camera_id):
+        """The poller only publishes for cameras that someone is watching"""
+        with self._lock:
+            self._watchers[camera_id] = self._watchers.get(camera_id, 0) + 1
+            first = self._watchers[camera_id] == 1
+        if first:
+            self.ptz_pool.status_poller(camera_id).add_listener(self._publish)
+
+    def _release(self, camera_id):
+        with self._lock:
+            self._watchers[camera_id] = self._watchers.get(camera_id, 1) - 1
+            last = self._watchers[camera_id] <= 0
+            if last:
+                del self._watchers[camera_id]
+        if last:
+            self.ptz_pool.status_poller(camera_id).remove_listener(self._publish)
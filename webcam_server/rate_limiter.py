@@ -1,30 +1,151 @@
 from flask import request, jsonify
 from functools import wraps
-from datetime import datetime, timedelta
+import logging
 import redis
 import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Redis calls give up quickly so a slow Redis can't stall requests
+REDIS_TIMEOUT = float(os.environ.get('RATE_LIMIT_REDIS_TIMEOUT', 0.1))
+
+# Seconds to serve from local buckets after Redis fails before trying it again
+REDIS_RETRY_INTERVAL = 5.0
+
+# Local lease entries kept before expired ones are pruned
+MAX_LOCAL_KEYS = 10000
 
 redis_client = redis.Redis(
     host=os.environ.get('REDIS_HOST', 'redis'),
-    port=int(os.environ.get('REDIS_PORT', 6379))
+    port=int(os.environ.get('REDIS_PORT', 6379)),
+    socket_timeout=REDIS_TIMEOUT,
+    socket_connect_timeout=REDIS_TIMEOUT
 )
 
+# Sliding-window counter: the previous window's count, weighted by how much
+# of it still overlaps the sliding window, plus the current window's count.
+# Grants up to ARGV[2] tokens atomically and returns how many it granted.
+#   KEYS[1] current window counter, KEYS[2] previous window counter
+#   ARGV[1] limit, ARGV[2] tokens wanted,
+#   ARGV[3] permille of the current window elapsed, ARGV[4] window in ms
+SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local wanted = tonumber(ARGV[2])
+local weight = 1 - tonumber(ARGV[3]) / 1000
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local granted = math.min(wanted, limit - math.floor(previous * weight) - current)
+if granted <= 0 then
+    return 0
+end
+redis.call('INCRBY', KEYS[1], granted)
+redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[4]) * 2)
+return granted
+"""
+
+
+class RateLimiter:
+    """
+    Sliding-window rate limit shared through Redis, checked locally.
+
+    Each process leases tokens from Redis in batches with one atomic script
+    call, then answers checks from its local lease until it runs out or
+    expires, so most checks never leave the process. A refused lease is
+    remembered for the lease period too. Tokens leased but not used still
+    count against the window, so with several processes the effective limit
+    can fall short of ``limit`` by up to one batch per process.
+
+    If Redis fails, checks fall back to a per-process token bucket with the
+    same rate until Redis is retried.
+
+    :param limit: Requests allowed per window
+    :param window: Window length in seconds
+    :param name: Namespace for the Redis keys
+    :param batch: Tokens leased per Redis call (default: a tenth of the limit)
+    """
+
+    def __init__(self, limit, window=60.0, name='default', batch=None, client=None):
+        self.limit = limit
+        self.window = window
+        self.name = name
+        self.batch = batch or max(1, limit // 10)
+        # Leased tokens must be used soon, or a quiet process would hoard them
+        self.lease_seconds = window * self.batch / limit
+        self.client = client or redis_client
+        self.redis_calls = 0
+        self._script = self.client.register_script(SLIDING_WINDOW_SCRIPT)
+        self._leases = {}
+        self._buckets = {}
+        self._redis_down_until = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """
+        Take one request from ``key``'s budget
+        :return: True if the request is within the limit
+        """
+        now = time.monotonic()
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease[1] > now:
+                if lease[0] > 0:
+                    lease[0] -= 1
+                    return True
+                if lease[2]:
+                    return False
+            redis_down = now < self._redis_down_until
+
+        if redis_down:
+            return self._allow_local(key, now)
+        try:
+            granted = self._lease(key)
+        except redis.RedisError as e:
+            with self._lock:
+                self._redis_down_until = now + REDIS_RETRY_INTERVAL
+            logger.warning(f"Rate limiter falling back to local limits, Redis unavailable: {str(e)}")
+            return self._allow_local(key, now)
+
+        with self._lock:
+            if len(self._leases) >= MAX_LOCAL_KEYS:
+                self._leases = {k: v for k, v in self._leases.items() if v[1] > now}
+            # [tokens left, expiry, refused]
+            self._leases[key] = [max(0, granted - 1), now + self.lease_seconds, granted <= 0]
+        return granted > 0
+
+    def _lease(self, key):
+        """One round-trip: ask Redis for up to ``batch`` tokens"""
+        now = time.time()
+        index, offset = divmod(now, self.window)
+        prefix = f'rate_limit:{{{self.name}:{key}}}'
+        self.redis_calls += 1
+        return int(self._script(
+            keys=[f'{prefix}:{int(index)}', f'{prefix}:{int(index) - 1}'],
+            args=[self.limit, self.batch, int(offset / self.window * 1000), int(self.window * 1000)]
+        ))
+
+    def _allow_local(self, key, now):
+        """Token bucket holding ``limit`` tokens, refilled at limit / window per second"""
+        rate = self.limit / self.window
+        with self._lock:
+            if len(self._buckets) >= MAX_LOCAL_KEYS:
+                self._buckets.clear()
+            tokens, updated = self._buckets.get(key, (self.limit, now))
+            tokens = min(self.limit, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+
 def rate_limit(requests_per_minute=60):
     def decorator(f):
+        limiter = RateLimiter(requests_per_minute, 60.0, name=f.__name__)
+
         @wraps(f)
         def wrapped(*args, **kwargs):
-            client_ip = request.remote_addr
-            key = f'rate_limit:{client_ip}:{f.__name__}'
-            
-            # Get current request count
-            count = redis_client.get(key)
-            if count is None:
-                redis_client.setex(key, 60, 1)
-            elif int(count) >= requests_per_minute:
+            if not limiter.allow(request.remote_addr):
                 return jsonify({'error': 'Rate limit exceeded'}), 429
-            else:
-                redis_client.incr(key)
-            
             return f(*args, **kwargs)
         return wrapped
-    return decorator 
\ No newline at end of file
+    return decorator
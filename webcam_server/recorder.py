@@ -0,0 +1,268 @@
+import logging
+import os
+import queue
+import subprocess
+import time
+from threading import Event, Lock, Thread
+from camera_hub import get_hub
+from packet_source import CODECS, FFMPEG_BIN
+from settings_store import DEFAULT_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(__file__), 'static', 'recordings')
+
+# Packets a recorder may fall behind the live stream before it starts dropping,
+# on top of the pre-event history replayed when recording starts
+MAX_PENDING_PACKETS = 1000
+
+
+# A gap between packets longer than this (seconds), or a new connection to
+# the camera, ends the segment; the muxer assumes a constant frame rate, so
+# a gap inside a file would shift everything after it
+MAX_PACKET_GAP = 5.0
+
+# Suffix of a segment that is still being written; only finished files end in .mp4
+PARTIAL_SUFFIX = '.part'
+
+
+class Mp4Writer:
+    """
+    Remuxes Annex-B access units into an MP4 with ffmpeg -c copy (no decode,
+    no encode). The file is written under a .part name and renamed into
+    place once ffmpeg has finished the index.
+    """
+
+    def __init__(self, filepath, codec='h264', fps=25.0):
+        self.filepath = filepath
+        self.partial_path = filepath + PARTIAL_SUFFIX
+        self.codec = codec
+        self.fps = fps
+        self.process = None
+        self.bytes_written = 0
+        self.keyframes = 0
+        self.started_at = None
+
+    @property
+    def average_gop_bytes(self):
+        return self.bytes_written / self.keyframes if self.keyframes else 0
+
+    def open(self):
+        cmd = [FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+               '-f', CODECS[self.codec]['format'], '-framerate', f'{self.fps:.3f}',
+               '-i', 'pipe:0', '-c', 'copy', '-movflags', '+faststart',
+               '-f', 'mp4', self.partial_path]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE)
+        return self
+
+    def write(self, packet):
+        if self.started_at is None:
+            self.started_at = packet.timestamp
+        if packet.keyframe:
+            self.keyframes += 1
+        self.process.stdin.write(packet.data)
+        self.bytes_written += len(packet.data)
+
+    def close(self):
+        """
+        Finish the file; blocks until ffmpeg has written the index
+        :return: True if the finished MP4 was moved into place
+        """
+        if self.process is None:
+            return False
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        stderr = self.process.stderr.read()
+        self.process.wait()
+        returncode = self.process.returncode
+        self.process = None
+        if returncode != 0:
+            logger.error(f"Muxer for {self.filepath} exited with {returncode}: "
+                         f"{stderr.decode(errors='replace').strip()}")
+            return False
+        os.replace(self.partial_path, self.filepath)
+        return True
+
+
+class CameraRecorder:
+    """
+    Records a camera by attaching to its shared CameraHub as a packet sink, so
+    recording reuses the live RTSP session and stream-copies the compressed
+    video straight into MP4.
+
+    Recording is split into segments of at most ``recordLength`` minutes and
+    ``fileSize`` MB. Segments roll over on a keyframe, so no packet is lost
+    between them, and each finished segment is closed in the background and
+    handed to ``on_segment`` as soon as it is complete. ``on_segment_start``
+    is called with the final path when a segment is opened.
+    """
+
+    def __init__(self, camera_id, settings, record_settings=None, on_segment=None, on_segment_start=None):
+        self.camera_id = camera_id
+        self.settings = settings
+        self.is_recording = False
+        self.current_recording = None
+        self.recording_thread = None
+        self.trigger = None
+        self.dropped_packets = 0
+        self.segment_seconds = 0
+        self.segment_bytes = 0
+        self.on_segment = on_segment
+        self.on_segment_start = on_segment_start
+        # Motion-triggered and manual starts and stops can come from different threads
+        self._lock = Lock()
+        self.apply_settings(record_settings or DEFAULT_SETTINGS)
+        self.hub = get_hub(camera_id, settings)
+        pre_event_packets = self.hub.pre_event.capacity if self.hub.pre_event is not None else 0
+        self._queue_size = MAX_PENDING_PACKETS + pre_event_packets
+        # Each recording run has its own queue and stop event, so a run still
+        # draining after a stop never shares packets with the next one
+        self._packets = queue.Queue(maxsize=self._queue_size)
+        self._stopping = None
+
+    def apply_settings(self, record_settings):
+        """Take new segment limits; they apply from the next rollover check"""
+        self.segment_seconds = record_settings['recordLength'] * 60
+        self.segment_bytes = record_settings['fileSize'] * 1024 * 1024
+
+    def start_recording(self, trigger='manual'):
+        """
+        :param trigger: 'manual' or 'motion'; a manual start takes over a
+                        motion-triggered recording so motion ending won't stop it
+        """
+        with self._lock:
+            if not self.is_recording:
+                filename = self._next_filename()
+                self.current_recording = filename
+                self.trigger = trigger
+                self.is_recording = True
+                self.dropped_packets = 0
+                self._packets = queue.Queue(maxsize=self._queue_size)
+                self._stopping = Event()
+                self.hub.add_packet_sink(self._on_packet)
+                self.recording_thread = Thread(target=self._record_video,
+                                               args=(filename, self._packets, self._stopping))
+                self.recording_thread.start()
+                return {'status': 'started', 'filename': filename}
+            if trigger == 'manual':
+                self.trigger = trigger
+            return {'status': 'already_recording', 'filename': self.current_recording}
+
+    def stop_recording(self):
+        """
+        Stop taking packets. Returns once the queued ones are written; the
+        last segment is finalized in the background, like a rollover
+        """
+        with self._lock:
+            if not self.is_recording:
+                return {'status': 'not_recording'}
+            self.is_recording = False
+            self.hub.remove_packet_sink(self._on_packet)
+            self._stopping.set()
+            thread, self.recording_thread = self.recording_thread, None
+            filename = self.current_recording
+        # Outside the lock, so a motion-triggered start isn't held up meanwhile
+        if thread:
+            thread.join()
+        return {'status': 'stopped', 'filename': filename}
+
+    def _abort(self, packets, stopping):
+        """Detach after the recording thread failed, so a later start begins afresh"""
+        with self._lock:
+            # A stop, and perhaps a new run, may have come first
+            if self._stopping is stopping and self.is_recording:
+                self.is_recording = False
+                self.hub.remove_packet_sink(self._on_packet)
+                stopping.set()
+        while True:
+            try:
+                packets.get_nowait()
+            except queue.Empty:
+                break
+
+    def _next_filename(self):
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        filename = f"camera_{self.camera_id}_{timestamp}.mp4"
+        suffix = 1
+        while os.path.exists(os.path.join(RECORDINGS_DIR, filename)) or filename == self.current_recording:
+            filename = f"camera_{self.camera_id}_{timestamp}_{suffix}.mp4"
+            suffix += 1
+        return filename
+
+    def _on_packet(self, packet):
+        """Called on the hub's capture thread; must not block"""
+        try:
+            self._packets.put_nowait(packet)
+        except queue.Full:
+            self.dropped_packets += 1
+
+    def _segment_full(self, writer, packet):
+        """Checked on keyframes only; leaves room for one more GOP under the size cap"""
+        if packet.timestamp - writer.started_at >= self.segment_seconds:
+            return True
+        return writer.bytes_written + writer.average_gop_bytes > self.segment_bytes
+
+    def _open_segment(self, filename):
+        filepath = os.path.join(RECORDINGS_DIR, filename)
+        self.current_recording = filename
+        logger.info(f"Camera {self.camera_id} recording segment {filename}")
+        if self.on_segment_start:
+            self.on_segment_start(self.camera_id, filepath)
+        return Mp4Writer(filepath, self.hub.codec, self.hub.frame_rate).open()
+
+    def _close_segment(self, writer):
+        if writer.close() and self.on_segment:
+            self.on_segment(self.camera_id, writer.filepath)
+
+    def _finish_segment(self, writer):
+        """Close a segment without holding up the next one"""
+        Thread(target=self._close_segment, args=(writer,),
+               name=f'finish-{os.path.basename(writer.filepath)}').start()
+
+    def _record_video(self, filename, packets, stopping):
+        writer = None
+        last_packet = None
+        try:
+            while True:
+                try:
+                    packet = packets.get(timeout=1.0)
+                except queue.Empty:
+                    if stopping.is_set():
+                        break
+                    if not self.hub.is_running:
+                        logger.error(f"Camera {self.camera_id} stream ended, stopping recording")
+                        self._abort(packets, stopping)
+                        break
+                    continue
+
+                if writer is not None and last_packet is not None and (
+                        packet.seq <= last_packet.seq or packet.timestamp - last_packet.timestamp > MAX_PACKET_GAP):
+                    logger.warning(f"Camera {self.camera_id} stream was interrupted, starting a new segment")
+                    self._finish_segment(writer)
+                    writer = None
+                    filename = self._next_filename()
+                last_packet = packet
+
+                if writer is not None and packet.keyframe and self._segment_full(writer, packet):
+                    self._finish_segment(writer)
+                    writer = None
+                    filename = self._next_filename()
+
+                if writer is None:
+                    # An MP4 has to start on a keyframe to be playable
+                    if not packet.keyframe:
+                        continue
+                    writer = self._open_segment(filename)
+
+                writer.write(packet)
+
+        except Exception as e:
+            logger.error(f"Recording error for camera {self.camera_id}: {str(e)}")
+            self._abort(packets, stopping)
+        finally:
+            if writer:
+                # Finalizing (+faststart) can take seconds; don't make stop_recording wait for it
+                self._finish_segment(writer)
@@ -0,0 +1,387 @@
+import base64
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from recorder import PARTIAL_SUFFIX, RECORDINGS_DIR
+
+logger = logging.getLogger(__name__)
+
+# Kept beside the recordings so it persists with them (the recordings
+# directory is the volume in docker-compose.yml); keep flags and
+# compression state would otherwise be lost with the container
+RECORDINGS_INDEX_PATH = os.environ.get('RECORDINGS_INDEX_PATH', os.path.join(RECORDINGS_DIR, 'recordings.db'))
+
+# camera_<id>_<YYYYmmdd-HHMMSS>[_<n>].mp4, as named by CameraRecorder
+RECORDING_NAME = re.compile(r'^camera_(\d+)_(\d{8}-\d{6})(?:_\d+)?\.mp4$')
+
+# Sort keys accepted by RecordingsIndex.query and the column each one orders by
+SORT_COLUMNS = {'date': 'started_at', 'size': 'size'}
+
+MAX_PAGE_SIZE = 500
+
+# Recording lifecycle: written by a recorder, finalized and waiting for the
+# compressor, being compressed, compressed (or not worth compressing), failed
+RECORDING = 'recording'
+PENDING = 'pending'
+COMPRESSING = 'compressing'
+DONE = 'done'
+FAILED = 'failed'
+STATES = (RECORDING, PENDING, COMPRESSING, DONE, FAILED)
+
+# Each entry upgrades the schema by one version (PRAGMA user_version)
+MIGRATIONS = [
+    """
+    CREATE TABLE recordings (
+        id INTEGER PRIMARY KEY,
+        filename TEXT NOT NULL UNIQUE,
+        camera_id INTEGER,
+        started_at REAL NOT NULL,
+        ended_at REAL,
+        size INTEGER NOT NULL
+    );
+    CREATE INDEX recordings_started ON recordings (started_at, id);
+    CREATE INDEX recordings_camera_started ON recordings (camera_id, started_at, id);
+    CREATE INDEX recordings_size ON recordings (size, id);
+    """,
+    """
+    ALTER TABLE recordings ADD COLUMN state TEXT NOT NULL DEFAULT 'pending';
+    ALTER TABLE recordings ADD COLUMN original_size INTEGER;
+    ALTER TABLE recordings ADD COLUMN compressed_at REAL;
+    CREATE INDEX recordings_state ON recordings (state, started_at);
+    """,
+    """
+    ALTER TABLE recordings ADD COLUMN keep INTEGER NOT NULL DEFAULT 0;
+    """,
+    """
+    ALTER TABLE recordings ADD COLUMN thumbnail TEXT;
+    ALTER TABLE recordings ADD COLUMN sprite TEXT;
+    ALTER TABLE recordings ADD COLUMN sprite_interval REAL;
+    ALTER TABLE recordings ADD COLUMN sprite_columns INTEGER;
+    ALTER TABLE recordings ADD COLUMN sprite_count INTEGER;
+    """,
+]
+
+
+def parse_recording_name(filename):
+    """
+    :return: (camera_id, start timestamp) from a recorder file name, or (None, None)
+    """
+    match = RECORDING_NAME.match(filename)
+    if not match:
+        return None, None
+    started = datetime.strptime(match.group(2), '%Y%m%d-%H%M%S')
+    return int(match.group(1)), started.timestamp()
+
+
+def encode_cursor(value, row_id):
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+class RecordingsIndex:
+    """
+    SQLite catalog of recordings, so listing them never touches the recordings
+    directory. Segments are added as the recorder opens and finishes them, and
+    ``sync_directory()`` reconciles the index with the disk once at startup.
+    Each row also carries its compression state (see STATES).
+    Each thread gets its own connection; the database runs in WAL mode so
+    readers never wait on a writer.
+    """
+
+    def __init__(self, path=RECORDINGS_INDEX_PATH):
+        self.path = path
+        # Recorders of this process only open segments after this
+        self.opened_at = time.time()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        self._migrate()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _migrate(self):
+        connection = self._connection()
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            connection.executescript(f'BEGIN; {migration}; PRAGMA user_version = {number}; COMMIT;')
+            logger.info(f"Recordings index {self.path} upgraded to schema {number}")
+
+    def add_recording(self, filepath, camera_id):
+        """Record a segment that is still being written; it stays out of listings until finished"""
+        filename = os.path.basename(filepath)
+        _, started_at = parse_recording_name(filename)
+        self._connection().execute(
+            """
+            INSERT INTO recordings (filename, camera_id, started_at, size, state)
+            VALUES (?, ?, ?, 0, ?)
+            ON CONFLICT (filename) DO NOTHING
+            """,
+            (filename, camera_id, started_at if started_at is not None else time.time(), RECORDING)
+        )
+
+    def add_file(self, filepath, camera_id=None):
+        """Index (or re-index) a finished recording; new files wait for the compressor"""
+        filename = os.path.basename(filepath)
+        stat = os.stat(filepath)
+        name_camera_id, started_at = parse_recording_name(filename)
+        if camera_id is None:
+            camera_id = name_camera_id
+        self._connection().execute(
+            """
+            INSERT INTO recordings (filename, camera_id, started_at, ended_at, size, state)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (filename) DO UPDATE SET
+                camera_id = excluded.camera_id, ended_at = excluded.ended_at, size = excluded.size,
+                state = CASE WHEN state = ? THEN ? ELSE state END
+            """,
+            (filename, camera_id, started_at if started_at is not None else stat.st_mtime,
+             stat.st_mtime, stat.st_size, PENDING, RECORDING, PENDING)
+        )
+
+    def remove(self, filename):
+        self._connection().execute('DELETE FROM recordings WHERE filename = ?', (filename,))
+
+    def get(self, filename):
+        row = self._connection().execute('SELECT * FROM recordings WHERE filename = ?', (filename,)).fetchone()
+        return dict(row) if row else None
+
+    def claim_pending(self):
+        """
+        Move the oldest pending recording to COMPRESSING
+        :return: Its row dict, or None if nothing is pending
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT * FROM recordings WHERE state = ? ORDER BY started_at LIMIT 1', (PENDING,)
+            ).fetchone()
+            if row is not None:
+                connection.execute('UPDATE recordings SET state = ? WHERE id = ?', (COMPRESSING, row['id']))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return dict(row, state=COMPRESSING) if row is not None else None
+
+    def finish_compression(self, filename, state, size, original_size):
+        """
+        :param state: DONE or FAILED
+        :param size: Size of the file now on disk
+        :param original_size: Size before compression
+        """
+        self._connection().execute(
+            """
+            UPDATE recordings SET state = ?, size = ?, original_size = ?, compressed_at = ?
+            WHERE filename = ?
+            """,
+            (state, size, original_size, time.time(), filename)
+        )
+
+    def reset_state(self, from_state, to_state):
+        """:return: Number of recordings moved"""
+        return self._connection().execute(
+            'UPDATE recordings SET state = ? WHERE state = ?', (to_state, from_state)
+        ).rowcount
+
+    def compression_stats(self):
+        """:return: Recording count per state, and bytes saved by compression so far"""
+        connection = self._connection()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(connection.execute('SELECT state, COUNT(*) FROM recordings GROUP BY state').fetchall())
+        original, compressed = connection.execute(
+            """
+            SELECT COALESCE(SUM(original_size), 0), COALESCE(SUM(size), 0)
+            FROM recordings WHERE original_size IS NOT NULL
+            """
+        ).fetchone()
+        return {'states': counts, 'original_bytes': original, 'compressed_bytes': compressed,
+                'saved_bytes': original - compressed}
+
+    def set_keep(self, filename, keep):
+        """
+        Protect a recording from retention, or release it
+        :return: False if the recording isn't indexed
+        """
+        return self._connection().execute(
+            'UPDATE recordings SET keep = ? WHERE filename = ?', (1 if keep else 0, filename)
+        ).rowcount > 0
+
+    def usage(self, since):
+        """
+        :param since: Start of the window for ``recent_bytes``
+        :return: {camera_id: {'count', 'bytes', 'kept_bytes', 'oldest', 'recent_bytes'}}
+        """
+        rows = self._connection().execute(
+            """
+            SELECT camera_id, COUNT(*), COALESCE(SUM(size), 0),
+                   COALESCE(SUM(CASE WHEN keep THEN size ELSE 0 END), 0), MIN(started_at),
+                   COALESCE(SUM(CASE WHEN started_at >= ? THEN size ELSE 0 END), 0)
+            FROM recordings GROUP BY camera_id
+            """,
+            (since,)
+        ).fetchall()
+        return {
+            row[0]: {'count': row[1], 'bytes': row[2], 'kept_bytes': row[3], 'oldest': row[4], 'recent_bytes': row[5]}
+            for row in rows
+        }
+
+    def evictable(self, camera_id=None, before=None, limit=100):
+        """
+        Oldest recordings retention may delete: not kept, and neither being
+        written nor being compressed
+        :param camera_id: Only this camera's recordings
+        :param before: Only recordings started before this timestamp
+        """
+        conditions, params = ['keep = 0', 'state NOT IN (?, ?)'], [RECORDING, COMPRESSING]
+        if camera_id is not None:
+            conditions.append('camera_id = ?')
+            params.append(camera_id)
+        if before is not None:
+            conditions.append('started_at < ?')
+            params.append(before)
+        rows = self._connection().execute(
+            f"SELECT * FROM recordings WHERE {' AND '.join(conditions)} ORDER BY started_at, id LIMIT ?",
+            params + [limit]
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def without_previews(self, limit=10):
+        """:return: Finished recordings that have no thumbnail yet, newest first"""
+        rows = self._connection().execute(
+            'SELECT * FROM recordings WHERE thumbnail IS NULL AND state != ? ORDER BY started_at DESC LIMIT ?',
+            (RECORDING, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def set_previews(self, filename, thumbnail, sprite=None, interval=None, columns=None, count=None):
+        """
+        :param thumbnail: Cache name of the poster image; '' if none could be made
+        :param sprite: Cache name of the sprite sheet
+        :param interval: Seconds of video between sprite tiles
+        :param columns: Tiles per sprite row
+        :param count: Tiles in the sprite
+        """
+        self._connection().execute(
+            """
+            UPDATE recordings SET thumbnail = ?, sprite = ?, sprite_interval = ?, sprite_columns = ?, sprite_count = ?
+            WHERE filename = ?
+            """,
+            (thumbnail, sprite, interval, columns, count, filename)
+        )
+
+    def preview_names(self):
+        """:return: Every cached image some recording still refers to"""
+        names = set()
+        for thumbnail, sprite in self._connection().execute('SELECT thumbnail, sprite FROM recordings'):
+            names.update(name for name in (thumbnail, sprite) if name)
+        return names
+
+    def sync_directory(self, directory):
+        """
+        Add MP4s the index doesn't know about, drop entries whose file is gone,
+        and delete partial segments a previous run left unfinished
+        """
+        start = time.monotonic()
+        on_disk = {}
+        orphans = 0
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith('.mp4'):
+                    on_disk[entry.name] = entry
+                elif entry.name.endswith('.mp4' + PARTIAL_SUFFIX) and entry.stat().st_mtime < self.opened_at:
+                    # Never finalized, so unplayable: the muxer didn't write its index
+                    try:
+                        os.remove(entry.path)
+                        orphans += 1
+                    except FileNotFoundError:
+                        pass
+        connection = self._connection()
+        indexed = {row[0]: row[1] for row in connection.execute('SELECT filename, size FROM recordings')}
+
+        added = 0
+        for filename, entry in on_disk.items():
+            if indexed.get(filename) != entry.stat().st_size:
+                self.add_file(entry.path)
+                added += 1
+        missing = [(filename,) for filename in indexed if filename not in on_disk]
+        connection.executemany('DELETE FROM recordings WHERE filename = ?', missing)
+        logger.info(f"Recordings index synced in {time.monotonic() - start:.2f}s: "
+                    f"{len(on_disk)} files, {added} added or updated, {len(missing)} removed, "
+                    f"{orphans} unfinished segments deleted")
+
+    def query(self, camera_id=None, start=None, end=None, sort='date', order='desc', limit=50, cursor=None):
+        """
+        One page of recordings, using keyset pagination so every page costs the same
+        :param camera_id: Only this camera's recordings
+        :param start: Only recordings starting at or after this timestamp
+        :param end: Only recordings starting before this timestamp
+        :param sort: One of SORT_COLUMNS
+        :param order: 'asc' or 'desc'
+        :param limit: Page size, at most MAX_PAGE_SIZE
+        :param cursor: ``next_cursor`` of the previous page
+        :return: {'recordings': [row dicts], 'total': matching rows, 'total_size': their bytes,
+                  'next_cursor': str or None}
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f'Unknown sort: {sort}')
+        if order not in ('asc', 'desc'):
+            raise ValueError(f'Unknown order: {order}')
+        column = SORT_COLUMNS[sort]
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        # Segments still being written aren't playable yet
+        conditions, params = ['state != ?'], [RECORDING]
+        if camera_id is not None:
+            conditions.append('camera_id = ?')
+            params.append(camera_id)
+        if start is not None:
+            conditions.append('started_at >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append('started_at < ?')
+            params.append(end)
+
+        connection = self._connection()
+        where = f"WHERE {' AND '.join(conditions)}"
+        total, total_size = connection.execute(
+            f'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM recordings {where}', params
+        ).fetchone()
+
+        if cursor:
+            value, row_id = decode_cursor(cursor)
+            conditions.append(f"({column}, id) {'<' if order == 'desc' else '>'} (?, ?)")
+            params.extend((value, row_id))
+            where = f"WHERE {' AND '.join(conditions)}"
+        rows = connection.execute(
+            f'SELECT * FROM recordings {where} ORDER BY {column} {order}, id {order} LIMIT ?',
+            params + [limit + 1]
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][column], rows[-1]['id'])
+        return {'recordings': [dict(row) for row in rows], 'total': total, 'total_size': total_size,
+                'next_cursor': next_cursor}
@@ -0,0 +1,206 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+DAY = 86400
+
+# Limits for all recordings together; 0 turns a limit off. Cameras can set
+# retention_max_gb / retention_max_days in camera_config.yml for their own.
+RETENTION_MAX_GB = float(os.environ.get('RETENTION_MAX_GB', 0))
+RETENTION_MAX_DAYS = float(os.environ.get('RETENTION_MAX_DAYS', 0))
+
+# Free space kept on the recordings volume whatever the quotas say, so the
+# recorders never run into a full disk. Off (0) unless set: on a volume that
+# is already short of it, the first pass would delete every recording not
+# marked keep
+RETENTION_MIN_FREE_GB = float(os.environ.get('RETENTION_MIN_FREE_GB', 0))
+
+# Seconds between retention passes when nothing wakes the manager
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 300))
+
+# Pause after each deletion so freeing large files never hogs the disk
+DELETE_PAUSE = 0.05
+
+# Recent history used to project growth
+GROWTH_WINDOW_DAYS = 7
+
+
+class RetentionManager:
+    """
+    Keeps the recordings directory within its quotas by deleting the oldest
+    recordings first, chosen from the recordings index rather than by
+    scanning the directory. Each pass applies, in order, the maximum age,
+    the per-camera byte quotas, then the global quota and minimum free
+    space. Recordings marked keep, still being written, or being compressed
+    are never deleted.
+
+    Passes run on a background thread every ``interval`` seconds, or sooner
+    when ``wake()`` is called after a new segment.
+    """
+
+    def __init__(self, index, directory, load_camera_settings, max_gb=RETENTION_MAX_GB,
+                 max_days=RETENTION_MAX_DAYS, min_free_gb=RETENTION_MIN_FREE_GB, interval=RETENTION_INTERVAL):
+        self.index = index
+        self.directory = directory
+        self.load_camera_settings = load_camera_settings
+        self.max_bytes = max_gb * GB
+        self.max_days = max_days
+        self.min_free_bytes = min_free_gb * GB
+        self.interval = interval
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+        self.last_run = None
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def camera_limits(self, camera_id, cameras):
+        """:return: (max bytes, max days) for a camera; 0 means unlimited"""
+        camera = cameras[camera_id] if camera_id is not None and 0 <= camera_id < len(cameras) else {}
+        max_bytes = float(camera.get('retention_max_gb', 0)) * GB
+        max_days = float(camera.get('retention_max_days', self.max_days))
+        return max_bytes, max_days
+
+    def _run(self):
+        try:
+            # On Linux this lowers only this thread, and its I/O priority
+            # follows its nice level
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Couldn't lower retention thread priority: {str(e)}")
+        while True:
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Retention pass failed: {str(e)}")
+            self._wake.wait(self.interval)
+
+    def run_once(self):
+        """
+        One retention pass
+        :return: Number of recordings deleted
+        """
+        now = time.time()
+        cameras = self.load_camera_settings()
+        usage = self.index.usage(now)
+        deleted_before = self.deleted_files
+
+        for camera_id, camera_usage in usage.items():
+            if camera_id is None:
+                continue
+            max_bytes, max_days = self.camera_limits(camera_id, cameras)
+            if max_days:
+                self._evict(camera_id=camera_id, before=now - max_days * DAY)
+            if max_bytes and camera_usage['bytes'] > max_bytes:
+                self._evict(camera_id=camera_id, need_bytes=camera_usage['bytes'] - max_bytes)
+
+        total_bytes = sum(camera_usage['bytes'] for camera_usage in self.index.usage(now).values())
+        if self.max_bytes and total_bytes > self.max_bytes:
+            self._evict(need_bytes=total_bytes - self.max_bytes)
+        free_bytes = shutil.disk_usage(self.directory).free
+        if free_bytes < self.min_free_bytes:
+            self._evict(need_bytes=self.min_free_bytes - free_bytes)
+
+        self.last_run = now
+        deleted = self.deleted_files - deleted_before
+        if deleted:
+            logger.info(f"Retention deleted {deleted} recordings")
+        return deleted
+
+    def _evict(self, camera_id=None, before=None, need_bytes=None):
+        """Delete the oldest evictable recordings until ``need_bytes`` are freed, or all before ``before``"""
+        freed = 0
+        while need_bytes is None or freed < need_bytes:
+            rows = self.index.evictable(camera_id=camera_id, before=before)
+            if not rows:
+                if need_bytes is not None:
+                    logger.warning(f"Retention is {(need_bytes - freed) / GB:.2f} GB short"
+                                   f"{f' for camera {camera_id}' if camera_id is not None else ''}; "
+                                   f"everything left is kept or in use")
+                return freed
+            for row in rows:
+                freed += self._delete(row)
+                if need_bytes is not None and freed >= need_bytes:
+                    break
+        return freed
+
+    def _delete(self, row):
+        path = os.path.join(self.directory, row['filename'])
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self.index.remove(row['filename'])
+        self.deleted_files += 1
+        self.deleted_bytes += row['size']
+        logger.debug(f"Retention deleted {row['filename']} ({row['size'] / 1e6:.1f} MB)")
+        time.sleep(DELETE_PAUSE)
+        return row['size']
+
+    def report(self):
+        """
+        Storage usage, limits and how long until they are reached at the
+        recent recording rate
+        """
+        now = time.time()
+        cameras = self.load_camera_settings()
+        usage = self.index.usage(now - GROWTH_WINDOW_DAYS * DAY)
+        disk = shutil.disk_usage(self.directory)
+
+        def daily_rate(camera_usage):
+            if not camera_usage['oldest']:
+                return 0.0
+            # Young installs project from the history they have
+            days = min(GROWTH_WINDOW_DAYS, max((now - camera_usage['oldest']) / DAY, 1 / 24))
+            return camera_usage['recent_bytes'] / days
+
+        def days_until(remaining, rate):
+            if rate <= 0:
+                return None
+            return round(max(remaining, 0) / rate, 1)
+
+        camera_reports = {}
+        for camera_id, camera_usage in usage.items():
+            max_bytes, max_days = self.camera_limits(camera_id, cameras)
+            rate = daily_rate(camera_usage)
+            camera_reports[str(camera_id)] = {
+                'count': camera_usage['count'],
+                'bytes': camera_usage['bytes'],
+                'kept_bytes': camera_usage['kept_bytes'],
+                'oldest': camera_usage['oldest'],
+                'max_bytes': max_bytes or None,
+                'max_days': max_days or None,
+                'daily_growth_bytes': round(rate),
+                'days_until_quota': days_until(max_bytes - camera_usage['bytes'], rate) if max_bytes else None
+            }
+
+        total_bytes = sum(camera_usage['bytes'] for camera_usage in usage.values())
+        total_rate = sum(daily_rate(camera_usage) for camera_usage in usage.values())
+        return {
+            'recordings_bytes': total_bytes,
+            'disk': {'total_bytes': disk.total, 'used_bytes': disk.used, 'free_bytes': disk.free},
+            'max_bytes': self.max_bytes or None,
+            'max_days': self.max_days or None,
+            'min_free_bytes': self.min_free_bytes,
+            'daily_growth_bytes': round(total_rate),
+            # Until the volume reaches the free-space floor and retention starts evicting
+            'days_until_full': days_until(disk.free - self.min_free_bytes, total_rate),
+            'days_until_quota': days_until(self.max_bytes - total_bytes, total_rate) if self.max_bytes else None,
+            'deleted_files': self.deleted_files,
+            'deleted_bytes': self.deleted_bytes,
+            'last_run': self.last_run,
+            'cameras': camera_reports
+        }
@@ -0,0 +1,111 @@
+import numpy as np
+import threading
+from packet_source import Packet
+
+# Upper bound on camera frame rate used to size the packet index
+MAX_FPS = 60
+
+
+class PacketRingBuffer:
+    """
+    Bounded in-memory history of a camera's compressed packets.
+
+    Everything is preallocated: packet payloads live in one circular
+    bytearray of ``max_bytes`` and the per-packet index (offset, length,
+    timestamp, keyframe flag, seq) in fixed-size NumPy arrays, so the memory
+    held per camera is known up front and never grows. Packets older than
+    ``max_seconds`` or overwritten by newer data are evicted oldest-first.
+    """
+
+    def __init__(self, max_seconds, max_bytes):
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.capacity = max(1, int(max_seconds * MAX_FPS))
+        self._data = bytearray(max_bytes)
+        self._offsets = np.zeros(self.capacity, dtype=np.int64)
+        self._lengths = np.zeros(self.capacity, dtype=np.int64)
+        self._timestamps = np.zeros(self.capacity, dtype=np.float64)
+        self._keyframes = np.zeros(self.capacity, dtype=np.bool_)
+        self._seqs = np.zeros(self.capacity, dtype=np.int64)
+        self._head = 0
+        self._count = 0
+        self._write_pos = 0
+        self._bytes_used = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def bytes_used(self):
+        return self._bytes_used
+
+    @property
+    def seconds_buffered(self):
+        with self._lock:
+            if not self._count:
+                return 0.0
+            tail = (self._head + self._count - 1) % self.capacity
+            return float(self._timestamps[tail] - self._timestamps[self._head])
+
+    def clear(self):
+        with self._lock:
+            self._head = self._count = self._write_pos = self._bytes_used = 0
+
+    def append(self, packet):
+        size = len(packet.data)
+        with self._lock:
+            if size > self.max_bytes:
+                # A single packet larger than the buffer breaks the GOP chain
+                self._head = self._count = self._write_pos = self._bytes_used = 0
+                return
+
+            pos = self._write_pos
+            if pos + size > self.max_bytes:
+                # Wrap around: the packets stored past the write position are the oldest
+                while self._count and self._offsets[self._head] >= pos:
+                    self._evict_oldest()
+                pos = 0
+
+            while self._count and (
+                    pos <= self._offsets[self._head] < pos + size
+                    or self._count == self.capacity
+                    or packet.timestamp - self._timestamps[self._head] > self.max_seconds):
+                self._evict_oldest()
+
+            self._data[pos:pos + size] = packet.data
+            index = (self._head + self._count) % self.capacity
+            self._offsets[index] = pos
+            self._lengths[index] = size
+            self._timestamps[index] = packet.timestamp
+            self._keyframes[index] = packet.keyframe
+            self._seqs[index] = packet.seq
+            self._count += 1
+            self._write_pos = pos + size
+            self._bytes_used += size
+
+    def packets_from_keyframe(self):
+        """
+        Copy out the buffered packets starting at the oldest keyframe, so the
+        result is decodable on its own and covers as much history as possible
+        """
+        with self._lock:
+            order = (self._head + np.arange(self._count)) % self.capacity
+            keyframe_positions = np.flatnonzero(self._keyframes[order])
+            if not len(keyframe_positions):
+                return []
+            packets = []
+            for index in order[keyframe_positions[0]:]:
+                offset = int(self._offsets[index])
+                packets.append(Packet(int(self._seqs[index]), float(self._timestamps[index]),
+                                      bytes(self._data[offset:offset + int(self._lengths[index])]),
+                                      bool(self._keyframes[index])))
+            return packets
+
+    def _evict_oldest(self):
+        self._bytes_used -= int(self._lengths[self._head])
+        self._head = (self._head + 1) % self.capacity
+        self._count -= 1
+        if not self._count:
+            self._head = 0
+            self._write_pos = 0
@@ -0,0 +1,36 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_PATH = os.environ.get('SETTINGS_PATH', 'recording_settings.json')
+
+DEFAULT_SETTINGS = {
+    'recordLength': 10,  # minutes per recording segment
+    'fileSize': 100,  # MB per recording segment
+    'autoRecord': False,
+    'quality': 'high',
+    'fps': 30
+}
+
+
+def load_settings():
+    """Load the recording settings, falling back to defaults for anything missing"""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(SETTINGS_PATH, 'r') as f:
+            settings.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error loading settings: {str(e)}")
+    return settings
+
+
+def save_settings(settings):
+    """Persist settings atomically so a crash never leaves a half-written file"""
+    tmp_path = f"{SETTINGS_PATH}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(settings, f, indent=2)
+    os.replace(tmp_path, SETTINGS_PATH)
@@ -0,0 +1,179 @@
+import cv2
+import hashlib
+import logging
+import numpy as np
+import os
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from frame_cache import DEFAULT_QUALITY, QUALITY_PROFILES, encode_jpeg
+from packet_source import CODECS, FFMPEG_BIN
+
+logger = logging.getLogger(__name__)
+
+# Oldest frame, in seconds, a snapshot may show unless the request sets max_age;
+# also how long clients may cache it
+SNAPSHOT_MAX_AGE = float(os.environ.get('SNAPSHOT_MAX_AGE', 5))
+
+# Seconds to wait for a keyframe when the camera isn't being captured
+SNAPSHOT_TIMEOUT = 10.0
+
+# Bounds on the width a snapshot can be requested at
+SNAPSHOT_MIN_WIDTH = 16
+SNAPSHOT_MAX_WIDTH = 3840
+
+# jpeg: the JPEG bytes
+# etag: strong validator, a hash of the bytes
+# captured_at: time.monotonic() the image was captured or published
+Snapshot = namedtuple('Snapshot', ['jpeg', 'etag', 'captured_at'])
+
+
+def parse_snapshot_args(args):
+    """
+    Validate snapshot query parameters
+    :param args: Mapping of parameter name to string value
+    :return: (width or None, quality, max_age); raises ValueError if invalid
+    """
+    quality = args.get('quality') or DEFAULT_QUALITY
+    if quality not in QUALITY_PROFILES:
+        raise ValueError('Unknown quality')
+    width = args.get('width')
+    if width:
+        width = int(width)
+        if not SNAPSHOT_MIN_WIDTH <= width <= SNAPSHOT_MAX_WIDTH:
+            raise ValueError(f'width must be between {SNAPSHOT_MIN_WIDTH} and {SNAPSHOT_MAX_WIDTH}')
+    else:
+        width = None
+    max_age = float(args.get('max_age') or SNAPSHOT_MAX_AGE)
+    if not 0 <= max_age <= 3600:
+        raise ValueError('max_age must be between 0 and 3600 seconds')
+    return width, quality, max_age
+
+
+def decode_keyframe(packet, codec):
+    """:return: BGR frame decoded from one self-contained keyframe access unit"""
+    spec = CODECS[codec]
+    cmd = [FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin',
+           '-f', spec['format'], '-i', 'pipe:0', '-frames:v', '1', '-c:v', 'bmp', '-f', 'image2pipe', 'pipe:1']
+    result = subprocess.run(cmd, input=packet.data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=10)
+    frame = None
+    if result.stdout:
+        frame = cv2.imdecode(np.frombuffer(result.stdout, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise RuntimeError(result.stderr.decode(errors='replace').strip() or 'keyframe did not decode')
+    return frame
+
+
+class SnapshotCache:
+    """
+    Stills of one camera, served from what its hub already has in memory.
+
+    While viewers keep the decoder running, a snapshot is the newest
+    published frame, and at the default width it is the very JPEG the
+    viewers get. Otherwise the hub is pinned until its next keyframe, and
+    that single keyframe is decoded. No stream decoder is started, and the
+    capture stops after the hub's grace period. Each image is encoded once
+    per (width, quality), so repeated snapshots of the same frame cost a
+    dictionary lookup. Concurrent requests wait for one capture instead of
+    starting their own. A live frame the decoder scaled below the requested
+    width is not used; the keyframe is decoded at full resolution instead.
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self._lock = threading.Lock()
+        self._source = None
+        self._captured_at = None
+        self._frame = None
+        self._keyframe = None
+        self._full_resolution = False
+        self._snapshots = {}
+
+    def get(self, width=None, quality=DEFAULT_QUALITY, max_age=SNAPSHOT_MAX_AGE, timeout=SNAPSHOT_TIMEOUT):
+        """
+        :param width: Scale down to this width; None for the quality level's maximum
+        :param max_age: Oldest frame, in seconds, that may be returned
+        :return: Snapshot, or None if the camera sent no keyframe within ``timeout``
+        """
+        with self._lock:
+            now = time.monotonic()
+            since = now - max_age
+            live = self.hub.latest_frame()
+            usable = False
+            if live is not None:
+                seq, frame, published_at = live
+                full_resolution = self._is_full_resolution(frame)
+                # A live frame is as fresh as it gets until the next one is due, but
+                # it may have been decoded smaller than this snapshot needs
+                usable = (published_at >= min(since, now - 2.0 / self.hub.frame_rate)
+                          and self._covers(frame.shape[1], full_resolution, width, quality))
+            if usable:
+                self._set_source(('frame', seq), published_at, frame=frame, full_resolution=full_resolution)
+            elif (self._source is None or self._captured_at < since
+                  or not self._covers(self._frame.shape[1] if self._frame is not None else 0,
+                                      self._full_resolution, width, quality)):
+                packet = self._capture_keyframe(since, timeout)
+                if packet is None:
+                    return None
+                self._set_source(('keyframe', packet.seq, packet.timestamp), packet.timestamp,
+                                 keyframe=packet, full_resolution=True)
+
+            snapshot = self._snapshots.get((width, quality))
+            if snapshot is None:
+                snapshot = self._encode(width, quality)
+                self._snapshots[(width, quality)] = snapshot
+            return snapshot
+
+    def _is_full_resolution(self, frame):
+        """Whether a live frame is the main stream at its native width"""
+        plan = self.hub.decode_plan
+        # The decoder only scales down, so a frame narrower than the plan's width wasn't scaled
+        return (plan is not None and plan.source == 'main'
+                and (plan.width is None or frame.shape[1] < plan.width))
+
+    @staticmethod
+    def _covers(frame_width, full_resolution, width, quality):
+        """Whether a frame is wide enough for a snapshot of ``width`` at ``quality``"""
+        needed = width or QUALITY_PROFILES[quality]['max_width']
+        return full_resolution or (needed is not None and frame_width >= needed)
+
+    def _set_source(self, source, captured_at, frame=None, keyframe=None, full_resolution=False):
+        if source == self._source:
+            return
+        self._source = source
+        self._captured_at = captured_at
+        self._frame = frame
+        self._keyframe = keyframe
+        self._full_resolution = full_resolution
+        self._snapshots = {}
+
+    def _capture_keyframe(self, since, timeout):
+        # A running capture answers at once if its last keyframe is recent enough
+        self.hub.pin()
+        try:
+            packet = self.hub.wait_for_keyframe(since, timeout)
+        finally:
+            self.hub.unpin()
+        if packet is None:
+            logger.warning(f"No keyframe from {self.hub.name} for a snapshot")
+        return packet
+
+    def _encode(self, width, quality):
+        jpeg = None
+        if self._source[0] == 'frame' and width is None:
+            # The viewers' JPEG of this frame, if one was made
+            encoded = self.hub.frame_cache.get(quality)
+            if encoded is not None and encoded.seq == self._source[1]:
+                jpeg = bytes(encoded.jpeg)
+        if jpeg is None:
+            if self._frame is None:
+                start = time.monotonic()
+                self._frame = decode_keyframe(self._keyframe, self.hub.codec)
+                logger.debug(f"Decoded a keyframe of {self.hub.name} for a snapshot in "
+                             f"{(time.monotonic() - start) * 1000:.0f} ms")
+            buffer = encode_jpeg(self._frame, quality, width)
+            if buffer is None:
+                raise RuntimeError(f"Failed to encode snapshot of {self.hub.name}")
+            jpeg = buffer.tobytes()
+        return Snapshot(jpeg, hashlib.sha1(jpeg).hexdigest()[:20], self._captured_at)
@@ -0,0 +1,126 @@
+// Live frames for many cameras over one WebSocket (the server's /frames
+// Socket.IO namespace). Only the small part of the Socket.IO protocol the
+// namespace uses is implemented, so no client library has to be loaded.
+(function() {
+    const NAMESPACE = '/frames';
+    const RECONNECT_DELAY = 2000;
+    // Connections that may close before joining the namespace before the
+    // socket gives up and calls onUnavailable (WebSockets blocked by a proxy,
+    // or a server mode without them)
+    const MAX_FAILED_CONNECTS = 2;
+
+    class FrameSocket {
+        constructor() {
+            this.cameras = new Map();  // cameraId -> {img, options, objectUrl}
+            this.ws = null;
+            this.ready = false;
+            this.expectingFrame = false;
+            this.failedConnects = 0;
+            this.onUnavailable = null;
+        }
+
+        connect() {
+            const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+            this.ws = new WebSocket(`${protocol}//${window.location.host}/socket.io/?EIO=4&transport=websocket`);
+            this.ws.binaryType = 'arraybuffer';
+            this.ws.onmessage = event => this.onMessage(event.data);
+            this.ws.onclose = () => {
+                if (!this.ready) {
+                    this.failedConnects += 1;
+                }
+                this.ready = false;
+                if (this.failedConnects >= MAX_FAILED_CONNECTS && this.onUnavailable) {
+                    this.onUnavailable();
+                    return;
+                }
+                setTimeout(() => this.connect(), RECONNECT_DELAY);
+            };
+        }
+
+        send(packet) {
+            if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+                this.ws.send(packet);
+            }
+        }
+
+        emit(name, data) {
+            if (this.ready) {
+                this.send(`42${NAMESPACE},${JSON.stringify([name, data])}`);
+            }
+        }
+
+        onMessage(data) {
+            if (typeof data !== 'string') {
+                // Attachment of the preceding binary event
+                if (this.expectingFrame) {
+                    this.expectingFrame = false;
+                    this.onFrame(data);
+                }
+                return;
+            }
+            switch (data[0]) {
+                case '0':  // Engine.IO open: join the frames namespace
+                    this.send(`40${NAMESPACE},`);
+                    break;
+                case '2':  // ping
+                    this.send('3');
+                    break;
+                case '4':  // Socket.IO packet
+                    if (data.startsWith(`40${NAMESPACE},`)) {
+                        this.ready = true;
+                        this.failedConnects = 0;
+                        this.cameras.forEach((camera, cameraId) => this.emit('subscribe', camera.options));
+                    } else if (data.startsWith(`451-${NAMESPACE},["frame"`)) {
+                        this.expectingFrame = true;
+                    } else if (data.startsWith(`44${NAMESPACE},`)) {
+                        // Namespace refused, e.g. the session has expired
+                        window.location.reload();
+                    }
+                    break;
+            }
+        }
+
+        onFrame(buffer) {
+            const view = new DataView(buffer);
+            const cameraId = view.getUint32(0);
+            const camera = this.cameras.get(cameraId);
+            if (!camera) {
+                return;
+            }
+            const previousUrl = camera.objectUrl;
+            camera.objectUrl = URL.createObjectURL(new Blob([new Uint8Array(buffer, 8)], {type: 'image/jpeg'}));
+            camera.img.onload = camera.img.onerror = () => {
+                if (previousUrl) {
+                    URL.revokeObjectURL(previousUrl);
+                }
+                // Ask for the next frame only once this one is on screen
+                this.emit('ack', {camera: cameraId});
+            };
+            camera.img.src = camera.objectUrl;
+        }
+
+        subscribe(cameraId, img, quality, fps) {
+            const options = {camera: cameraId, quality: quality || 'high', fps: fps || 30};
+            const camera = this.cameras.get(cameraId);
+            if (camera) {
+                camera.options = options;
+            } else {
+                this.cameras.set(cameraId, {img, options, objectUrl: null});
+            }
+            this.emit('subscribe', options);
+        }
+
+        unsubscribe(cameraId) {
+            if (this.cameras.delete(cameraId)) {
+                this.emit('unsubscribe', {camera: cameraId});
+            }
+        }
+
+        options(cameraId) {
+            const camera = this.cameras.get(cameraId);
+            return camera ? camera.options : null;
+        }
+    }
+
+    window.FrameSocket = FrameSocket;
+})();
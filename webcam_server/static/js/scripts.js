@@ -169,11 +169,13 @@ document.addEventListener('DOMContentLoaded', function() {
                     const size = (recording.size / 1024 / 1024).toFixed(2); // Convert to MB
                     li.innerHTML = `
                         <a href="${recording.url}" target="_blank">
+                            <span class="recording-thumbnail"></span>
                             <span class="recording-name">${recording.name}</span>
                             <span class="recording-info">
                                 ${recording.date} | ${size} MB
                             </span>
                         </a>`;
+                    attachPreview(li.querySelector('.recording-thumbnail'), recording);
                     recordingsList.appendChild(li);
                 });
                 
@@ -189,6 +191,36 @@ document.addEventListener('DOMContentLoaded', function() {
 
     window.toggleRecordingsMenu = toggleRecordingsMenu;
 
+    // Show the poster, and scrub through the sprite sheet as the pointer moves across it
+    function attachPreview(element, recording) {
+        if (!recording.thumbnail_url) {
+            element.remove();
+            return;
+        }
+        const poster = `url("${recording.thumbnail_url}")`;
+        element.style.backgroundImage = poster;
+        const sprite = recording.sprite;
+        if (!sprite) return;
+
+        const rows = Math.ceil(sprite.count / sprite.columns);
+        element.addEventListener('mousemove', event => {
+            const bounds = element.getBoundingClientRect();
+            const fraction = Math.min(Math.max((event.clientX - bounds.left) / bounds.width, 0), 0.999);
+            const tile = Math.floor(fraction * sprite.count);
+            const column = tile % sprite.columns;
+            const row = Math.floor(tile / sprite.columns);
+            element.style.backgroundImage = `url("${sprite.url}")`;
+            element.style.backgroundSize = `${sprite.columns * 100}% ${rows * 100}%`;
+            element.style.backgroundPosition = `${sprite.columns > 1 ? column / (sprite.columns - 1) * 100 : 0}% `
+                + `${rows > 1 ? row / (rows - 1) * 100 : 0}%`;
+        });
+        element.addEventListener('mouseleave', () => {
+            element.style.backgroundImage = poster;
+            element.style.backgroundSize = '';
+            element.style.backgroundPosition = '';
+        });
+    }
+
     async function toggleRecording(cameraId) {
         const statusElement = document.getElementById(`recordStatus${cameraId}`);
         const durationElement = document.getElementById(`recordDuration${cameraId}`);
@@ -226,16 +258,59 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 1000);
     }
 
-    function setQuality(cameraId, quality) {
-        fetch(`/camera/${cameraId}/quality`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ quality })
+    // Tiles get their frames over one shared WebSocket, and only while they are
+    // on screen; browsers without it, or when the socket can't connect, fall
+    // back to one MJPEG stream per tile
+    const cameraFeeds = document.querySelectorAll('img[data-camera-id]');
+    let frameSocket = window.WebSocket && window.IntersectionObserver ? new FrameSocket() : null;
+
+    function startMjpeg(feed) {
+        const url = new URL(feed.dataset.src, window.location.origin);
+        if (feed.dataset.quality) {
+            url.searchParams.set('quality', feed.dataset.quality);
+        }
+        feed.src = url.toString();
+    }
+
+    if (frameSocket) {
+        const tileObserver = new IntersectionObserver(entries => {
+            entries.forEach(entry => {
+                const cameraId = parseInt(entry.target.dataset.cameraId);
+                if (entry.isIntersecting) {
+                    frameSocket.subscribe(cameraId, entry.target, entry.target.dataset.quality);
+                } else {
+                    frameSocket.unsubscribe(cameraId);
+                }
+            });
         });
+        cameraFeeds.forEach(feed => tileObserver.observe(feed));
+        frameSocket.onUnavailable = () => {
+            tileObserver.disconnect();
+            frameSocket = null;
+            cameraFeeds.forEach(startMjpeg);
+        };
+        frameSocket.connect();
+    } else {
+        cameraFeeds.forEach(startMjpeg);
     }
 
+    function setQuality(cameraId, quality) {
+        // Switch the tile to the server's shared encoded variant for this quality
+        const feed = document.getElementById(`cameraFeed${cameraId}`);
+        feed.dataset.quality = quality;
+        if (frameSocket) {
+            if (frameSocket.options(cameraId)) {
+                frameSocket.subscribe(cameraId, feed, quality);
+            }
+            return;
+        }
+        const url = new URL(feed.src, window.location.origin);
+        url.searchParams.set('quality', quality);
+        feed.src = url.toString();
+    }
+
+    window.setQuality = setQuality;
+
     async function startRecording(cameraId) {
         try {
             const response = await fetch(`/camera/${cameraId}/record/start`, {
@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import math
+import os
+import re
+import subprocess
+import threading
+import time
+from compressor import idle_command, probe
+from packet_source import FFMPEG_BIN
+from recorder import RECORDINGS_DIR
+
+logger = logging.getLogger(__name__)
+
+# On the recordings volume, like the index that refers to these images
+PREVIEW_CACHE_DIR = os.environ.get('PREVIEW_CACHE_DIR', os.path.join(RECORDINGS_DIR, 'previews'))
+
+# Poster thumbnail width; height follows the aspect ratio
+THUMBNAIL_WIDTH = 320
+
+# Sprite sheets hold one SPRITE_TILE_WIDTH tile every SPRITE_INTERVAL seconds,
+# SPRITE_COLUMNS to a row, with the interval stretched for long recordings so
+# a sheet never exceeds SPRITE_MAX_TILES
+SPRITE_TILE_WIDTH = 160
+SPRITE_INTERVAL = 10.0
+SPRITE_COLUMNS = 10
+SPRITE_MAX_TILES = 100
+
+# mjpeg quantizer for previews (2 best - 31 worst)
+PREVIEW_QUALITY = 5
+
+# Seconds between checks for recordings without previews
+PREVIEW_POLL_INTERVAL = 30.0
+
+# Seconds between removals of cached images no recording refers to; images
+# younger than this are left alone in case their row isn't updated yet
+CACHE_SWEEP_INTERVAL = 3600.0
+
+DURATION = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+# Cache names: content hash + extension, so they are safe to serve forever
+PREVIEW_NAME = re.compile(r'^[0-9a-f]{32}\.jpg$')
+
+
+class PreviewGenerator:
+    """
+    Makes a poster thumbnail and a scrub-preview sprite sheet for each
+    finished recording, newest first, on a background thread.
+
+    Only keyframes are decoded (``-skip_frame nokey``), so a preview costs a
+    few dozen frame decodes however long the recording is, and ffmpeg runs at
+    nice 19. Images are stored under the hash of their content, which makes
+    them immutable: the URL changes whenever the image does, so they can be
+    served with year-long cache headers.
+    """
+
+    def __init__(self, index, directory, cache_dir=PREVIEW_CACHE_DIR):
+        self.index = index
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self._swept_at = 0.0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='previews', daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def path_for(self, name):
+        """:return: Cache path of an image name, or None if it isn't one"""
+        if not PREVIEW_NAME.match(name):
+            return None
+        return os.path.join(self.cache_dir, name[:2], name)
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                rows = self.index.without_previews()
+                for row in rows:
+                    self.generate(row)
+                if rows:
+                    continue
+                if time.time() - self._swept_at >= CACHE_SWEEP_INTERVAL:
+                    self.sweep()
+            except Exception as e:
+                logger.error(f"Preview generation error: {str(e)}")
+            self._wake.wait(PREVIEW_POLL_INTERVAL)
+
+    def generate(self, row):
+        """Make and index the previews of one recording"""
+        filename = row['filename']
+        path = os.path.join(self.directory, filename)
+        start = time.monotonic()
+        try:
+            match = DURATION.search(probe(path))
+            duration = 0.0
+            if match:
+                duration = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+            thumbnail = self._store(self._poster(path, duration))
+        except Exception as e:
+            logger.error(f"Error making previews for {filename}: {str(e)}")
+            # Don't retry every poll; the file is unreadable or gone
+            self.index.set_previews(filename, '')
+            return
+
+        interval = max(SPRITE_INTERVAL, duration / SPRITE_MAX_TILES)
+        count = max(1, math.ceil(duration / interval))
+        columns = min(SPRITE_COLUMNS, count)
+        rows = math.ceil(count / columns)
+        video_filter = f'scale={SPRITE_TILE_WIDTH}:-2'
+        if count > 1:
+            video_filter = f'fps=1/{interval:.3f},{video_filter},tile={columns}x{rows}'
+        try:
+            sprite = self._store(self._extract(['-skip_frame', 'nokey', '-i', path, '-vf', video_filter]))
+        except Exception as e:
+            logger.warning(f"No sprite sheet for {filename}: {str(e)}")
+            self.index.set_previews(filename, thumbnail)
+            return
+        self.index.set_previews(filename, thumbnail, sprite, interval, columns, count)
+        logger.debug(f"Previews for {filename} made in {time.monotonic() - start:.2f}s")
+
+    def _poster(self, path, duration):
+        """:return: JPEG of the keyframe nearest the middle of the recording"""
+        args = ['-skip_frame', 'nokey', '-i', path, '-vf', f'scale={THUMBNAIL_WIDTH}:-2']
+        try:
+            # Input seeking jumps straight to the keyframes around the midpoint
+            return self._extract(['-ss', f'{duration / 2:.3f}'] + args)
+        except RuntimeError:
+            # No keyframe after the midpoint; use the first one
+            return self._extract(args)
+
+    def _extract(self, args):
+        """:return: JPEG bytes of the single frame ffmpeg renders from ``args``"""
+        cmd = [FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin'] + args + [
+            '-frames:v', '1', '-c:v', 'mjpeg', '-q:v', str(PREVIEW_QUALITY), '-f', 'image2pipe', 'pipe:1']
+        result = subprocess.run(idle_command(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=300)
+        if result.returncode != 0 or not result.stdout:
+            raise RuntimeError(result.stderr.decode(errors='replace').strip() or 'no frame decoded')
+        return result.stdout
+
+    def _store(self, data):
+        """:return: Cache name of ``data``, written if it isn't cached already"""
+        name = f'{hashlib.sha256(data).hexdigest()[:32]}.jpg'
+        path = self.path_for(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return name
+
+    def sweep(self):
+        """Delete cached images of recordings that no longer exist"""
+        self._swept_at = now = time.time()
+        referenced = self.index.preview_names()
+        removed = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if name in referenced:
+                    continue
+                try:
+                    if now - os.path.getmtime(path) >= CACHE_SWEEP_INTERVAL:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            logger.info(f"Removed {removed} unused preview images")
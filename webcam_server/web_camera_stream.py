@@ -1,14 +1,30 @@
-import cv2
-import yaml
 from flask import Flask, render_template, Response, jsonify, request, url_for, send_from_directory, redirect, flash
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+from flask_socketio import SocketIO
 import logging
-from ptz_controller import PTZController
+from ptz_controller import PTZPool
+from camera_hub import get_hub, all_hubs
+from metrics import registered as registered_metrics, render_prometheus
+from config import ConfigRegistry, SecureConfig
+from frame_cache import DEFAULT_QUALITY, QUALITY_PROFILES
+from recorder import CameraRecorder, RECORDINGS_DIR
+from recordings_index import RecordingsIndex
+from compressor import VideoCompressor
+from retention import RetentionManager
+from thumbnails import PreviewGenerator
+from snapshots import parse_snapshot_args
+from mosaic import parse_mosaic_args, open_mosaic, close_mosaic
+from settings_store import load_settings, save_settings
+from motion_detector import MotionMonitor
+from frame_socket import FrameNamespace
+from ptz_socket import PTZStatusNamespace
+from validators import validate_settings
+from marshmallow import ValidationError
 import os
 from datetime import datetime
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.utils import safe_join, secure_filename
 from threading import Thread
-import time
 import sys
 from auth import Auth
 import secrets
@@ -25,10 +41,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-RECORDINGS_DIR = os.path.join(os.path.dirname(__file__), 'static', 'recordings')
 if not os.path.exists(RECORDINGS_DIR):
     os.makedirs(RECORDINGS_DIR)
 
+recording_settings = load_settings()
+
+# Catalog of finished recordings; /recordings queries it instead of the directory
+recordings_index = RecordingsIndex()
+
+# Re-encode finished recordings in the background at idle priority
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+compressor = VideoCompressor(recordings_index, RECORDINGS_DIR)
+
+# Poster thumbnails and scrub sprites; named by content hash, so cached for a year
+previews = PreviewGenerator(recordings_index, RECORDINGS_DIR)
+PREVIEW_MAX_AGE = 365 * 24 * 3600
+
+# Internal nginx location aliased to RECORDINGS_DIR. When set, recordings are
+# handed to nginx with X-Accel-Redirect so it streams them with sendfile()
+# instead of this process copying them through Python
+RECORDINGS_ACCEL_REDIRECT = os.environ.get('RECORDINGS_ACCEL_REDIRECT')
+
+# Bearer token a Prometheus scraper can send to /metrics; without one,
+# /metrics needs a logged-in session like the rest of the API
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Per-client frame rate caps accepted by /video_feed, as in validators.SettingsSchema
+STREAM_FPS_OPTIONS = (15, 24, 30)
+
 # Add these after app initialization
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 auth = Auth(app)
@@ -49,61 +89,94 @@ talisman = Talisman(
     }
 )
 
+# Binary WebSocket frame push; several cameras share one connection
+socketio = SocketIO(app, async_mode='threading')
+
 class CameraStream:
-    def __init__(self, camera_settings):
+    def __init__(self, camera_id, camera_settings, quality=DEFAULT_QUALITY, max_fps=None, client=None):
+        self.camera_id = camera_id
         self.camera_settings = camera_settings
-        self.cap = None
+        self.quality = quality
+        self.max_fps = max_fps
+        self.client = client
+        self.hub = get_hub(camera_id, camera_settings)
 
     def get_video_stream(self):
-        """Generator function to yield video frames"""
-        stream_url = self.camera_settings['url']
-        logger.info(f"Attempting to connect to: {stream_url}")
+        """
+        Generator function to yield video frames from the shared camera hub.
+        Each iteration takes the newest frame, so a slow client skips frames
+        rather than building up latency. While the hub reconnects to the
+        camera, the last good frame is repeated so the stream stays open.
+        """
+        subscription = self.hub.subscribe(self.quality, self.max_fps, self.client)
+        logger.info(f"Viewer attached to camera: {self.camera_settings['name']} "
+                    f"({self.hub.subscriber_count} watching)")
 
         try:
-            # Create capture object with FFMPEG backend
-            self.cap = cv2.VideoCapture(stream_url, cv2.CAP_FFMPEG)
-
-            if not self.cap.isOpened():
-                logger.error(f"Could not open camera stream for {self.camera_settings['name']}.")
-                return
-
-            logger.info(f"Successfully connected to camera: {self.camera_settings['name']}")
-
             while True:
-                ret, frame = self.cap.read()
-                if not ret:
-                    logger.error(f"Can't receive frame from {self.camera_settings['name']} (stream ended?)")
-                    break
-
-                # Encode the frame in JPEG format
-                ret, buffer = cv2.imencode('.jpg', frame)
-                if not ret:
-                    logger.error(f"Failed to encode frame from {self.camera_settings['name']}.")
-                    continue
-
-                frame = buffer.tobytes()
-
-                # Yield the frame in byte format
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+                # Frames are JPEG-encoded once per quality level by the hub
+                encoded = subscription.next_encoded()
+                if encoded is None:
+                    if not self.hub.is_running:
+                        logger.error(f"No frames from {self.camera_settings['name']} (stream ended?)")
+                        break
+                    encoded = self.hub.frame_cache.get(self.quality)
+                    if encoded is None:
+                        continue
+
+                # Yield the shared multipart-framed bytes without copying
+                yield encoded.payload
 
         except Exception as e:
             logger.error(f"Error in camera stream {self.camera_settings['name']}: {str(e)}")
             raise
 
         finally:
-            # Cleanup
-            if self.cap is not None:
-                self.cap.release()
-                logger.info(f"Stream closed for camera: {self.camera_settings['name']}")
+            # Detach from the hub; it shuts the capture down after the grace period
+            subscription.close()
+            logger.info(f"Viewer detached from camera: {self.camera_settings['name']}")
+
+# Parsed once per change of camera_config.yml; onvif passwords are stored
+# encrypted when ENCRYPTION_KEY is set
+camera_config = ConfigRegistry(
+    os.environ.get('CAMERA_CONFIG_PATH', 'camera_config.yml'),
+    SecureConfig() if os.environ.get('ENCRYPTION_KEY') else None
+)
 
 def load_camera_settings():
-    try:
-        with open('camera_config.yml', 'r') as f:
-            return yaml.safe_load(f)
-    except Exception as e:
-        logger.error(f"Error loading camera config: {str(e)}")
-        return []
+    return camera_config.get()
+
+# Deletes the oldest recordings to stay within the storage quotas
+retention = RetentionManager(recordings_index, RECORDINGS_DIR, load_camera_settings)
+
+def apply_camera_config(changed_ids, cameras):
+    """Restart only the pipelines of cameras whose settings changed"""
+    hubs = all_hubs()
+    for camera_id in changed_ids:
+        camera = cameras[camera_id] if camera_id < len(cameras) else None
+        ptz_pool.update(camera_id, camera)
+        monitor = motion_monitors.pop(camera_id, None)
+        if monitor is not None:
+            monitor.stop()
+        if camera is None:
+            if camera_id in camera_recorders:
+                camera_recorders[camera_id].stop_recording()
+            logger.info(f"Camera {camera_id} removed from config")
+            continue
+        if camera_id in camera_recorders:
+            camera_recorders[camera_id].settings = camera
+        if camera_id in hubs:
+            hubs[camera_id].reconfigure(camera)
+        logger.info(f"Camera {camera_id} ({camera.get('name')}) settings changed")
+    apply_auto_record()
+
+socketio.on_namespace(FrameNamespace(socketio, load_camera_settings, STREAM_FPS_OPTIONS))
+
+def start_always_on_cameras():
+    """Keep cameras marked always_on capturing so their pre-event buffer stays full"""
+    for camera_id, camera in enumerate(load_camera_settings()):
+        if camera.get('always_on'):
+            get_hub(camera_id, camera).pin()
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -139,9 +212,16 @@ def index():
 def video_feed(camera_id):
     """Video streaming route. Put this in the src attribute of an img tag."""
     camera_settings = load_camera_settings()
+    quality = request.args.get('quality', DEFAULT_QUALITY)
+    if quality not in QUALITY_PROFILES:
+        return "Unknown quality", 400
+    max_fps = request.args.get('fps', recording_settings['fps'], type=int)
+    if max_fps not in STREAM_FPS_OPTIONS:
+        return "Unsupported fps", 400
     if camera_id < len(camera_settings):
         try:
-            camera_stream = CameraStream(camera_settings[camera_id])
+            camera_stream = CameraStream(camera_id, camera_settings[camera_id], quality,
+                                         max_fps, request.remote_addr)
             return Response(camera_stream.get_video_stream(),
                           mimetype='multipart/x-mixed-replace; boundary=frame')
         except Exception as e:
@@ -150,74 +230,243 @@ def video_feed(camera_id):
     else:
         return "Camera not found", 404
 
-ptz_controllers = {}
+def get_mosaic_stream(layout, camera_settings):
+    """
+    Generator of a mosaic's MJPEG frames. Viewers of the same layout share
+    one compositor; the newest frame is taken each time, so a slow client
+    skips frames, and the last one is repeated while no tile changes.
+    """
+    mosaic = open_mosaic(layout, camera_settings)
+    last_seq = 0
+    try:
+        while True:
+            encoded = mosaic.wait_for_frame(last_seq)
+            if encoded is None:
+                encoded = mosaic.latest()
+                if encoded is None:
+                    continue
+            last_seq = encoded.seq
+            yield encoded.payload
+    finally:
+        close_mosaic(mosaic)
 
-def init_ptz_controller(camera_settings):
-    """Initialize PTZ controller for a camera"""
-    if 'onvif' in camera_settings:
-        try:
-            controller = PTZController(
-                camera_settings['onvif']['host'],
-                camera_settings['onvif']['username'],
-                camera_settings['onvif']['password']
-            )
-            return controller
-        except Exception as e:
-            logger.error(f"Failed to initialize PTZ controller: {str(e)}")
-    return None
+@app.route('/video_feed/mosaic')
+@login_required
+def mosaic_feed():
+    """
+    Several cameras tiled into one MJPEG stream. Query parameters: cameras
+    (comma-separated ids, default all), columns, width, fps and quality.
+    """
+    camera_settings = load_camera_settings()
+    try:
+        layout = parse_mosaic_args(request.args, len(camera_settings))
+    except ValueError as e:
+        return str(e), 400
+    try:
+        return Response(get_mosaic_stream(layout, camera_settings),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+    except Exception as e:
+        logger.error(f"Error in mosaic feed: {str(e)}")
+        return f"Error: {str(e)}", 500
+
+@app.route('/camera/<int:camera_id>/snapshot.jpg')
+@login_required
+def camera_snapshot(camera_id):
+    """
+    The camera's latest frame as a JPEG, from memory when its pipeline is
+    running. Query parameters: quality, width, and max_age (oldest frame
+    accepted, in seconds, which is also how long the client may cache it).
+    """
+    camera_settings = load_camera_settings()
+    if camera_id >= len(camera_settings):
+        return jsonify({'error': 'Camera not found'}), 404
+    try:
+        width, quality, max_age = parse_snapshot_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        hub = get_hub(camera_id, camera_settings[camera_id])
+        snapshot = hub.snapshots.get(width, quality, max_age)
+        if snapshot is None:
+            return jsonify({'error': 'No frame available'}), 503
+        response = Response(snapshot.jpeg, mimetype='image/jpeg')
+        response.set_etag(snapshot.etag)
+        response.cache_control.private = True
+        if int(max_age):
+            response.cache_control.max_age = int(max_age)
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error(f"Snapshot error for camera {camera_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/camera/<int:camera_id>/clients')
+@login_required
+def camera_clients(camera_id):
+    """Per-viewer delivery stats, including frames dropped for slow clients"""
+    camera_settings = load_camera_settings()
+    if camera_id >= len(camera_settings):
+        return jsonify({'error': 'Camera not found'}), 404
+    hub = get_hub(camera_id, camera_settings[camera_id])
+    return jsonify({'clients': hub.client_stats()})
+
+def pipeline_status():
+    """
+    Pipeline metrics of each camera with a hub, or only the one in the
+    ``camera`` query parameter
+    :return: {camera_id: CameraMetrics.status()}
+    """
+    camera_id = request.args.get('camera', type=int)
+    return {
+        str(metrics_id): camera_metrics.status()
+        for metrics_id, camera_metrics in sorted(registered_metrics().items())
+        if camera_id is None or metrics_id == camera_id
+    }
+
+@app.route('/status/frame_rate')
+@login_required
+def status_frame_rate():
+    """Average measured frame rate of the running cameras"""
+    try:
+        cameras = pipeline_status()
+        running = [status['fps'] for status in cameras.values() if status['running']]
+        return jsonify({
+            'rate': round(sum(running) / len(running), 1) if running else 0,
+            'cameras': {camera_id: status['fps'] for camera_id, status in cameras.items()}
+        })
+    except Exception as e:
+        logger.error(f"Frame rate status error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/status/stream_rate')
+@login_required
+def status_stream_rate():
+    """Bitrate received from the cameras and sent to viewers, in Mbps"""
+    try:
+        cameras = pipeline_status()
+        return jsonify({
+            'rate': round(sum(status['in_mbps'] for status in cameras.values()), 2),
+            'out_rate': round(sum(status['out_mbps'] for status in cameras.values()), 2),
+            'cameras': {camera_id: {'in': status['in_mbps'], 'out': status['out_mbps']}
+                        for camera_id, status in cameras.items()}
+        })
+    except Exception as e:
+        logger.error(f"Stream rate status error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/status/signal_strength')
+@login_required
+def status_signal_strength():
+    """Worst stream health of the running cameras: Strong, Moderate or Weak"""
+    try:
+        cameras = pipeline_status()
+        signals = [status['signal'] for status in cameras.values() if status['signal']]
+        strength = 'Idle'
+        for level in ('Weak', 'Moderate', 'Strong'):
+            if level in signals:
+                strength = level
+                break
+        return jsonify({
+            'strength': strength,
+            'cameras': {camera_id: status['signal'] for camera_id, status in cameras.items()}
+        })
+    except Exception as e:
+        logger.error(f"Signal strength status error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/status/cameras')
+@login_required
+def status_cameras():
+    """Every pipeline metric of each camera: rates, latencies, drops and reconnects"""
+    try:
+        return jsonify({'cameras': pipeline_status()})
+    except Exception as e:
+        logger.error(f"Pipeline status error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Pipeline metrics of every camera in the Prometheus text format"""
+    if not current_user.is_authenticated:
+        authorization = request.headers.get('Authorization', '')
+        if not METRICS_TOKEN or not secrets.compare_digest(authorization, f'Bearer {METRICS_TOKEN}'):
+            return Response('Unauthorized', 401, {'WWW-Authenticate': 'Bearer'})
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# ONVIF sessions are connected at startup and rebuilt in the background
+ptz_pool = PTZPool()
+socketio.on_namespace(PTZStatusNamespace(socketio, ptz_pool))
+
+def get_ptz_controller(camera_id):
+    """
+    :return: (controller, None), or (None, error response) if it isn't usable right now
+    """
+    if not ptz_pool.is_configured(camera_id):
+        return None, (jsonify({'error': 'PTZ not available for this camera'}), 400)
+    controller = ptz_pool.get(camera_id)
+    if controller is None:
+        return None, (jsonify({'error': 'PTZ connecting, try again shortly'}), 503)
+    return controller, None
 
 @app.route('/ptz/<int:camera_id>/move', methods=['POST'])
 def ptz_move(camera_id):
-    """Handle PTZ movement commands"""
+    """Queue a PTZ movement; superseded moves are dropped before reaching the camera"""
     try:
         camera_settings = load_camera_settings()
         if camera_id >= len(camera_settings):
             return jsonify({'error': 'Camera not found'}), 404
 
-        if camera_id not in ptz_controllers:
-            ptz_controllers[camera_id] = init_ptz_controller(camera_settings[camera_id])
-
-        if not ptz_controllers[camera_id]:
-            return jsonify({'error': 'PTZ not available for this camera'}), 400
+        controller, error_response = get_ptz_controller(camera_id)
+        if error_response:
+            return error_response
 
         data = request.get_json()
         movement_type = data.get('type', 'continuous')
+        if movement_type not in ('continuous', 'absolute'):
+            return jsonify({'error': 'Unknown movement type'}), 400
         pan = float(data.get('pan', 0))
         tilt = float(data.get('tilt', 0))
         zoom = float(data.get('zoom', 0))
 
-        if movement_type == 'continuous':
-            ptz_controllers[camera_id].move_continuous(pan, tilt, zoom)
-        elif movement_type == 'absolute':
-            ptz_controllers[camera_id].move_absolute(pan, tilt, zoom)
-        
-        return jsonify({'status': 'success'})
+        seq = ptz_pool.dispatcher(camera_id).submit(movement_type, pan, tilt, zoom)
+        return jsonify({'status': 'queued', 'seq': seq}), 202
     except Exception as e:
         logger.error(f"PTZ movement error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/ptz/<int:camera_id>/stop', methods=['POST'])
 def ptz_stop(camera_id):
-    """Stop PTZ movement"""
+    """Stop PTZ movement; goes out ahead of any queued move"""
     try:
-        if camera_id not in ptz_controllers or not ptz_controllers[camera_id]:
-            return jsonify({'error': 'PTZ not available'}), 400
+        controller, error_response = get_ptz_controller(camera_id)
+        if error_response:
+            return error_response
 
-        ptz_controllers[camera_id].stop()
-        return jsonify({'status': 'success'})
+        seq = ptz_pool.dispatcher(camera_id).submit('stop')
+        return jsonify({'status': 'queued', 'seq': seq}), 202
     except Exception as e:
         logger.error(f"PTZ stop error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/ptz/<int:camera_id>/metrics', methods=['GET'])
+def ptz_metrics(camera_id):
+    """PTZ command counts and request-to-camera latency"""
+    if not ptz_pool.is_configured(camera_id):
+        return jsonify({'error': 'PTZ not available for this camera'}), 400
+    return jsonify(ptz_pool.dispatcher(camera_id).stats())
+
 @app.route('/ptz/<int:camera_id>/status', methods=['GET'])
 def ptz_status(camera_id):
-    """Get PTZ status"""
+    """Get PTZ status from the background poller's cache, with its age in seconds"""
     try:
-        if camera_id not in ptz_controllers or not ptz_controllers[camera_id]:
-            return jsonify({'error': 'PTZ not available'}), 400
+        if not ptz_pool.is_configured(camera_id):
+            return jsonify({'error': 'PTZ not available for this camera'}), 400
 
-        status = ptz_controllers[camera_id].get_status()
-        return jsonify(status)
+        snapshot = ptz_pool.status_poller(camera_id).read()
+        if snapshot['status'] is None:
+            return jsonify({'error': snapshot['error'] or 'PTZ status not available yet'}), 503
+        return jsonify(snapshot)
     except Exception as e:
         logger.error(f"PTZ status error: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -225,15 +474,7 @@ def ptz_status(camera_id):
 @app.route('/settings/current', methods=['GET'])
 def get_current_settings():
     try:
-        # Get settings from your storage (database/file/etc)
-        settings = {
-            'recordLength': 10,  # default values
-            'fileSize': 100,
-            'autoRecord': False,
-            'quality': 'high',
-            'fps': 30
-        }
-        return jsonify(settings)
+        return jsonify(recording_settings)
     except Exception as e:
         logger.error(f"Error getting settings: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -242,102 +483,227 @@ def get_current_settings():
 @login_required
 def update_settings():
     try:
-        settings = request.get_json()
-        # Validate settings
-        if not all(key in settings for key in ['recordLength', 'fileSize', 'autoRecord', 'quality', 'fps']):
-            return jsonify({'error': 'Missing required settings'}), 400
-            
-        # Save settings to your storage (database/file/etc)
-        # For now, just log them
+        try:
+            settings = validate_settings(request.get_json())
+        except ValidationError as e:
+            return jsonify({'error': e.messages}), 400
+
+        recording_settings.update(settings)
+        save_settings(recording_settings)
+        # New segment limits apply to recordings already in progress
+        for recorder in camera_recorders.values():
+            recorder.apply_settings(recording_settings)
+        apply_auto_record()
         logger.info(f"Updated settings: {settings}")
         return jsonify({'status': 'success'})
     except Exception as e:
         logger.error(f"Error updating settings: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def parse_time_param(name):
+    """
+    :return: Timestamp from a query parameter given as epoch seconds or ISO 8601, or None
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value}")
+
 @app.route('/recordings')
 def list_recordings():
-    """Endpoint to list recorded videos."""
+    """
+    Endpoint to list recorded videos, newest first, one page at a time.
+    Query parameters: camera, start, end (epoch seconds or ISO 8601),
+    sort ('date' or 'size'), order ('asc' or 'desc'), limit and cursor
+    (the ``next_cursor`` of the previous page).
+    """
+    try:
+        page = recordings_index.query(
+            camera_id=request.args.get('camera', type=int),
+            start=parse_time_param('start'),
+            end=parse_time_param('end'),
+            sort=request.args.get('sort', 'date'),
+            order=request.args.get('order', 'desc'),
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     try:
-        recordings = []
-        for filename in os.listdir(RECORDINGS_DIR):
-            if filename.endswith('.mp4'):
-                file_path = os.path.join(RECORDINGS_DIR, filename)
-                file_stats = os.stat(file_path)
-                recordings.append({
-                    'name': filename,
-                    'size': file_stats.st_size,
-                    'date': datetime.fromtimestamp(file_stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
-                    'url': url_for('static', filename=f'recordings/{filename}')
-                })
-        return jsonify({'recordings': recordings}), 200
+        recordings = [{
+            'name': row['filename'],
+            'camera_id': row['camera_id'],
+            'size': row['size'],
+            'original_size': row['original_size'],
+            'state': row['state'],
+            'keep': bool(row['keep']),
+            'date': datetime.fromtimestamp(row['started_at']).strftime('%Y-%m-%d %H:%M:%S'),
+            'duration': round(row['ended_at'] - row['started_at'], 1) if row['ended_at'] else None,
+            'url': url_for('serve_recording', filename=row['filename']),
+            'thumbnail_url': url_for('serve_preview', name=row['thumbnail']) if row['thumbnail'] else None,
+            'sprite': {
+                'url': url_for('serve_preview', name=row['sprite']),
+                'interval': row['sprite_interval'],
+                'columns': row['sprite_columns'],
+                'count': row['sprite_count']
+            } if row['sprite'] else None
+        } for row in page['recordings']]
+        return jsonify({
+            'recordings': recordings,
+            'total': page['total'],
+            'total_size': page['total_size'],
+            'next_cursor': page['next_cursor']
+        }), 200
     except Exception as e:
         logger.error(f"Error listing recordings: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def send_recording(filename, as_attachment=False):
+    """
+    Serve a recording with byte ranges, ETag / Last-Modified validation and
+    If-Range, so the player can seek without downloading the whole file
+    :param filename: Path relative to RECORDINGS_DIR
+    :param as_attachment: Ask the browser to save the file instead of playing it
+    """
+    if RECORDINGS_ACCEL_REDIRECT:
+        path = safe_join(RECORDINGS_DIR, filename)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+        # nginx answers the range and conditional headers itself
+        response = Response(mimetype='video/mp4')
+        response.headers['X-Accel-Redirect'] = f"{RECORDINGS_ACCEL_REDIRECT.rstrip('/')}/{filename}"
+        if as_attachment:
+            response.headers.set('Content-Disposition', 'attachment', filename=os.path.basename(filename))
+        return response
+    # Flask 2.0 only sends an ETag when asked to explicitly
+    response = send_from_directory(
+        RECORDINGS_DIR,
+        filename,
+        as_attachment=as_attachment,
+        download_name=os.path.basename(filename),
+        conditional=True,
+        etag=True
+    )
+    # Werkzeug only advertises ranges on 206s; players look for it on the first response
+    response.headers.setdefault('Accept-Ranges', 'bytes')
+    return response
+
+@app.route('/api/recordings/compression')
+@login_required
+def compression_status():
+    """Recordings per compression state and the space compression has saved"""
+    try:
+        return jsonify(compressor.status())
+    except Exception as e:
+        logger.error(f"Error reading compression status: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/recordings/<path:filename>/keep', methods=['POST'])
+@login_required
+def keep_recording(filename):
+    """Protect a recording from retention, or release it with {'keep': false}"""
+    try:
+        keep = bool((request.get_json(silent=True) or {}).get('keep', True))
+        if not recordings_index.set_keep(filename, keep):
+            return jsonify({'error': 'Recording not found'}), 404
+        return jsonify({'status': 'success', 'name': filename, 'keep': keep})
+    except Exception as e:
+        logger.error(f"Error updating recording {filename}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/storage')
+@login_required
+def storage_status():
+    """Recording storage use per camera, quotas, and projected days until full"""
+    try:
+        return jsonify(retention.report())
+    except Exception as e:
+        logger.error(f"Error reading storage usage: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/previews/<name>')
+@login_required
+def serve_preview(name):
+    """Serve a recording thumbnail or sprite sheet from the preview cache"""
+    path = previews.path_for(name)
+    if path is None:
+        return jsonify({'error': 'Preview not found'}), 404
+    try:
+        response = send_from_directory(os.path.dirname(path), name, max_age=PREVIEW_MAX_AGE, etag=True)
+    except NotFound as e:
+        return jsonify({'error': str(e)}), 404
+    # Content-addressed: a changed image gets a new name, so never revalidate
+    response.cache_control.public = None
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/recordings/<path:filename>')
 def serve_recording(filename):
     """Serve a recorded video file."""
     try:
-        return send_from_directory(RECORDINGS_DIR, filename)
-    except Exception as e:
+        return send_recording(filename)
+    except NotFound as e:
         logger.error(f"Error serving recording {filename}: {str(e)}")
         return jsonify({'error': str(e)}), 404
 
-class CameraRecorder:
-    def __init__(self, camera_id, settings):
-        self.camera_id = camera_id
-        self.settings = settings
-        self.is_recording = False
-        self.current_recording = None
-        self.recording_thread = None
-
-    def start_recording(self):
-        if not self.is_recording:
-            timestamp = time.strftime("%Y%m%d-%H%M%S")
-            filename = f"camera_{self.camera_id}_{timestamp}.mp4"
-            filepath = os.path.join(RECORDINGS_DIR, filename)
-            self.current_recording = filename
-            self.is_recording = True
-            self.recording_thread = Thread(target=self._record_video, args=(filepath,))
-            self.recording_thread.start()
-            return {'status': 'started', 'filename': filename}
-        return {'status': 'already_recording', 'filename': self.current_recording}
-
-    def stop_recording(self):
-        if self.is_recording:
-            self.is_recording = False
-            if self.recording_thread:
-                self.recording_thread.join()
-            return {'status': 'stopped', 'filename': self.current_recording}
-        return {'status': 'not_recording'}
-
-    def _record_video(self, filepath):
-        try:
-            cap = cv2.VideoCapture(self.settings['url'])
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = None
-            
-            while self.is_recording:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                    
-                if out is None:
-                    height, width = frame.shape[:2]
-                    out = cv2.VideoWriter(filepath, fourcc, 20.0, (width, height))
-                    
-                out.write(frame)
-                
-        except Exception as e:
-            logger.error(f"Recording error for camera {self.camera_id}: {str(e)}")
-        finally:
-            if out:
-                out.release()
-            if cap:
-                cap.release()
-
 camera_recorders = {}
+motion_monitors = {}
+
+def index_recording_start(camera_id, filepath):
+    """Called by the recorders as each segment is opened"""
+    try:
+        recordings_index.add_recording(filepath, camera_id)
+    except Exception as e:
+        logger.error(f"Error indexing recording {filepath}: {str(e)}")
+
+def index_recording(camera_id, filepath):
+    """Called by the recorders as each segment is finalized"""
+    try:
+        recordings_index.add_file(filepath, camera_id)
+        compressor.wake()
+        retention.wake()
+        previews.wake()
+    except Exception as e:
+        logger.error(f"Error indexing recording {filepath}: {str(e)}")
+
+def get_recorder(camera_id, camera_settings):
+    if camera_id not in camera_recorders:
+        camera_recorders[camera_id] = CameraRecorder(
+            camera_id, camera_settings, recording_settings,
+            on_segment=index_recording, on_segment_start=index_recording_start
+        )
+    return camera_recorders[camera_id]
+
+def apply_auto_record():
+    """Start or stop motion-triggered recording to match the autoRecord setting"""
+    if recording_settings['autoRecord']:
+        for camera_id, camera in enumerate(load_camera_settings()):
+            if camera_id in motion_monitors:
+                continue
+            recorder = get_recorder(camera_id, camera)
+
+            def on_motion_stop(recorder=recorder):
+                # Leave recordings that someone started by hand running
+                if recorder.trigger == 'motion':
+                    recorder.stop_recording()
+
+            motion_monitors[camera_id] = MotionMonitor(
+                get_hub(camera_id, camera),
+                on_start=lambda recorder=recorder: recorder.start_recording(trigger='motion'),
+                on_stop=on_motion_stop
+            ).start()
+    else:
+        for camera_id, monitor in list(motion_monitors.items()):
+            monitor.stop()
+            del motion_monitors[camera_id]
 
 @app.route('/camera/<int:camera_id>/record/start', methods=['POST'])
 def start_recording(camera_id):
@@ -346,10 +712,7 @@ def start_recording(camera_id):
         if camera_id >= len(camera_settings):
             return jsonify({'error': 'Camera not found'}), 404
 
-        if camera_id not in camera_recorders:
-            camera_recorders[camera_id] = CameraRecorder(camera_id, camera_settings[camera_id])
-
-        result = camera_recorders[camera_id].start_recording()
+        result = get_recorder(camera_id, camera_settings[camera_id]).start_recording()
         return jsonify(result)
     except Exception as e:
         logger.error(f"Failed to start recording: {str(e)}")
@@ -372,12 +735,31 @@ def recording_status(camera_id):
     if camera_id in camera_recorders:
         return jsonify({
             'is_recording': camera_recorders[camera_id].is_recording,
-            'current_recording': camera_recorders[camera_id].current_recording
+            'current_recording': camera_recorders[camera_id].current_recording,
+            'trigger': camera_recorders[camera_id].trigger,
+            'motion': camera_id in motion_monitors and motion_monitors[camera_id].is_moving
         })
-    return jsonify({'is_recording': False, 'current_recording': None})
+    return jsonify({'is_recording': False, 'current_recording': None, 'trigger': None, 'motion': False})
+
+def start_background_services():
+    """Start the capture and motion work that runs without any viewer attached"""
+    camera_config.add_listener(apply_camera_config)
+    # Pick up recordings made or deleted while the server was down
+    Thread(target=recordings_index.sync_directory, args=(RECORDINGS_DIR,),
+           name='recordings-index-sync', daemon=True).start()
+    if COMPRESSION_ENABLED:
+        compressor.start()
+    retention.start()
+    previews.start()
+    ptz_pool.prewarm(load_camera_settings())
+    start_always_on_cameras()
+    apply_auto_record()
 
 @app.errorhandler(Exception)
 def handle_error(error):
+    if isinstance(error, HTTPException):
+        # 304, 404, 416 and the like are answers, not failures
+        return error
     logger.error(f"Unhandled error: {str(error)}", exc_info=True)
     return jsonify({'error': str(error)}), 500
 
@@ -392,28 +774,24 @@ def settings():
 def download_recording(filename):
     """Download a specific recording."""
     try:
-        return send_from_directory(
-            RECORDINGS_DIR, 
-            filename,
-            as_attachment=True,
-            attachment_filename=filename
-        )
-    except Exception as e:
+        return send_recording(filename, as_attachment=True)
+    except NotFound as e:
         logger.error(f"Error downloading recording {filename}: {str(e)}")
         return jsonify({'error': str(e)}), 404
 
 if __name__ == "__main__":
     try:
         logger.info("Starting web camera stream server...")
+        start_background_services()
         ssl_context = (
             os.environ.get('SSL_CERT_PATH', 'certs/cert.pem'),
             os.environ.get('SSL_KEY_PATH', 'certs/key.pem')
         )
-        app.run(
+        socketio.run(
+            app,
             host='0.0.0.0',
             port=443,
-            ssl_context=ssl_context,
-            threaded=True
+            ssl_context=ssl_context
         )
     except Exception as e:
         logger.error(f"Failed to start server: {str(e)}", exc_info=True)